@@ -2,6 +2,7 @@ from django.db.models import Count, Avg, Q, F, Sum
 from django.utils import timezone
 from datetime import timedelta, datetime
 from .models import Token, Doctor, Clinic, Consultation, Patient
+from .time_buckets import filter_tokens, hourly_counts
 import json
 
 class AdvancedReports:
@@ -112,18 +113,7 @@ class AdvancedReports:
     @staticmethod
     def _analyze_peak_hours(clinic_id, start_date, end_date):
         """Analyze peak hours for the clinic"""
-        hourly_data = {}
-        
-        tokens = Token.objects.filter(
-            clinic_id=clinic_id,
-            date__range=[start_date, end_date]
-        )
-        
-        for token in tokens:
-            hour = token.created_at.hour
-            if hour not in hourly_data:
-                hourly_data[hour] = 0
-            hourly_data[hour] += 1
+        hourly_data = hourly_counts(filter_tokens(clinic_id=clinic_id, start_date=start_date, end_date=end_date))
         
         # Convert to list and sort by patient count
         peak_hours = [
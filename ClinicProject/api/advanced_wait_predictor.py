@@ -1,7 +1,11 @@
 from django.utils import timezone
-from django.db.models import Avg, Count, Q
+from django.db.models import Avg, Count
 from .models import Token, Doctor
 from .waiting_time_predictor import waiting_time_predictor
+from .service_time_stats import ServiceTimeStats
+from .queue_simulator import QueueSimulator
+from .queue_state import queue_state
+from .queue_ranks import ranked_tokens
 import logging
 from datetime import datetime, timedelta
 import numpy as np
@@ -18,13 +22,21 @@ class AdvancedWaitPredictor:
         """Get predicted wait time for a pre-booked token"""
         try:
             token = Token.objects.get(id=token_id)
-            
+            return self._predict_for_token(token)
+        except Exception as e:
+            logger.error(f"Error predicting wait time for token {token_id}: {e}")
+            return 15  # Default fallback
+    
+    def _predict_for_token(self, token, ml_prediction=None):
+        """Wait time for a loaded token; ml_prediction may be supplied from a batch"""
+        try:
             # Only for pre-booked appointments (created 1+ days ago)
             if not self._is_prebooked_appointment(token):
                 return self._get_current_queue_wait_time(token)
             
             # Combine ML prediction with real-time flow analysis
-            ml_prediction = self._get_ml_prediction(token)
+            if ml_prediction is None:
+                ml_prediction = self._get_ml_prediction(token)
             flow_adjustment = self._get_realtime_flow_adjustment(token)
             
             # Weighted combination: 60% ML, 40% real-time flow
@@ -33,7 +45,7 @@ class AdvancedWaitPredictor:
             return max(0, int(final_prediction))
             
         except Exception as e:
-            logger.error(f"Error predicting wait time for token {token_id}: {e}")
+            logger.error(f"Error predicting wait time for token {token.id}: {e}")
             return 15  # Default fallback
     
     def _is_prebooked_appointment(self, token):
@@ -101,71 +113,34 @@ class AdvancedWaitPredictor:
     
     def _calculate_queue_impact(self, token):
         """Calculate impact of current queue on wait time"""
-        # Count tokens ahead in queue for same doctor
-        tokens_ahead = Token.objects.filter(
-            doctor=token.doctor,
-            date=token.date,
-            appointment_time__lt=token.appointment_time,
-            status__in=['confirmed', 'in_progress']
-        ).count()
-        
-        # Count current in-progress consultations
-        in_progress = Token.objects.filter(
-            doctor=token.doctor,
-            date=token.date,
-            status='in_progress'
-        ).count()
-        
-        # Estimate 15 minutes per consultation + 5 minutes buffer
-        queue_impact = (tokens_ahead * 15) + (in_progress * 10)
+        # Simulated minutes until this token's consultation starts
+        forecast = QueueSimulator.forecast_by_token([token.doctor_id]).get(token.id)
+        if forecast is None:
+            return 0  # Not waiting in today's queue
         
-        return queue_impact
+        return forecast['expected_minutes']
     
     def _get_historical_baseline(self, token):
         """Get historical baseline for similar appointments"""
-        # Look at same doctor, same time slot, last 30 days
-        historical_tokens = Token.objects.filter(
-            doctor=token.doctor,
-            appointment_time__range=(
-                (datetime.combine(timezone.now().date(), token.appointment_time) - timedelta(minutes=30)).time(),
-                (datetime.combine(timezone.now().date(), token.appointment_time) + timedelta(minutes=30)).time()
-            ),
-            date__gte=timezone.now().date() - timedelta(days=30),
-            status='completed',
-            completed_at__isnull=False
-        )
+        # Same doctor, same appointment hour, from the service-time rollup
+        stats = ServiceTimeStats.summary(token.doctor_id, hour=token.appointment_time.hour)
         
-        if not historical_tokens.exists():
+        if not stats['count']:
             return 15  # Default baseline
         
-        # Calculate average historical delay
-        delays = []
-        for hist_token in historical_tokens:
-            expected = datetime.combine(hist_token.date, hist_token.appointment_time)
-            if expected.tzinfo is None:
-                expected = timezone.make_aware(expected)
-            actual = hist_token.completed_at
-            delay = (actual - expected).total_seconds() / 60
-            delays.append(delay)
-        
-        return max(0, np.mean(delays)) if delays else 15
+        return max(0, stats['mean'])
     
     def _get_current_queue_wait_time(self, token):
         """For same-day appointments, use simple queue-based calculation"""
         if token.status == 'in_consultancy':
             return 0  # Currently being seen
         
-        # Count tokens ahead in queue
-        from django.db import models
-        tokens_ahead = Token.objects.filter(
-            doctor=token.doctor,
-            date=token.date,
-            status__in=['confirmed', 'in_consultancy']
-        ).filter(
-            models.Q(appointment_time__lt=token.appointment_time) |
-            models.Q(appointment_time=token.appointment_time, created_at__lt=token.created_at) |
-            models.Q(appointment_time__isnull=True, created_at__lt=token.created_at)
-        ).count()
+        # Count tokens ahead in queue; tokens from ranked_tokens() already carry their rank
+        queue_rank = getattr(token, 'queue_rank', None)
+        if queue_rank is not None:
+            tokens_ahead = queue_rank - 1
+        else:
+            tokens_ahead = queue_state.patients_ahead(token, ('confirmed', 'in_consultancy'))
         
         if tokens_ahead == 0:
             return 5  # Next in queue
@@ -177,16 +152,27 @@ class AdvancedWaitPredictor:
         today = timezone.now().date()
         current_time = timezone.now()
         
-        # Base query
-        query = Q(date=today, status__in=['confirmed', 'in_progress'])
-        if doctor_id:
-            query &= Q(doctor_id=doctor_id)
+        # Rank confirmed tokens behind the patients being seen, for every doctor in one query
+        ranked = ranked_tokens(today, [doctor_id] if doctor_id else None, ('in_consultancy', 'confirmed'))
+        upcoming_tokens = [
+            token for token in ranked.select_related('patient', 'doctor').order_by('appointment_time')
+            if token.status == 'confirmed'
+        ]
         
-        upcoming_tokens = Token.objects.filter(query).order_by('appointment_time')
+        # One batched ML call for every pre-booked token on the board
+        prebooked = [token for token in upcoming_tokens if self._is_prebooked_appointment(token)]
+        try:
+            ml_predictions = dict(zip(
+                [token.id for token in prebooked],
+                self.ml_predictor.predict_many([(token.doctor_id, token.appointment_time) for token in prebooked])
+            ))
+        except Exception as e:
+            logger.error(f"ML prediction error: {e}")
+            ml_predictions = {}
         
         live_data = []
         for token in upcoming_tokens:
-            predicted_wait = self.get_predicted_wait_time(token.id)
+            predicted_wait = self._predict_for_token(token, ml_predictions.get(token.id))
             
             # Calculate expected completion time
             expected_start = datetime.combine(token.date, token.appointment_time)
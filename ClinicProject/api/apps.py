@@ -8,3 +8,12 @@ class ApiConfig(AppConfig):
     def ready(self):
         # Import signals to enable automatic training triggers
         import api.auto_training_triggers
+        # Keep doctor slot occupancy bitmaps in sync with token changes
+        import api.slot_occupancy
+        # Keep the per-doctor service-time rollup in sync with completions
+        import api.service_time_stats
+        # Bump queue/patient/schedule versions (prediction cache, ETags) on token deletes and schedule changes
+        import api.prediction_cache
+        api.prediction_cache.warn_if_cache_is_local()
+        # Broadcast coalesced queue updates to WebSocket clients after token changes commit
+        import api.queue_update_signals
@@ -2,8 +2,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from .models import Token
-from .waiting_time_predictor import waiting_time_predictor
-from django_q.tasks import async_task
+from .training_jobs import TrainingJobRunner
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,10 +28,7 @@ def trigger_model_retraining(sender, instance, created, **kwargs):
         
         if recent_completions >= 5:
             logger.info(f"Triggering automatic model retraining: {recent_completions} new completions")
-            async_task(
-                'api.tasks_ml.train_waiting_time_model',
-                hook='api.auto_training_triggers.training_completed_hook'
-            )
+            TrainingJobRunner.submit(trigger='auto')
             last_training_trigger = now
         else:
             logger.info(f"Not enough new data for retraining: {recent_completions} completions")
@@ -46,18 +42,9 @@ def training_completed_hook(task):
 class AutoTrainingManager:
     @staticmethod
     def force_retrain_all_data():
+        """Queue a full retrain in the background; returns (job, created)"""
         logger.info("Force retraining with ALL consultation data")
-        try:
-            success = waiting_time_predictor.train_model()
-            if success:
-                logger.info("Force retraining completed successfully")
-                return True
-            else:
-                logger.error("Force retraining failed")
-                return False
-        except Exception as e:
-            logger.error(f"Force retraining error: {e}")
-            return False
+        return TrainingJobRunner.submit(trigger='force_all_data')
     
     @staticmethod
     def get_training_stats():
@@ -94,7 +81,8 @@ def conditional_training_task():
     
     if new_data >= 3:
         logger.info(f"Conditional training triggered: {new_data} new consultations")
-        return waiting_time_predictor.train_model()
+        job, ran = TrainingJobRunner.run_now(trigger='conditional')
+        return f"Training job {job.id}: {job.status}" if ran else f"Coalesced into running job {job.id}"
     else:
         logger.info(f"No training needed: only {new_data} new consultations")
         return "No training needed"
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""Historical replay of waiting time predictions.
+
+Every token creation and arrival in a date range is replayed in time order:
+the doctor's queue is reconstructed as it stood at that instant, the model
+is asked what the live predictor would have been asked, and the answer is
+compared with the token's actual consultation_start_time.
+
+Like model_search, this module has no Django imports at module level. The
+management command loads the tokens and hands each worker one day of plain
+arrays, so days replay independently across processes.
+"""
+import os
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from .forest_engine import FlatForest
+from .model_search import _init_worker
+
+# Token columns of a day shard, all float64 (NaN = missing). Times are epoch seconds.
+DAY_COLUMNS = ('token_id', 'doctor_id', 'created', 'arrival', 'start', 'leave', 'appointment', 'stored_prediction')
+EVENTS = ('created', 'arrival')
+# Sum columns accumulated per (version, event, doctor, local hour)
+SUM_FIELDS = ('count', 'abs_error', 'error', 'squared_error', 'within_10')
+STORED = 'stored'
+
+_models = {}
+
+
+def load_model(paths):
+    """(model, mean, scale) for a version's artifacts; cached per worker process"""
+    key = tuple(sorted(paths.items()))
+    if key not in _models:
+        import joblib
+        if FlatForest.exists(paths['forest']):
+            model = FlatForest.load(paths['forest'])
+        else:
+            model = joblib.load(paths['model'])
+        scaler = joblib.load(paths['scaler'])
+        _models[key] = (model, scaler)
+    return _models[key]
+
+
+def predict(paths, features):
+    model, scaler = load_model(paths)
+    mean = getattr(scaler, 'mean_', None)
+    scale = getattr(scaler, 'scale_', None)
+    scaled = (features - mean) / scale if mean is not None and scale is not None else scaler.transform(features)
+    # Same clipping and rounding as the live predictor
+    return np.round(np.clip(model.predict(scaled), 0, 120))
+
+
+def queue_events(day):
+    """Replay one day; returns the feature matrix and per-event metadata.
+
+    A token is in its doctor's queue at time t when it was created by t and
+    has not started (or finished) yet. The token being predicted is left out
+    at its creation, since the live prediction is made before the booking
+    exists, and counted at its arrival, when the live predictor already sees
+    it waiting. Only tokens whose consultation actually started are scored.
+    """
+    created, leave, appointment = day['created'], day['leave'], day['appointment']
+    features, meta = [], defaultdict(list)
+    for doctor_id in np.unique(day['doctor_id']):
+        members = np.flatnonzero(day['doctor_id'] == doctor_id)
+        for event in EVENTS:
+            times = day[event][members]
+            scored = members[~np.isnan(times) & ~np.isnan(day['start'][members])]
+            if not len(scored):
+                continue
+            at = day[event][scored][:, None]
+            others = members[None, :] != scored[:, None]
+            seen = (created[members][None, :] <= at) & (others | (event == 'arrival'))
+            active = seen & (leave[members][None, :] > at)
+            own_appointment = appointment[scored][:, None]
+            ahead = active & (appointment[members][None, :] < own_appointment)
+            position = np.where(
+                np.isnan(own_appointment[:, 0]),
+                active.sum(axis=1),
+                ahead.sum(axis=1),
+            ) + 1
+
+            at = at[:, 0]
+            features.append(np.column_stack([
+                (at // 3600) % 24,  # UTC, like timezone.now().hour in the live predictor
+                (at // 86400 + 3) % 7,  # 1970-01-01 was a Thursday
+                seen.sum(axis=1),
+                position,
+                np.full(len(scored), doctor_id),
+            ]))
+            meta['event'].extend([event] * len(scored))
+            meta['doctor_id'].append(np.full(len(scored), doctor_id))
+            meta['local_hour'].append(((at + day['utc_offset']) // 3600) % 24)
+            meta['actual'].append(np.maximum(0, (day['start'][scored] - at) / 60))
+            meta['stored'].append(
+                day['stored_prediction'][scored] if event == 'arrival' else np.full(len(scored), np.nan)
+            )
+
+    if not features:
+        return None, None
+    meta = {
+        name: np.asarray(values) if name == 'event' else np.concatenate(values)
+        for name, values in meta.items()
+    }
+    return np.vstack(features), meta
+
+
+def replay_day(day, models):
+    """Score every model on one day; returns {(version, event, doctor, hour): sums}"""
+    features, meta = queue_events(day)
+    sums = {}
+    if features is None:
+        return sums
+
+    predictions = {version: predict(paths, features) for version, paths in models.items()}
+    stored = ~np.isnan(meta['stored'])
+    if stored.any():
+        predictions[STORED] = np.where(stored, meta['stored'], np.nan)
+
+    for version, predicted in predictions.items():
+        error = predicted - meta['actual']
+        valid = ~np.isnan(error)
+        for event in EVENTS:
+            for doctor_id in np.unique(meta['doctor_id']):
+                for hour in np.unique(meta['local_hour']):
+                    mask = (
+                        valid & (meta['event'] == event)
+                        & (meta['doctor_id'] == doctor_id) & (meta['local_hour'] == hour)
+                    )
+                    if not mask.any():
+                        continue
+                    e = error[mask]
+                    sums[(version, event, int(doctor_id), int(hour))] = np.array([
+                        len(e), np.abs(e).sum(), e.sum(), (e ** 2).sum(), (np.abs(e) <= 10).sum(),
+                    ], dtype=float)
+    return sums
+
+
+def _metrics(totals):
+    count, abs_error, error, squared_error, within_10 = totals
+    return {
+        'count': int(count),
+        'mae': round(abs_error / count, 2),
+        'bias': round(error / count, 2),
+        'rmse': round(float(np.sqrt(squared_error / count)), 2),
+        'within_10_min': round(within_10 / count, 3),
+    }
+
+
+def summarize(sums):
+    """Roll the per-(version, event, doctor, hour) sums up into the report"""
+    groups = {
+        'overall': lambda version, event, doctor, hour: (),
+        'by_event': lambda version, event, doctor, hour: (event,),
+        'by_doctor': lambda version, event, doctor, hour: (doctor,),
+        'by_hour': lambda version, event, doctor, hour: (hour,),
+        'by_doctor_hour': lambda version, event, doctor, hour: (doctor, hour),
+    }
+    report = {}
+    for version in sorted({key[0] for key in sums}):
+        rolled = {name: defaultdict(lambda: np.zeros(len(SUM_FIELDS))) for name in groups}
+        for key, values in sums.items():
+            if key[0] != version:
+                continue
+            for name, group in groups.items():
+                rolled[name][group(*key)] += values
+        report[version] = {'overall': _metrics(rolled['overall'][()])}
+        report[version]['by_event'] = {event: _metrics(v) for (event,), v in sorted(rolled['by_event'].items())}
+        report[version]['by_doctor'] = {doctor: _metrics(v) for (doctor,), v in sorted(rolled['by_doctor'].items())}
+        report[version]['by_hour'] = {hour: _metrics(v) for (hour,), v in sorted(rolled['by_hour'].items())}
+        report[version]['by_doctor_hour'] = [
+            dict(_metrics(v), doctor_id=doctor, hour=hour)
+            for (doctor, hour), v in sorted(rolled['by_doctor_hour'].items())
+        ]
+    return report
+
+
+def run_backtest(days, models, workers=None, progress=None):
+    """Replay `days` (a list of day shards) against `models` ({version: artifact paths}).
+
+    Days are independent, so each one is a separate task; with workers <= 1
+    they replay in this process.
+    """
+    totals = defaultdict(lambda: np.zeros(len(SUM_FIELDS)))
+
+    def merge(sums):
+        for key, values in sums.items():
+            totals[key] += values
+
+    workers = min(workers or os.cpu_count() or 1, len(days))
+    if workers <= 1:
+        for done, day in enumerate(days, 1):
+            merge(replay_day(day, models))
+            if progress:
+                progress(done, len(days))
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            futures = [pool.submit(replay_day, day, models) for day in days]
+            for done, future in enumerate(as_completed(futures), 1):
+                merge(future.result())
+                if progress:
+                    progress(done, len(days))
+
+    return summarize(totals)
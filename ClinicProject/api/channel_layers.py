@@ -0,0 +1,47 @@
+import asyncio
+import time
+from copy import deepcopy
+from channels.layers import InMemoryChannelLayer
+
+# Expired messages and group memberships are swept at most this often
+CLEAN_INTERVAL_SECONDS = 1.0
+
+
+class QueueChannelLayer(InMemoryChannelLayer):
+    """In-memory channel layer that stays fast with thousands of sockets in one group.
+
+    The stock layer sweeps every channel and group membership on each receive
+    and group_send, and creates a task and a deep copy per recipient, which
+    makes one broadcast to N sockets cost O(N^2). Here the sweep runs at most
+    once per CLEAN_INTERVAL_SECONDS, and a group message is copied once and
+    queued to every member directly. Receivers share that copy, so consumers
+    must treat group messages as read-only.
+    """
+
+    def __init__(self, *args, clean_interval=CLEAN_INTERVAL_SECONDS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clean_interval = clean_interval
+        self._cleaned_at = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self._cleaned_at < self.clean_interval:
+            return
+        self._cleaned_at = now
+        super()._clean_expired()
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        self._clean_expired()
+
+        expires = time.time() + self.expiry
+        message = deepcopy(message)
+        for channel in list(self.groups.get(group, ())):
+            queue = self.channels.get(channel)
+            if queue is None:
+                queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+            try:
+                queue.put_nowait((expires, message))
+            except asyncio.QueueFull:
+                pass  # Like the stock layer: a full channel just misses this message
@@ -0,0 +1,39 @@
+from django.db.models import Count, Min, Q
+from .models import Token
+from .queue_state import WAITING_STATUSES
+
+STATUSES = [status for status, _ in Token.STATUS_CHOICES]
+
+
+def empty_counts():
+    counts = {status: 0 for status in STATUSES}
+    counts.update(total=0, queue=0, next_appointment=None)
+    return counts
+
+
+def doctor_status_counts(clinic_id, day):
+    """Token counts per doctor and status for a clinic's day, from one grouped query.
+
+    Returns {doctor_id: counts}, where counts has one key per status plus
+    'total', 'queue' (waiting + confirmed) and 'next_appointment' (earliest
+    booked time still in the queue, or None). Doctors without tokens that day
+    are absent; use empty_counts() for them.
+    """
+    aggregates = {status: Count('id', filter=Q(status=status)) for status in STATUSES}
+    rows = Token.objects.filter(clinic_id=clinic_id, date=day).values('doctor_id').annotate(
+        total=Count('id'),
+        queue=Count('id', filter=Q(status__in=WAITING_STATUSES)),
+        next_appointment=Min('appointment_time', filter=Q(status__in=WAITING_STATUSES)),
+        **aggregates,
+    ).order_by()
+    return {row.pop('doctor_id'): row for row in rows}
+
+
+def clinic_totals(counts_by_doctor):
+    """Clinic-wide counts: the per-doctor counts summed"""
+    totals = empty_counts()
+    del totals['next_appointment']
+    for counts in counts_by_doctor.values():
+        for key in totals:
+            totals[key] += counts[key]
+    return totals
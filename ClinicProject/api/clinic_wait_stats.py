@@ -1,6 +1,7 @@
 from django.utils import timezone
 from django.db.models import Avg, Count
 from .models import Token, Doctor, Clinic
+from .service_time_stats import ServiceTimeStats
 from datetime import datetime, timedelta
 import logging
 
@@ -46,30 +47,11 @@ class ClinicWaitStats:
     def get_doctor_avg_wait_time(doctor_id):
         """Get average wait time for specific doctor"""
         try:
-            tokens = Token.objects.filter(
-                doctor_id=doctor_id,
-                status='completed',
-                completed_at__isnull=False,
-                appointment_time__isnull=False,
-                date__gte=timezone.now().date() - timedelta(days=30)
-            )
-            
-            if not tokens.exists():
+            stats = ServiceTimeStats.summary(doctor_id)
+            if not stats['late_count']:
                 return 12  # Default fallback
             
-            total_wait = 0
-            count = 0
-            
-            for token in tokens:
-                expected = timezone.make_aware(datetime.combine(token.date, token.appointment_time))
-                actual = token.completed_at
-                wait_time = (actual - expected).total_seconds() / 60
-                
-                if wait_time >= 0:
-                    total_wait += wait_time
-                    count += 1
-            
-            return int(total_wait / count) if count > 0 else 12
+            return int(stats['late_minutes_sum'] / stats['late_count'])
             
         except Exception as e:
             logger.error(f"Error calculating doctor wait time: {e}")
@@ -2,6 +2,8 @@ from django.utils import timezone
 from datetime import timedelta
 from .models import Token, Patient
 from .utils.utils import send_sms_notification
+from .queue_state import queue_state
+from .queue_ranks import ranked_tokens
 from django_q.tasks import async_task, schedule
 import logging
 
@@ -16,11 +18,8 @@ class CommunicationHub:
         today = timezone.now().date()
         now = timezone.now()
         
-        # Get all active tokens for today
-        active_tokens = Token.objects.filter(
-            date=today,
-            status__in=['waiting', 'confirmed']
-        ).select_related('patient', 'doctor', 'clinic')
+        # Get all active tokens for today, each with its queue position (one query)
+        active_tokens = ranked_tokens(today).select_related('patient', 'doctor', 'clinic')
         
         notifications_sent = 0
         
@@ -76,25 +75,9 @@ class CommunicationHub:
     
     @staticmethod
     def _get_queue_position(token):
-        """Get current queue position for a token"""
-        if token.appointment_time:
-            # For scheduled appointments, count appointments before this time
-            earlier_tokens = Token.objects.filter(
-                doctor=token.doctor,
-                date=token.date,
-                appointment_time__lt=token.appointment_time,
-                status__in=['waiting', 'confirmed']
-            ).count()
-        else:
-            # For walk-ins, count by creation time
-            earlier_tokens = Token.objects.filter(
-                doctor=token.doctor,
-                date=token.date,
-                created_at__lt=token.created_at,
-                status__in=['waiting', 'confirmed']
-            ).count()
-        
-        return earlier_tokens + 1
+        """Get current queue position for a token; tokens from ranked_tokens() already carry it"""
+        queue_rank = getattr(token, 'queue_rank', None)
+        return queue_rank if queue_rank is not None else queue_state.position(token)
     
     @staticmethod
     def _estimate_remaining_wait(token):
@@ -0,0 +1,61 @@
+import asyncio
+from datetime import datetime
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.utils import timezone
+from .queue_update_signals import queue_broadcaster, queue_group_name
+
+
+class QueueConsumer(AsyncJsonWebsocketConsumer):
+    """Live queue of one doctor for one day (today unless the URL names a date).
+
+    Sends a `snapshot` on connect, then `delta` messages as tokens change.
+    A delta applies to the state at `base_version`; when it does not follow
+    the version this socket last received, a fresh snapshot is sent instead.
+    Clients can also ask for one with {"type": "resync"}.
+    """
+
+    async def connect(self):
+        kwargs = self.scope['url_route']['kwargs']
+        try:
+            self.doctor_id = int(kwargs['doctor_id'])
+            self.day = datetime.strptime(kwargs['date'], '%Y-%m-%d').date() if kwargs.get('date') else timezone.localdate()
+        except ValueError:
+            await self.close()
+            return
+        self.version = None
+        self.queue_group_name = queue_group_name(self.doctor_id)
+        queue_broadcaster.attach_loop(asyncio.get_running_loop())
+
+        await self.channel_layer.group_add(self.queue_group_name, self.channel_name)
+        await self.accept()
+        await self.send_snapshot()
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'queue_group_name'):
+            await self.channel_layer.group_discard(self.queue_group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        message_type = content.get('type') if isinstance(content, dict) else None
+        if message_type == 'resync':
+            await self.send_snapshot()
+        elif message_type == 'ping':
+            await self.send_json({'type': 'pong'})
+
+    async def send_snapshot(self):
+        snapshot = await database_sync_to_async(queue_broadcaster.snapshot)(self.doctor_id, self.day)
+        self.version = snapshot['version']
+        await self.send_json(snapshot)
+
+    async def queue_update(self, event):
+        message = event['message']
+        if message['date'] != self.day.isoformat():
+            return
+        if message['type'] == 'delta' and message['base_version'] != self.version:
+            await self.send_snapshot()
+            return
+        self.version = message['version']
+        if 'text' in event:
+            await self.send(text_data=event['text'])
+        else:
+            await self.send_json(message)
@@ -8,6 +8,7 @@ from .real_time_dashboard import RealTimeDashboard
 from .smart_queue_manager import SmartQueueManager
 from .communication_hub import CommunicationHub
 from .advanced_reports import AdvancedReports
+from .time_buckets import filter_tokens, weekday_hour_heatmap
 from .models import Clinic, Doctor
 import logging
 
@@ -261,4 +262,50 @@ class ClinicInsightsView(APIView):
             return user.doctor.clinic.id
         elif hasattr(user, 'receptionist') and user.receptionist.clinic:
             return user.receptionist.clinic.id
-        return None
\ No newline at end of file
+        return None
+class ClinicHeatmapView(APIView):
+    """Weekday x hour booking heatmap for the user's clinic"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        clinic_id = self._get_user_clinic_id(request.user)
+        
+        if not clinic_id:
+            return Response({'error': 'User not associated with clinic'}, status=status.HTTP_403_FORBIDDEN)
+        
+        # Defaults to the last four weeks, so every weekday is covered four times
+        try:
+            end_date = request.query_params.get('end_date')
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else timezone.now().date()
+            start_date = request.query_params.get('start_date')
+            start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else end_date - timedelta(days=27)
+            doctor_id = request.query_params.get('doctor_id')
+            doctor_id = int(doctor_id) if doctor_id else None
+        except ValueError:
+            return Response({'error': 'Invalid date or doctor_id'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if start_date > end_date:
+            return Response({'error': 'start_date must not be after end_date'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            tokens = filter_tokens(clinic_id=clinic_id, doctor_id=doctor_id, start_date=start_date, end_date=end_date)
+            
+            return Response({
+                'clinic_id': clinic_id,
+                'doctor_id': doctor_id,
+                'start_date': start_date.isoformat(),
+                'end_date': end_date.isoformat(),
+                'heatmap': weekday_hour_heatmap(tokens)
+            })
+            
+        except Exception as e:
+            logger.error(f"Heatmap generation error: {e}")
+            return Response({'error': 'Failed to generate heatmap'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def _get_user_clinic_id(self, user):
+        """Helper to get clinic ID from user"""
+        if hasattr(user, 'doctor') and user.doctor.clinic:
+            return user.doctor.clinic.id
+        elif hasattr(user, 'receptionist') and user.receptionist.clinic:
+            return user.receptionist.clinic.id
+        return None
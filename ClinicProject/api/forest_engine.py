@@ -0,0 +1,131 @@
+import json
+import os
+import numpy as np
+
+FORMAT_VERSION = 1
+ARRAY_NAMES = ('feature', 'threshold', 'children', 'value', 'roots')
+META_FILE = 'forest.json'
+
+
+class FlatForest:
+    """A trained regression forest flattened into a few contiguous NumPy arrays.
+
+    Node i of the combined forest splits on `feature[i]` at `threshold[i]` and
+    continues to `children[i, 0]` (x <= threshold) or `children[i, 1]`;
+    `roots[t]` is tree t's first node.
+    Leaves point at themselves, so every tree can be walked for a fixed
+    `max_depth` steps with all rows and trees advanced together. The arrays
+    are stored as plain .npy files, which lets each worker memory-map them and
+    share the pages instead of unpickling its own copy of the forest.
+
+    Predictions are identical to sklearn's RandomForestRegressor.predict with
+    n_jobs=1 (X is compared in float32, like sklearn, and the trees are summed
+    in the same order).
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @staticmethod
+    def supports(model):
+        """Whether `model` is a fitted single-output averaging forest (random/extra trees)"""
+        from sklearn.ensemble._forest import ForestRegressor
+        if not isinstance(model, ForestRegressor):
+            # e.g. gradient boosting: its estimators_ is a 2-D array of trees whose sum is not the mean
+            return False
+        estimators = getattr(model, 'estimators_', None)
+        return bool(estimators) and all(hasattr(e, 'tree_') for e in estimators) and model.n_outputs_ == 1
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted single-output sklearn forest regressor"""
+        if not cls.supports(model):
+            raise ValueError(f"Cannot flatten {type(model).__name__}: not a fitted single-output tree ensemble")
+
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count, dtype=np.int32) + offset
+            is_leaf = tree.children_left == -1
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            children.append(np.column_stack([
+                np.where(is_leaf, node_ids, tree.children_left + offset),
+                np.where(is_leaf, node_ids, tree.children_right + offset),
+            ]).astype(np.int32))
+            values.append(tree.value[:, 0, 0])
+            roots.append(offset)
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.concatenate(children),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            n_features=model.n_features_in_,
+        )
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({
+                'format': FORMAT_VERSION,
+                'max_depth': self.max_depth,
+                'n_features': self.n_features_in_,
+                'n_trees': self.n_trees,
+                'n_nodes': self.n_nodes,
+            }, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported flat forest format {meta.get('format')} in {directory}")
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(max_depth=meta['max_depth'], n_features=meta['n_features'], **arrays)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.isfile(os.path.join(directory, META_FILE))
+
+    def predict_per_tree(self, X):
+        """(n_trees, n_rows) matrix of per-tree predictions"""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected X with {self.n_features_in_} columns, got shape {X.shape}")
+        # Index into the flattened X and children arrays; cheaper than 2-D fancy indexing
+        row_offsets = np.arange(X.shape[0])[:, None] * X.shape[1]
+        flat_X = X.ravel()
+        flat_children = self.children.reshape(-1)
+        nodes = np.broadcast_to(np.asarray(self.roots), (X.shape[0], self.n_trees))
+        for _ in range(self.max_depth):
+            go_right = flat_X[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = flat_children[nodes * 2 + go_right]
+        return np.asarray(self.value[nodes]).T
+
+    def predict(self, X):
+        per_tree = self.predict_per_tree(X)
+        # Accumulate tree by tree, like sklearn, so the sums round identically
+        return np.cumsum(per_tree, axis=0)[-1] / self.n_trees
@@ -6,6 +6,7 @@ from django.db.models import Q
 from django.db import models
 from .models import Token, Doctor
 from .advanced_wait_predictor import advanced_wait_predictor
+from .queue_state import queue_state
 from .serializers import TokenSerializer
 import logging
 
@@ -49,16 +50,8 @@ class TokenWaitTimeView(APIView):
             if token.status == 'in_consultancy':
                 queue_position = 0  # Currently being seen
             else:
-                # Count confirmed tokens with earlier appointment times or creation times
-                tokens_ahead = Token.objects.filter(
-                    doctor=token.doctor,
-                    date=token.date,
-                    status__in=['confirmed', 'in_consultancy']
-                ).filter(
-                    models.Q(appointment_time__lt=token.appointment_time) |
-                    models.Q(appointment_time=token.appointment_time, created_at__lt=token.created_at) |
-                    models.Q(appointment_time__isnull=True, created_at__lt=token.created_at)
-                ).count()
+                # Count confirmed tokens ahead of it in the queue order
+                tokens_ahead = queue_state.patients_ahead(token, ('confirmed', 'in_consultancy'))
                 queue_position = tokens_ahead + 1
             
             return Response({
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Patient
+from api.utils.utils import normalize_phone_number
+
+
+class Command(BaseCommand):
+    help = "Populate Patient.normalized_phone for existing rows, streaming in primary-key chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows read and written per batch")
+        parser.add_argument("--force", action="store_true", help="Recompute rows that already have a value")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options["chunk_size"])
+        queryset = Patient.objects.order_by("pk")
+        if not options["force"]:
+            queryset = queryset.filter(normalized_phone="")
+
+        last_pk = 0
+        scanned = 0
+        updated = 0
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list("pk", "phone_number", "normalized_phone")[:chunk_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            scanned += len(rows)
+
+            changed = []
+            for pk, phone_number, current in rows:
+                normalized = normalize_phone_number(phone_number) or ""
+                if normalized != current:
+                    changed.append(Patient(pk=pk, normalized_phone=normalized))
+            if changed:
+                # bulk_update skips Patient.save(), so only normalized_phone is written
+                Patient.objects.bulk_update(changed, ["normalized_phone"])
+                updated += len(changed)
+            self.stdout.write(f"Processed {scanned} patients (up to id {last_pk}), updated {updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfill complete: {updated} of {scanned} patients updated."))
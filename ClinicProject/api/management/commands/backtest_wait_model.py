@@ -0,0 +1,120 @@
+import json
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.backtester import DAY_COLUMNS, run_backtest
+from api.model_registry import FOREST_DIR, MODEL_FILE, SCALER_FILE, model_registry
+from api.models import Token
+from api.waiting_time_predictor import ACTIVE_QUEUE_STATUSES, FEATURE_SPEC
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay token creations and arrivals over a date range, predict each with one or more '
+        'registered model versions and compare with the actual consultation start times'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day, YYYY-MM-DD (default: 7 days ago)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day, YYYY-MM-DD (default: yesterday)')
+        parser.add_argument('--model-version', action='append', dest='versions',
+                            help='Registry version to replay; repeat to compare versions (default: current)')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+        parser.add_argument('--report', help='Also write the full per-doctor/hour results to this JSON file')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = options['start'] or today - timedelta(days=7)
+        end = options['end'] or today - timedelta(days=1)
+        if end < start:
+            raise CommandError('--end is before --start')
+
+        models = self._model_paths(options['versions'] or [model_registry.current_version()])
+        started = time.monotonic()
+        days = self._load_days(start, end)
+        if not days:
+            raise CommandError(f'No tokens between {start} and {end}')
+        self.stdout.write(f"Replaying {len(days)} day(s) from {start} to {end} against {', '.join(models)}")
+
+        def progress(done, total):
+            if done == total or done % max(1, total // 10) == 0:
+                self.stdout.write(f"  {done}/{total} days replayed ({time.monotonic() - started:.0f}s)")
+
+        report = run_backtest(days, models, workers=options['workers'], progress=progress)
+        self.stdout.write('')
+        for version, results in report.items():
+            overall = results['overall']
+            self.stdout.write(
+                f"{version:<32} n={overall['count']:<6} MAE {overall['mae']:>6.2f}  bias {overall['bias']:>+6.2f}  "
+                f"RMSE {overall['rmse']:>6.2f}  within 10 min {overall['within_10_min']:.0%}"
+            )
+            for event, metrics in results['by_event'].items():
+                self.stdout.write(f"    at {event:<8} n={metrics['count']:<6} MAE {metrics['mae']:>6.2f}")
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump({'start': str(start), 'end': str(end), 'days': len(days), 'results': report}, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Finished in {time.monotonic() - started:.0f}s"))
+
+    def _model_paths(self, versions):
+        models = {}
+        for version in versions:
+            if not version:
+                raise CommandError('No model version registered; pass --model-version')
+            metadata = model_registry.metadata(version)
+            if metadata is None:
+                raise CommandError(f'Unknown model version {version}')
+            if not FEATURE_SPEC.matches(metadata.get('feature_spec')):
+                raise CommandError(f"Model version {version} was trained on different features")
+            models[version] = {
+                'model': model_registry.artifact_path(version, MODEL_FILE),
+                'scaler': model_registry.artifact_path(version, SCALER_FILE),
+                'forest': model_registry.artifact_path(version, FOREST_DIR),
+            }
+        return models
+
+    def _load_days(self, start, end):
+        """One query for the range, split into per-day shards of plain arrays"""
+        import numpy as np
+        import pandas as pd
+
+        rows = Token.objects.filter(
+            created_at__date__gte=start, created_at__date__lte=end,
+        ).order_by('created_at').values_list(
+            'id', 'doctor_id', 'created_at', 'arrival_confirmed_at', 'consultation_start_time',
+            'completed_at', 'appointment_time', 'predicted_waiting_time', 'status',
+        )
+        frame = pd.DataFrame(list(rows), columns=[
+            'token_id', 'doctor_id', 'created', 'arrival', 'start', 'completed_at',
+            'appointment', 'stored_prediction', 'status',
+        ])
+        if frame.empty:
+            return []
+
+        for column in ('created', 'arrival', 'start', 'completed_at'):
+            frame[column] = pd.to_datetime(frame[column], utc=True).map(
+                lambda value: value.timestamp() if pd.notna(value) else np.nan
+            ).astype(float)
+        frame['appointment'] = frame['appointment'].map(
+            lambda value: value.hour * 60 + value.minute if value is not None and pd.notna(value) else np.nan
+        ).astype(float)
+        # A token leaves the queue when its consultation starts (or it finishes).
+        # Still-active tokens never left; cancelled/skipped ones have no exit time and are not counted.
+        frame['leave'] = frame['start'].fillna(frame['completed_at'])
+        still_active = frame['leave'].isna() & frame['status'].isin(ACTIVE_QUEUE_STATUSES)
+        frame.loc[still_active, 'leave'] = np.inf
+        frame['leave'] = frame['leave'].fillna(-np.inf)
+        frame['stored_prediction'] = frame['stored_prediction'].astype(float)
+
+        local = pd.to_datetime(frame['created'], unit='s', utc=True).dt.tz_convert(timezone.get_current_timezone_name())
+        frame['day'] = local.dt.date
+        frame['utc_offset'] = local.map(lambda value: value.utcoffset().total_seconds())
+
+        days = []
+        for day, group in frame.groupby('day', sort=True):
+            shard = {column: group[column].to_numpy(dtype=float) for column in DAY_COLUMNS}
+            shard['day'] = str(day)
+            shard['utc_offset'] = float(group['utc_offset'].iloc[0])
+            days.append(shard)
+        return days
@@ -0,0 +1,147 @@
+import json
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _memory_kb():
+    """(rss, private) memory of this process in kB; private excludes shared file pages"""
+    rss = private = None
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        rss = int(fields['Rss'].split()[0])
+        private = int(fields['Private_Clean'].split()[0]) + int(fields['Private_Dirty'].split()[0])
+    except (OSError, KeyError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss, private
+
+
+def _measure_load(kind, path, n_features, results):
+    """Runs in a fresh process: memory added by loading one engine and predicting a row"""
+    import joblib
+    import numpy as np
+    import sklearn.ensemble  # noqa: F401 - imported up front so only the model itself is measured
+    from api.forest_engine import FlatForest
+    before = _memory_kb()
+    model = joblib.load(path) if kind == 'sklearn' else FlatForest.load(path)
+    model.predict(np.zeros((1, n_features)))
+    after = _memory_kb()
+    results.put({
+        'rss_kb': after[0] - before[0],
+        'private_kb': after[1] - before[1] if after[1] is not None else None,
+    })
+
+
+class Command(BaseCommand):
+    help = 'Compare latency and memory of sklearn and the flattened NumPy forest for the wait model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-version', help='Registry version to benchmark (default: current)')
+        parser.add_argument('--synthetic', action='store_true', help='Benchmark a forest trained on random data instead')
+        parser.add_argument('--rows', default='1,32', help='Comma-separated batch sizes (default: 1,32)')
+        parser.add_argument('--repeat', type=int, default=200, help='Timed calls per batch size')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        import joblib
+        import numpy as np
+        from api.forest_engine import FlatForest
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            model, label = self._load_model(options)
+            if not FlatForest.supports(model):
+                raise CommandError(f'{type(model).__name__} is not a tree ensemble')
+
+            model_path = os.path.join(tmpdir, 'model.pkl')
+            forest_dir = os.path.join(tmpdir, 'forest')
+            joblib.dump(model, model_path)
+            FlatForest.from_sklearn(model).save(forest_dir)
+            forest = FlatForest.load(forest_dir)
+
+            rng = np.random.default_rng(0)
+            report = {
+                'model': label,
+                'trees': forest.n_trees,
+                'nodes': forest.n_nodes,
+                'max_depth': forest.max_depth,
+                'pickle_bytes': os.path.getsize(model_path),
+                'flat_bytes': sum(os.path.getsize(os.path.join(forest_dir, name)) for name in os.listdir(forest_dir)),
+                'latency_ms': {},
+            }
+            for rows in [int(value) for value in options['rows'].split(',')]:
+                X = rng.normal(size=(rows, forest.n_features_in_))
+                if not np.array_equal(model.predict(X), forest.predict(X)):
+                    # sklearn sums trees in thread completion order when n_jobs != 1
+                    np.testing.assert_allclose(model.predict(X), forest.predict(X), rtol=1e-12)
+                report['latency_ms'][rows] = {
+                    'sklearn': self._time(model.predict, X, options['repeat']),
+                    'flat': self._time(forest.predict, X, options['repeat']),
+                }
+
+            context = multiprocessing.get_context('spawn')
+            report['memory_kb'] = {
+                'sklearn': self._measure(context, 'sklearn', model_path, forest.n_features_in_),
+                'flat': self._measure(context, 'flat', forest_dir, forest.n_features_in_),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(
+            f"{report['model']}: {report['trees']} trees, {report['nodes']} nodes, depth {report['max_depth']}"
+        )
+        self.stdout.write(f"On disk: pickle {report['pickle_bytes'] // 1024} kB, flat {report['flat_bytes'] // 1024} kB")
+        for rows, timings in report['latency_ms'].items():
+            speedup = timings['sklearn'] / timings['flat'] if timings['flat'] else float('inf')
+            self.stdout.write(
+                f"{rows:>5} row(s): sklearn {timings['sklearn']:.3f} ms, flat {timings['flat']:.3f} ms ({speedup:.1f}x)"
+            )
+        for kind, memory in report['memory_kb'].items():
+            self.stdout.write(f"Load {kind}: +{memory['rss_kb']} kB RSS, +{memory['private_kb']} kB private")
+        self.stdout.write(self.style.SUCCESS('Flat forest predictions match sklearn'))
+
+    def _load_model(self, options):
+        if options['synthetic']:
+            import numpy as np
+            from sklearn.ensemble import RandomForestRegressor
+            from api.waiting_time_predictor import FEATURE_SPEC
+            rng = np.random.default_rng(42)
+            X = rng.normal(size=(5000, len(FEATURE_SPEC)))
+            y = 20 + 8 * X[:, 3] + 3 * X[:, 0] + rng.normal(scale=5, size=len(X))
+            model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=1).fit(X, y)
+            return model, 'synthetic forest'
+
+        from api.model_registry import model_registry
+        version = options['model_version'] or model_registry.current_version()
+        if not version:
+            raise CommandError('No model version registered; train one or use --synthetic')
+        try:
+            model, _, _ = model_registry.load(version, flat=False)
+        except OSError as e:
+            raise CommandError(f'Cannot load model version {version}: {e}')
+        return model, f'version {version}'
+
+    @staticmethod
+    def _time(predict, X, repeat):
+        predict(X)
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            predict(X)
+            samples.append((time.perf_counter() - started) * 1000)
+        return round(statistics.median(samples), 4)
+
+    @staticmethod
+    def _measure(context, kind, path, n_features):
+        results = context.Queue()
+        process = context.Process(target=_measure_load, args=(kind, path, n_features, results))
+        process.start()
+        result = results.get(timeout=120)
+        process.join()
+        return result
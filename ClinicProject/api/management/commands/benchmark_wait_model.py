@@ -0,0 +1,303 @@
+import json
+import math
+import os
+import platform
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+# Synthetic history, mirroring the distributions in train_improved_model.py
+# (which also informed generate_realistic_data_v2.py), vectorised for bulk inserts
+PATIENTS_PER_DAY = (8, 20)
+SLOT_MINUTES = 15
+CLINIC_START_HOUR = 9
+WEEKEND_SKIP_PROBABILITY = 0.8
+ARRIVAL_PATTERNS = {
+    # name: (weight, offset range in minutes relative to the slot)
+    'very_early': (0.08, (-30, -15)),
+    'early': (0.25, (-14, -3)),
+    'ontime': (0.40, (-2, 5)),
+    'late': (0.18, (6, 20)),
+    'very_late': (0.07, (21, 45)),
+}
+CONSULTATION_MINUTES = [5, 8, 10, 12, 15, 18, 20, 25, 30, 40]
+CONSULTATION_WEIGHTS = [0.10, 0.15, 0.20, 0.18, 0.15, 0.10, 0.06, 0.04, 0.01, 0.01]
+INSERT_BATCH_SIZE = 5000
+
+
+class _MemoryPeak:
+    """Samples this process's RSS in a background thread and keeps the peak"""
+    INTERVAL = 0.005
+
+    def __init__(self):
+        self.peak = self.baseline = self._rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    @staticmethod
+    def _rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def _preserve_created_at(model):
+    """Let bulk_create store the synthetic arrival times instead of auto_now_add's now()"""
+    field = model._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark prepare_training_data, train_model, predictions and evaluate_model '
+        'against synthetic token histories in a throwaway database; writes a JSON report'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma-separated token counts')
+        parser.add_argument('--days', type=int, default=90, help='Days of history to spread the tokens over')
+        parser.add_argument('--predictions', type=int, default=200, help='Single predictions to time per size')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-evaluate', action='store_true', help='Skip the evaluate_model phase (it retrains)')
+        parser.add_argument('--output', default='wait_model_benchmark.json', help='Path of the JSON report')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(value) for value in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+
+        import numpy as np
+        import sklearn
+        from api.model_registry import ModelRegistry
+        from api.waiting_time_predictor import ModelHolder, waiting_time_predictor
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'sklearn': sklearn.__version__,
+                'database': connection.vendor,
+                'cpus': os.cpu_count(),
+            },
+            'options': {key: options[key] for key in ('days', 'predictions', 'seed', 'skip_evaluate')},
+            'runs': [],
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Throwaway database (a file, so 1M rows do not have to fit in memory)
+            test_settings = connection.settings_dict.setdefault('TEST', {})
+            original_test_name = test_settings.get('NAME')
+            if connection.vendor == 'sqlite':
+                test_settings['NAME'] = os.path.join(tmpdir, 'benchmark.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+            # ...and a throwaway model registry, so no real model version is touched
+            saved_holder, saved_registry = waiting_time_predictor.holder, waiting_time_predictor.registry
+            registry = ModelRegistry(os.path.join(tmpdir, 'registry'))
+            waiting_time_predictor.holder = ModelHolder(registry)
+            waiting_time_predictor.registry = registry
+            try:
+                for size in sizes:
+                    self.stdout.write(f"Benchmarking {size} tokens...")
+                    run = self._run_size(size, options, waiting_time_predictor, np)
+                    report['runs'].append(run)
+                    for phase, result in run['phases'].items():
+                        self.stdout.write(
+                            f"  {phase:<24} {result['seconds']:>9.3f}s  peak +{result['peak_rss_mb']:.1f} MB  "
+                            f"{result['queries']} queries"
+                        )
+            finally:
+                waiting_time_predictor.holder, waiting_time_predictor.registry = saved_holder, saved_registry
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = original_test_name
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _phase(self, phases, name, func):
+        counter = _QueryCounter()
+        with _MemoryPeak() as memory, connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - started
+        phases[name] = {
+            'seconds': round(seconds, 4),
+            'peak_rss_mb': round((memory.peak - memory.baseline) / 2 ** 20, 1),
+            'queries': counter.count,
+        }
+        return result
+
+    def _run_size(self, size, options, predictor, np):
+        from api.models import Token, Doctor, Patient, Clinic
+
+        Token.objects.all().delete()
+        Doctor.objects.all().delete()
+        rng = np.random.default_rng(options['seed'])
+        phases = {}
+
+        doctor_ids = self._phase(phases, 'seed', lambda: self._seed(size, options['days'], rng, np))
+        run = {'tokens': Token.objects.count(), 'doctors': len(doctor_ids), 'phases': phases}
+
+        X, y = self._phase(phases, 'prepare_training_data', lambda: predictor.prepare_training_data(use_all_data=True))
+        run['training_rows'] = 0 if X is None else len(X)
+        if not self._phase(phases, 'train_model', predictor.train_model):
+            raise CommandError(f'Training failed for {size} tokens')
+        run['model_version'] = predictor.registry.current_version()
+        run['metrics'] = (predictor.registry.metadata(run['model_version']) or {}).get('metrics')
+
+        now = timezone.now()
+        picks = rng.choice(doctor_ids, size=options['predictions'])
+        latencies = []
+
+        def predict_each():
+            for doctor_id in picks:
+                started = time.perf_counter()
+                predictor.predict_waiting_time(int(doctor_id), current_time=now)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        self._phase(phases, 'predict_waiting_time', predict_each)
+        phases['predict_waiting_time']['calls'] = len(latencies)
+        phases['predict_waiting_time']['p50_ms'] = round(float(np.percentile(latencies, 50)), 3)
+        phases['predict_waiting_time']['p95_ms'] = round(float(np.percentile(latencies, 95)), 3)
+
+        self._phase(phases, 'predict_many', lambda: predictor.predict_many([(d, None) for d in doctor_ids], current_time=now))
+        phases['predict_many']['rows'] = len(doctor_ids)
+
+        if not options['skip_evaluate']:
+            self._phase(phases, 'evaluate_model', lambda: call_command('evaluate_model', stdout=StringIO()))
+        return run
+
+    def _seed(self, size, days, rng, np):
+        """Bulk-insert about `size` completed tokens; returns the doctor ids"""
+        from api.models import Token, Doctor, Patient, Clinic
+
+        today = timezone.localdate()
+        day_list = [today - timedelta(days=days - offset) for offset in range(days)]
+        day_list = [d for d in day_list if d.weekday() < 5 or rng.random() >= WEEKEND_SKIP_PROBABILITY]
+        low, high = PATIENTS_PER_DAY
+        n_doctors = max(1, math.ceil(size / (len(day_list) * (low + high) / 2)))
+
+        clinic = Clinic.objects.create(name='Benchmark Clinic', address='-', city='-')
+        doctors = Doctor.objects.bulk_create([
+            Doctor(name=f'Benchmark Doctor {i}', specialization='General', clinic=clinic) for i in range(n_doctors)
+        ])
+        patients = Patient.objects.bulk_create([
+            Patient(name=f'Benchmark Patient {i}', age=30 + i % 50) for i in range(200)
+        ])
+        doctor_ids = np.array([d.id for d in doctors])
+        patient_ids = np.array([p.id for p in patients])
+
+        # One group per (doctor, day), truncated so the total is exactly `size`
+        counts = rng.integers(low, high + 1, size=n_doctors * len(day_list))
+        counts[np.cumsum(counts) - counts >= size] = 0
+        counts[np.argmax(np.cumsum(counts) >= size)] -= max(0, int(counts.sum()) - size)
+        group = np.repeat(np.arange(len(counts)), counts)
+        position = np.arange(len(group)) - np.repeat(np.cumsum(counts) - counts, counts)
+        group_doctor = group // len(day_list)
+        group_day = group % len(day_list)
+        n = len(group)
+
+        # Per doctor-day factors
+        efficiency = rng.uniform(0.6, 1.4, size=len(counts))[group]
+        busy_day = (rng.random(len(counts)) < 0.3)[group]
+        emergency = (rng.random(len(counts)) < 0.15)[group] & (position > counts[group] // 2)
+
+        names = list(ARRIVAL_PATTERNS)
+        weights = np.array([ARRIVAL_PATTERNS[name][0] for name in names])
+        pattern = rng.choice(len(names), size=n, p=weights / weights.sum())
+        low_offset = np.array([ARRIVAL_PATTERNS[name][1][0] for name in names])[pattern]
+        high_offset = np.array([ARRIVAL_PATTERNS[name][1][1] for name in names])[pattern]
+        arrival_offset = rng.integers(low_offset, high_offset + 1)
+
+        queue_position = position + 1
+        base_wait = np.select(
+            [queue_position == 1, queue_position <= 3, queue_position <= 8],
+            [rng.integers(0, 6, n), rng.integers(2, 13, n), queue_position * rng.integers(3, 9, n)],
+            queue_position * rng.integers(5, 13, n),
+        ).astype(float)
+        slot_minutes = position * SLOT_MINUTES
+        wait = (
+            base_wait
+            + base_wait * (efficiency - 1.0)
+            + np.where(busy_day, rng.integers(5, 16, n), 0)
+            + np.where(emergency, rng.integers(10, 26, n), 0)
+            + np.where(CLINIC_START_HOUR + slot_minutes // 60 >= 14, rng.integers(2, 9, n), 0)
+            + np.where(rng.random(n) < 0.2, rng.integers(5, 16, n), 0)
+            + np.where(pattern <= names.index('early'), -rng.integers(2, 9, n), 0)
+            + np.where(pattern >= names.index('late'), rng.integers(3, 11, n), 0)
+        )
+        wait = np.clip(wait.astype(int), 0, 120)
+        duration = rng.choice(CONSULTATION_MINUTES, size=n, p=CONSULTATION_WEIGHTS)
+
+        # Epoch seconds of each token's slot, then arrival/start/completion
+        day_starts = np.array([
+            timezone.make_aware(datetime.combine(day, dt_time(CLINIC_START_HOUR))).timestamp() for day in day_list
+        ])
+        slot_ts = day_starts[group_day] + slot_minutes * 60
+        arrival_ts = slot_ts + arrival_offset * 60
+        start_ts = arrival_ts + wait * 60
+        completed_ts = start_ts + duration * 60
+        patient_pick = rng.choice(patient_ids, size=n)
+
+        def as_datetime(ts):
+            return datetime.fromtimestamp(float(ts), tz=dt_timezone.utc)
+
+        with _preserve_created_at(Token):
+            for start in range(0, n, INSERT_BATCH_SIZE):
+                stop = min(n, start + INSERT_BATCH_SIZE)
+                Token.objects.bulk_create([
+                    Token(
+                        patient_id=int(patient_pick[i]),
+                        doctor_id=int(doctor_ids[group_doctor[i]]),
+                        clinic_id=clinic.id,
+                        token_number=f'BENCH{i:07d}',
+                        status='completed',
+                        date=day_list[group_day[i]],
+                        appointment_time=dt_time(CLINIC_START_HOUR + int(slot_minutes[i]) // 60, int(slot_minutes[i]) % 60),
+                        created_at=as_datetime(arrival_ts[i]),
+                        consultation_start_time=as_datetime(start_ts[i]),
+                        completed_at=as_datetime(completed_ts[i]),
+                    )
+                    for i in range(start, stop)
+                ])
+        return [int(doctor_id) for doctor_id in doctor_ids]
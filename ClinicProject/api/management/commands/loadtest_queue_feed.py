@@ -0,0 +1,244 @@
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from datetime import time as dt_time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+HANDSHAKE_CONCURRENCY = 100
+SERVER_START_TIMEOUT = 30
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        'p50': round(statistics.median(ordered), 2),
+        'p95': round(pick(0.95), 2),
+        'max': round(ordered[-1], 2),
+    }
+
+
+def _process_stats():
+    with open('/proc/self/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return {'rss_mb': round(rss / 2 ** 20, 1), 'open_fds': len(os.listdir('/proc/self/fd'))}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the live queue WebSocket feed: serve the ASGI app with Daphne in this process, '
+        'open many concurrent sockets on one doctor and time snapshot and delta delivery'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=2000, help='Concurrent WebSocket clients (default 2000)')
+        parser.add_argument('--updates', type=int, default=20, help='Token changes to broadcast (default 20)')
+        parser.add_argument('--queue-size', type=int, default=40, help='Tokens in the doctor queue (default 40)')
+        parser.add_argument('--window', type=float, help='Coalescing window in seconds (default: the broadcaster setting)')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for each phase')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        try:
+            import websockets  # noqa: F401
+            from daphne.server import Server  # noqa: F401 - installs the asyncio Twisted reactor
+        except ImportError as e:
+            raise CommandError(f'The load test needs daphne and websockets: {e}')
+        from api.queue_update_signals import queue_broadcaster
+
+        self._raise_fd_limit(options['sockets'] * 2 + 256)
+        if options['window'] is not None:
+            queue_broadcaster.window = options['window']
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Throwaway database on disk: the server, broadcaster and load threads each open their own connection
+            test_settings = connection.settings_dict.setdefault('TEST', {})
+            if connection.vendor == 'sqlite':
+                test_settings['NAME'] = os.path.join(tmpdir, 'loadtest.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                doctor_id, token_ids = self._seed(options['queue_size'])
+                connections.close_all()
+                server, port = self._start_server()
+                try:
+                    report = asyncio.run(self._run(port, doctor_id, token_ids, options))
+                finally:
+                    self._stop_server(server)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report['window_seconds'] = queue_broadcaster.window
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{report['connected']}/{report['sockets']} sockets connected in {report['connect_seconds']}s; "
+            f"snapshot latency ms {report['snapshot_ms']}"
+        )
+        self.stdout.write(
+            f"{report['updates']} updates: delivered to all sockets {report['complete_updates']}x, "
+            f"commit-to-client ms {report['delta_ms']} (includes the {report['window_seconds']}s coalescing window)"
+        )
+        self.stdout.write(f"Resyncs: {report['resyncs']}, errors: {report['errors']}, process: {report['process']}")
+        if report['connected'] == report['sockets'] and report['complete_updates'] == report['updates']:
+            self.stdout.write(self.style.SUCCESS('Every socket received every update'))
+        else:
+            self.stdout.write(self.style.WARNING('Some sockets missed updates'))
+
+    @staticmethod
+    def _raise_fd_limit(needed):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < needed:
+            if hard != resource.RLIM_INFINITY and hard < needed:
+                raise CommandError(f'Need {needed} open files, the hard limit is {hard}')
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+    @staticmethod
+    def _seed(queue_size):
+        from api.models import Clinic, Doctor, Patient, Token
+        clinic = Clinic.objects.create(name='Load Test Clinic', address='Addr', city='City')
+        doctor = Doctor.objects.create(name='Dr Load', specialization='GP', clinic=clinic)
+        patient = Patient.objects.create(name='Load Patient', age=40, phone_number='+15550001111')
+        today = timezone.localdate()
+        tokens = [
+            Token.objects.create(
+                patient=patient, doctor=doctor, date=today,
+                appointment_time=dt_time(8 + slot // 4, 15 * (slot % 4)),
+            )
+            for slot in range(queue_size)
+        ]
+        return doctor.id, [token.id for token in tokens]
+
+    @staticmethod
+    def _start_server():
+        from daphne.endpoints import build_endpoint_description_strings
+        from daphne.server import Server
+        from clinic_token_system.asgi import application
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        ready = threading.Event()
+        server = Server(
+            application=application,
+            endpoints=build_endpoint_description_strings(host='127.0.0.1', port=port),
+            signal_handlers=False,
+            verbosity=0,
+            ready_callable=ready.set,
+        )
+        threading.Thread(target=server.run, name='daphne', daemon=True).start()
+        if not ready.wait(SERVER_START_TIMEOUT):
+            raise CommandError('Daphne did not start')
+        return server, port
+
+    @staticmethod
+    def _stop_server(server):
+        from twisted.internet import reactor
+        reactor.callFromThread(reactor.stop)
+
+    async def _run(self, port, doctor_id, token_ids, options):
+        from websockets.asyncio.client import connect
+
+        url = f'ws://127.0.0.1:{port}/ws/queue/{doctor_id}/'
+        total = options['sockets']
+        versions = [None] * total
+        # The update being timed: sockets reach it when they hold `version` or newer
+        waiting = {'version': None, 'reached': set(), 'arrivals': [], 'event': asyncio.Event()}
+        snapshot_ms, errors, resyncs = [], [], [0]
+        connected = [0]
+        handshakes = asyncio.Semaphore(HANDSHAKE_CONCURRENCY)
+        sockets = []
+
+        async def client(index):
+            try:
+                async with handshakes:
+                    started = time.perf_counter()
+                    websocket = await connect(url, origin='http://localhost', open_timeout=options['timeout'])
+                    snapshot = json.loads(await websocket.recv())
+                    snapshot_ms.append((time.perf_counter() - started) * 1000)
+                versions[index] = snapshot['version']
+                connected[0] += 1
+                async with websocket:
+                    sockets.append(websocket)
+                    async for text in websocket:
+                        message = json.loads(text)
+                        if message['type'] == 'delta' and message['base_version'] != versions[index]:
+                            errors.append(f"socket {index}: delta from {message['base_version']} on {versions[index]}")
+                        elif message['type'] == 'snapshot':
+                            resyncs[0] += 1
+                        versions[index] = message['version']
+                        target = waiting['version']
+                        if target is not None and message['version'] >= target and index not in waiting['reached']:
+                            waiting['reached'].add(index)
+                            waiting['arrivals'].append(time.perf_counter())
+                            if len(waiting['reached']) >= connected[0]:
+                                waiting['event'].set()
+            except Exception as e:
+                errors.append(f"socket {index}: {type(e).__name__}: {e}")
+
+        before = _process_stats()
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(client(index)) for index in range(total)]
+        deadline = time.monotonic() + options['timeout']
+        while connected[0] + len(errors) < total and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        connect_seconds = round(time.perf_counter() - started, 2)
+        with_sockets = _process_stats()
+
+        delta_ms, complete = [], 0
+        for step in range(options['updates']):
+            changed_at = time.perf_counter()
+            version = await asyncio.to_thread(self._change_token, doctor_id, token_ids[step % len(token_ids)])
+            waiting.update(version=version, reached=set(), arrivals=[], event=asyncio.Event())
+            # Sockets may have seen this version while the change was committing
+            for index, seen in enumerate(versions):
+                if seen is not None and seen >= version:
+                    waiting['reached'].add(index)
+                    waiting['arrivals'].append(time.perf_counter())
+            if len(waiting['reached']) < connected[0]:
+                try:
+                    await asyncio.wait_for(waiting['event'].wait(), options['timeout'])
+                except asyncio.TimeoutError:
+                    pass
+            complete += len(waiting['reached']) == total
+            delta_ms.extend((at - changed_at) * 1000 for at in waiting['arrivals'])
+
+        await asyncio.gather(*(websocket.close() for websocket in sockets))
+        await asyncio.gather(*tasks)
+        return {
+            'sockets': total,
+            'connected': connected[0],
+            'connect_seconds': connect_seconds,
+            'snapshot_ms': _percentiles(snapshot_ms),
+            'updates': options['updates'],
+            'complete_updates': complete,
+            'delta_ms': _percentiles(delta_ms),
+            'resyncs': resyncs[0],
+            'errors': len(errors),
+            'first_errors': errors[:5],
+            'process': {'before': before, 'with_sockets': with_sockets},
+        }
+
+    @staticmethod
+    def _change_token(doctor_id, token_id):
+        """Flip one token between waiting and in consultation; returns the queue version after commit"""
+        from api.models import Token
+        from api.prediction_cache import QueueVersion
+        try:
+            token = Token.objects.get(pk=token_id)
+            token.status = 'in_consultancy' if token.status == 'waiting' else 'waiting'
+            token.save()
+            return QueueVersion.get(doctor_id, token.date)
+        finally:
+            connections.close_all()
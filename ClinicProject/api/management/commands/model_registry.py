@@ -0,0 +1,73 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.model_registry import model_registry
+
+
+class Command(BaseCommand):
+    help = 'List, promote, roll back, prune and export versions of the waiting time model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'promote', 'rollback', 'prune', 'import-legacy', 'export-forest'])
+        parser.add_argument('version', nargs='?', help='Version id (for promote; export-forest defaults to the current version)')
+        parser.add_argument('--keep', type=int, help='Versions to keep when pruning (default: registry setting)')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        try:
+            if action == 'list':
+                self._list()
+            elif action == 'promote':
+                if not options['version']:
+                    raise CommandError('promote needs a version id')
+                model_registry.promote(options['version'])
+                self.stdout.write(self.style.SUCCESS(f"Promoted {options['version']}"))
+            elif action == 'rollback':
+                version = model_registry.rollback()
+                self.stdout.write(self.style.SUCCESS(f"Rolled back to {version}"))
+            elif action == 'prune':
+                removed = model_registry.prune(keep=options['keep'])
+                self.stdout.write(self.style.SUCCESS(f"Removed {len(removed)} version(s)"))
+            elif action == 'import-legacy':
+                self._import_legacy()
+            elif action == 'export-forest':
+                version = options['version'] or model_registry.current_version()
+                if not version:
+                    raise CommandError('No current model version to export')
+                path = model_registry.export_forest(version)
+                self.stdout.write(self.style.SUCCESS(f"Exported flattened forest for {version} to {path}"))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def _list(self):
+        versions = model_registry.list_versions()
+        if not versions:
+            self.stdout.write('No model versions registered')
+            return
+        for meta in versions:
+            marker = '*' if meta['current'] else ' '
+            metrics = meta.get('metrics') or {}
+            metric_text = ', '.join(f"{name}={value}" for name, value in metrics.items()) or '-'
+            self.stdout.write(
+                f"{marker} {meta['version']}  rows={meta.get('training_rows', '-')}  "
+                f"time={meta.get('training_seconds', '-')}s  {metric_text}"
+            )
+
+    def _import_legacy(self):
+        """Register the pre-registry waiting_time_model.pkl/waiting_time_scaler.pkl pair"""
+        import joblib
+        from api.waiting_time_predictor import FEATURE_SPEC
+
+        model_path = os.path.join(settings.BASE_DIR, 'waiting_time_model.pkl')
+        scaler_path = os.path.join(settings.BASE_DIR, 'waiting_time_scaler.pkl')
+        if not (os.path.exists(model_path) and os.path.exists(scaler_path)):
+            raise CommandError(f'No legacy model files found in {settings.BASE_DIR}')
+
+        model = joblib.load(model_path)
+        scaler = joblib.load(scaler_path)
+        version = model_registry.register(model, scaler, metadata={
+            'model_type': type(model).__name__,
+            'feature_spec': FEATURE_SPEC.to_dict(),
+            'imported_from': model_path,
+        })
+        self.stdout.write(self.style.SUCCESS(f'Imported legacy model as {version}'))
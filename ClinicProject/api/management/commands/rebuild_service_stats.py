@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.service_time_stats import DEFAULT_WINDOW_DAYS, ServiceTimeStats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-doctor service-time rollup from completed Token rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctor_id", type=int, action="append", help="Limit to this doctor (repeatable)")
+        parser.add_argument("--days", type=int, default=DEFAULT_WINDOW_DAYS,
+                            help=f"Days of history to include (default {DEFAULT_WINDOW_DAYS})")
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days < 1:
+            raise CommandError("--days must be at least 1")
+
+        self.stdout.write(f"Rebuilding service-time stats from the last {days} days ...")
+        written = ServiceTimeStats.rebuild(days=days, doctor_ids=options.get("doctor_id"))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} doctor/weekday/hour rows."))
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.slot_occupancy import SlotOccupancy
+
+
+class Command(BaseCommand):
+    help = "Rebuild doctor slot occupancy bitmaps from booked Token rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--doctor_id", type=int, action="append", help="Limit to this doctor (repeatable)")
+        parser.add_argument("--from_date", type=str, help="First date to rebuild (YYYY-MM-DD, default today)")
+        parser.add_argument("--days", type=int, default=30, help="Number of days to rebuild (default 30)")
+
+    def handle(self, *args, **options):
+        if options.get("from_date"):
+            try:
+                start_date = datetime.strptime(options["from_date"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--from_date must be YYYY-MM-DD")
+        else:
+            start_date = timezone.now().date()
+        days = options["days"]
+        if days < 1:
+            raise CommandError("--days must be at least 1")
+        end_date = start_date + timedelta(days=days - 1)
+
+        self.stdout.write(f"Rebuilding slot occupancy from {start_date} to {end_date} ...")
+        written = SlotOccupancy.rebuild(start_date, end_date, doctor_ids=options.get("doctor_id"))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} doctor-day bitmaps. Other days are built on first read."))
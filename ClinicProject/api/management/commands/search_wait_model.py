@@ -0,0 +1,98 @@
+import json
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.model_search import CANDIDATE_GRID, build_estimator, run_search
+
+
+class Command(BaseCommand):
+    help = (
+        'Search model types and hyperparameters for the waiting time model with forward-chaining '
+        'time-series CV over dates, then register the best candidate'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--splits', type=int, default=4, help='Forward-chaining folds (default 4)')
+        parser.add_argument('--models', default=','.join(CANDIDATE_GRID),
+                            help=f"Comma-separated model families (default: {','.join(CANDIDATE_GRID)})")
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+        parser.add_argument('--no-register', action='store_true', help='Report the results without registering a model')
+        parser.add_argument('--no-promote', action='store_true', help='Register the best model without promoting it')
+        parser.add_argument('--report', help='Also write the full results to this JSON file')
+
+    def handle(self, *args, **options):
+        from sklearn.preprocessing import StandardScaler
+        from api.waiting_time_predictor import waiting_time_predictor
+
+        if options['splits'] < 1:
+            raise CommandError('--splits must be at least 1')
+        model_names = [name.strip() for name in options['models'].split(',') if name.strip()]
+
+        started = time.monotonic()
+        X, y, days = waiting_time_predictor.prepare_training_data(use_all_data=True, with_days=True)
+        if X is None:
+            raise CommandError('Insufficient training data')
+        self.stdout.write(f"Loaded {len(X)} rows over {len(set(days))} days")
+
+        def progress(done, total):
+            if done == total or done % max(1, total // 10) == 0:
+                self.stdout.write(f"  {done}/{total} fits done ({time.monotonic() - started:.0f}s)")
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            try:
+                summaries, splits = run_search(
+                    X, y, days, data_dir,
+                    n_splits=options['splits'],
+                    model_names=model_names,
+                    workers=options['workers'],
+                    progress=progress,
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write('')
+        for summary in summaries:
+            self.stdout.write(
+                f"{summary['mae']:>8.3f} ± {summary['mae_std']:<6.3f} r2={summary['r2']}  "
+                f"{summary['model']} {summary['params']}"
+            )
+        best = summaries[0]
+        result = {'splits': len(splits), 'rows': len(X), 'best': best, 'candidates': summaries}
+
+        if not options['no_register']:
+            # Refit the winner on all rows, using every core for the final fit
+            # (save_model stores it with n_jobs=1 for serving)
+            params = dict(best['params'])
+            if 'n_jobs' in params:
+                params['n_jobs'] = -1
+            fit_started = time.monotonic()
+            scaler = StandardScaler()
+            model = build_estimator(best['estimator'], params)
+            model.fit(scaler.fit_transform(X), y)
+
+            waiting_time_predictor.model = model
+            waiting_time_predictor.scaler = scaler
+            version = waiting_time_predictor.save_model(
+                metrics={'mae': best['mae'], 'mae_std': best['mae_std'], 'r2': best['r2']},
+                training_rows=len(X),
+                training_seconds=round(time.monotonic() - fit_started, 2),
+                promote=not options['no_promote'],
+                details={'search': {
+                    'cv': 'forward-chaining by date',
+                    'splits': len(splits),
+                    'params': best['params'],
+                    'candidates': len(summaries),
+                }},
+            )
+            result['version'] = version
+            self.stdout.write(self.style.SUCCESS(
+                f"Registered {best['model']} as {version} (CV MAE {best['mae']:.3f})"
+                + ('' if options['no_promote'] else ' and promoted it')
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Best: {best['model']} {best['params']} (CV MAE {best['mae']:.3f})"))
+
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(result, f, indent=2)
+        self.stdout.write(f"Finished in {time.monotonic() - started:.0f}s")
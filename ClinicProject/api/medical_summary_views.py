@@ -30,12 +30,9 @@ class MedicalSummaryView(APIView):
             if patient_id:
                 patients = [Patient.objects.get(id=patient_id)]
             else:
-                # Normalize phone number for search
-                normalized_phone = self.normalize_phone_number(phone_number)
-                patients = []
-                for patient in Patient.objects.all():
-                    if self.normalize_phone_number(patient.phone_number) == normalized_phone:
-                        patients.append(patient)
+                # Match every patient sharing the normalized phone number
+                from .views import resolve_patient_ids_by_phone
+                patients = list(Patient.objects.filter(id__in=resolve_patient_ids_by_phone(phone_number)).order_by('id'))
                 
                 if not patients:
                     return Response({
@@ -68,24 +65,6 @@ class MedicalSummaryView(APIView):
                 'error': f'Error generating medical summary: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def normalize_phone_number(self, phone):
-        """Normalize phone number by removing country codes and special chars"""
-        if not phone:
-            return phone
-        digits_only = re.sub(r'\D', '', str(phone))
-        if not digits_only:
-            return phone
-        
-        # Remove country codes
-        if digits_only.startswith('91') and len(digits_only) == 12:
-            return digits_only[2:]
-        elif digits_only.startswith('1') and len(digits_only) == 11:
-            return digits_only[1:]
-        
-        if len(digits_only) > 10:
-            return digits_only[-10:]
-        return digits_only
-
     def generate_medical_summary(self, consultations, primary_patient):
         """Generate structured medical summary"""
         
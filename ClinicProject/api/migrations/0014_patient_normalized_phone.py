@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+from api.utils.utils import normalize_phone_number
+
+BACKFILL_CHUNK_SIZE = 2000
+
+
+def backfill_normalized_phones(apps, schema_editor):
+    """Same as the backfill_normalized_phones command: fill existing rows in primary-key chunks"""
+    Patient = apps.get_model('api', 'Patient')
+    last_pk = 0
+    while True:
+        rows = list(
+            Patient.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'phone_number')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        changed = []
+        for pk, phone_number in rows:
+            normalized = normalize_phone_number(phone_number)
+            if normalized:
+                changed.append(Patient(pk=pk, normalized_phone=normalized))
+        if changed:
+            Patient.objects.bulk_update(changed, ['normalized_phone'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_prescriptionreminder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='normalized_phone',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=15),
+        ),
+        migrations.RunPython(backfill_normalized_phones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from api.service_time_stats import ServiceTimeStats
+
+
+def seed_service_stats(apps, schema_editor):
+    """Fill the rollup from the existing completions, as ServiceTimeStats.rebuild() does"""
+    Token = apps.get_model('api', 'Token')
+    DoctorServiceStats = apps.get_model('api', 'DoctorServiceStats')
+    totals = ServiceTimeStats.rollup(ServiceTimeStats.window_tokens(Token).values_list(
+        'doctor_id', 'date', 'appointment_time', 'completed_at'
+    ).iterator())
+    DoctorServiceStats.objects.bulk_create([
+        DoctorServiceStats(doctor_id=doctor_id, weekday=weekday, hour=hour, **row)
+        for (doctor_id, weekday, hour), row in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_doctorslotoccupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorServiceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(help_text='Monday=0 ... Sunday=6')),
+                ('hour', models.PositiveSmallIntegerField(help_text='Hour of the appointment time')),
+                ('count', models.IntegerField(default=0)),
+                ('delay_sum', models.FloatField(default=0)),
+                ('delay_sum_sq', models.FloatField(default=0)),
+                ('early_count', models.IntegerField(default=0)),
+                ('early_minutes_sum', models.FloatField(default=0)),
+                ('late_count', models.IntegerField(default=0, help_text='Completions at or after the appointment time')),
+                ('late_minutes_sum', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='service_stats', to='api.doctor')),
+            ],
+            options={
+                'unique_together': {('doctor', 'weekday', 'hour')},
+            },
+        ),
+        migrations.RunPython(seed_service_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-17 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_doctorservicestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrainingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('phase', models.CharField(choices=[('queued', 'Queued'), ('loading', 'Loading data'), ('features', 'Building features'), ('fit', 'Fitting model'), ('eval', 'Evaluating'), ('save', 'Saving model'), ('done', 'Done')], default='queued', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0, help_text='Percent complete')),
+                ('trigger', models.CharField(default='manual', max_length=30)),
+                ('message', models.TextField(blank=True, default='')),
+                ('model_version', models.CharField(blank=True, default='', max_length=64)),
+                ('metrics', models.JSONField(blank=True, default=dict)),
+                ('active_lock', models.CharField(blank=True, max_length=10, null=True, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
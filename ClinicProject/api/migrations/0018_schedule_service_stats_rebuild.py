@@ -0,0 +1,38 @@
+from django.db import migrations
+from django.utils import timezone
+
+REBUILD_FUNC = 'api.tasks_ml.rebuild_service_time_stats'
+
+
+def schedule_service_stats_rebuild(apps, schema_editor):
+    """Register the nightly rollup rebuild (at 1:30, as setup_ml_schedules does) unless it exists"""
+    Schedule = apps.get_model('django_q', 'Schedule')
+    if Schedule.objects.filter(func=REBUILD_FUNC).exists():
+        return
+    now = timezone.now()
+    next_run = now.replace(hour=1, minute=30, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timezone.timedelta(days=1)
+    Schedule.objects.create(
+        func=REBUILD_FUNC,
+        name='nightly_service_stats_rebuild',
+        schedule_type='D',
+        repeats=-1,
+        next_run=next_run,
+    )
+
+
+def unschedule_service_stats_rebuild(apps, schema_editor):
+    apps.get_model('django_q', 'Schedule').objects.filter(func=REBUILD_FUNC).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_trainingjob'),
+        ('django_q', '__latest__'),
+    ]
+
+    operations = [
+        migrations.RunPython(schedule_service_stats_rebuild, unschedule_service_stats_rebuild),
+    ]
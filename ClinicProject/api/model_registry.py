@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import uuid
+from django.conf import settings
+from django.utils import timezone
+from .forest_engine import FlatForest
+import logging
+
+try:
+    import joblib
+except ImportError:
+    joblib = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'model.pkl'
+SCALER_FILE = 'scaler.pkl'
+METADATA_FILE = 'metadata.json'
+FOREST_DIR = 'forest'
+CURRENT_POINTER = 'CURRENT'
+
+
+class ModelRegistry:
+    """Versioned on-disk store for the waiting time model.
+
+    Layout under the registry root:
+
+        versions/<version>/model.pkl, scaler.pkl, metadata.json
+        versions/<version>/forest/      flattened copy of a forest model (see FlatForest)
+        CURRENT            name of the version in use
+
+    A version directory is fully written under a temporary name and then
+    renamed into place, and CURRENT is swapped with os.replace, so a reader
+    that follows the pointer never sees a half-written artifact.
+    """
+
+    def __init__(self, root, keep=5):
+        self.root = str(root)
+        self.keep = keep
+        self.versions_dir = os.path.join(self.root, 'versions')
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def artifact_path(self, version, name):
+        return os.path.join(self.version_dir(version), name)
+
+    def current_version(self):
+        try:
+            with open(os.path.join(self.root, CURRENT_POINTER)) as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version or None
+
+    def _write_atomic(self, path, text):
+        tmp_path = f"{path}.tmp.{os.getpid()}.{uuid.uuid4().hex[:6]}"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _new_version_id(self):
+        return f"{timezone.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+
+    def register(self, model, scaler, metadata=None, promote=True):
+        """Store a trained (model, scaler) pair as a new version and return its id"""
+        os.makedirs(self.versions_dir, exist_ok=True)
+        version = self._new_version_id()
+        staging_dir = os.path.join(self.versions_dir, f".staging-{version}")
+        os.makedirs(staging_dir)
+        try:
+            joblib.dump(model, os.path.join(staging_dir, MODEL_FILE))
+            joblib.dump(scaler, os.path.join(staging_dir, SCALER_FILE))
+            if FlatForest.supports(model):
+                FlatForest.from_sklearn(model).save(os.path.join(staging_dir, FOREST_DIR))
+            metadata = dict(metadata or {}, version=version, created_at=timezone.now().isoformat())
+            with open(os.path.join(staging_dir, METADATA_FILE), 'w') as f:
+                json.dump(metadata, f, indent=2, default=str)
+            os.rename(staging_dir, self.version_dir(version))
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        logger.info(f"Registered waiting time model version {version}")
+        if promote:
+            self.promote(version)
+        self.prune()
+        return version
+
+    def metadata(self, version):
+        try:
+            with open(self.artifact_path(version, METADATA_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def versions(self):
+        """Registered version ids, newest first"""
+        try:
+            names = os.listdir(self.versions_dir)
+        except OSError:
+            return []
+        return sorted((name for name in names if not name.startswith('.')), reverse=True)
+
+    def list_versions(self):
+        current = self.current_version()
+        return [
+            dict(self.metadata(version) or {'version': version}, current=version == current)
+            for version in self.versions()
+        ]
+
+    def promote(self, version):
+        if not os.path.isfile(self.artifact_path(version, METADATA_FILE)):
+            raise ValueError(f"Unknown model version: {version}")
+        os.makedirs(self.root, exist_ok=True)
+        self._write_atomic(os.path.join(self.root, CURRENT_POINTER), version)
+        logger.info(f"Promoted waiting time model version {version}")
+        return version
+
+    def rollback(self):
+        """Point CURRENT at the version registered just before the current one"""
+        current = self.current_version()
+        older = [version for version in self.versions() if current is None or version < current]
+        if not older:
+            raise ValueError("No earlier model version to roll back to")
+        return self.promote(older[0])
+
+    def prune(self, keep=None):
+        """Delete all but the newest `keep` versions; the current version is always kept"""
+        keep = self.keep if keep is None else keep
+        current = self.current_version()
+        removed = []
+        for version in self.versions()[keep:]:
+            if version == current:
+                continue
+            shutil.rmtree(self.version_dir(version), ignore_errors=True)
+            removed.append(version)
+        return removed
+
+    def load(self, version, flat=True):
+        """Load (model, scaler, metadata) for a version
+
+        With `flat`, a version that has a flattened forest is loaded as a
+        memory-mapped FlatForest instead of unpickling the sklearn model.
+        """
+        forest_dir = self.artifact_path(version, FOREST_DIR)
+        if flat and FlatForest.exists(forest_dir):
+            model = FlatForest.load(forest_dir)
+        else:
+            model = joblib.load(self.artifact_path(version, MODEL_FILE))
+        scaler = joblib.load(self.artifact_path(version, SCALER_FILE))
+        return model, scaler, self.metadata(version)
+
+    def export_forest(self, version):
+        """Write the flattened forest for a version registered without one"""
+        model = joblib.load(self.artifact_path(version, MODEL_FILE))
+        if not FlatForest.supports(model):
+            raise ValueError(f"Model version {version} ({type(model).__name__}) is not a tree ensemble")
+        staging_dir = os.path.join(self.version_dir(version), f".{FOREST_DIR}-{uuid.uuid4().hex[:6]}")
+        FlatForest.from_sklearn(model).save(staging_dir)
+        shutil.rmtree(self.artifact_path(version, FOREST_DIR), ignore_errors=True)
+        os.rename(staging_dir, self.artifact_path(version, FOREST_DIR))
+        return self.artifact_path(version, FOREST_DIR)
+
+
+model_registry = ModelRegistry(
+    getattr(settings, 'WAITING_TIME_MODEL_REGISTRY', os.path.join(settings.BASE_DIR, 'model_registry')),
+    keep=getattr(settings, 'WAITING_TIME_MODEL_KEEP', 5),
+)
@@ -0,0 +1,156 @@
+"""Time-series cross-validation and hyperparameter search for the waiting time model.
+
+Kept free of Django imports at module level: the worker processes of the
+search import this module directly and only need NumPy and scikit-learn.
+"""
+import importlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
+
+# name: (estimator class, parameter grid, fixed parameters)
+CANDIDATE_GRID = {
+    'random_forest': (
+        'sklearn.ensemble.RandomForestRegressor',
+        {'max_depth': [12, 20], 'min_samples_leaf': [5, 20]},
+        # Fewer, subsampled trees than train_model's 100 keep a 500k-row search to minutes
+        {'n_estimators': 60, 'max_samples': 0.3, 'random_state': 42, 'n_jobs': 1},
+    ),
+    'hist_gradient_boosting': (
+        'sklearn.ensemble.HistGradientBoostingRegressor',
+        {'learning_rate': [0.05, 0.1], 'max_leaf_nodes': [31, 63]},
+        {'max_iter': 200, 'random_state': 42},
+    ),
+    'ridge': (
+        'sklearn.linear_model.Ridge',
+        {'alpha': [1.0, 10.0]},
+        {},
+    ),
+}
+
+FEATURES_FILE = 'features.npy'
+TARGETS_FILE = 'targets.npy'
+
+
+def expand_grid(model_names=None):
+    """[(model name, estimator path, params), ...] for every grid point of the chosen models"""
+    candidates = []
+    for name in model_names or CANDIDATE_GRID:
+        if name not in CANDIDATE_GRID:
+            raise ValueError(f"Unknown model '{name}'; choose from {', '.join(CANDIDATE_GRID)}")
+        path, grid, fixed = CANDIDATE_GRID[name]
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            candidates.append((name, path, dict(fixed, **dict(zip(keys, values)))))
+    return candidates
+
+
+def build_estimator(path, params):
+    module_name, class_name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)(**params)
+
+
+def forward_chaining_splits(days, n_splits):
+    """Row ranges for forward-chaining CV over dates.
+
+    `days` must be sorted. The distinct dates are cut into n_splits + 1
+    consecutive blocks; fold k trains on blocks 0..k and validates on block
+    k + 1. Returns [(train_end, valid_end), ...] as row offsets, so a fold is
+    rows [:train_end] for training and [train_end:valid_end] for validation.
+    """
+    unique_days = np.unique(days)
+    if len(unique_days) < n_splits + 1:
+        raise ValueError(f"Need at least {n_splits + 1} distinct days for {n_splits} splits, have {len(unique_days)}")
+    block_starts = [unique_days[i] for i in np.linspace(0, len(unique_days), n_splits + 2, dtype=int)[1:-1]]
+    boundaries = [int(np.searchsorted(days, day, side='left')) for day in block_starts] + [len(days)]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def evaluate_fold(data_dir, path, params, train_end, valid_end):
+    """Fit one candidate on one fold; runs in a worker on the memory-mapped matrix"""
+    from sklearn.metrics import mean_absolute_error, r2_score
+    from sklearn.preprocessing import StandardScaler
+
+    X = np.load(os.path.join(data_dir, FEATURES_FILE), mmap_mode='r')
+    y = np.load(os.path.join(data_dir, TARGETS_FILE), mmap_mode='r')
+    started = time.perf_counter()
+    scaler = StandardScaler()
+    X_train = scaler.fit_transform(X[:train_end])
+    model = build_estimator(path, params)
+    model.fit(X_train, y[:train_end])
+    predicted = np.clip(model.predict(scaler.transform(X[train_end:valid_end])), 0, 120)
+    actual = y[train_end:valid_end]
+    return {
+        'mae': float(mean_absolute_error(actual, predicted)),
+        'r2': float(r2_score(actual, predicted)) if len(actual) > 1 else None,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def _init_worker():
+    # One process per core already; keep BLAS/OpenMP inside each worker single-threaded
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(1)
+
+
+def summarize(name, path, params, folds):
+    maes = [fold['mae'] for fold in folds]
+    r2s = [fold['r2'] for fold in folds if fold['r2'] is not None]
+    return {
+        'model': name,
+        'estimator': path,
+        'params': params,
+        'mae': round(float(np.mean(maes)), 3),
+        'mae_std': round(float(np.std(maes)), 3),
+        'r2': round(float(np.mean(r2s)), 4) if r2s else None,
+        'fold_mae': [round(mae, 3) for mae in maes],
+        'fit_seconds': round(sum(fold['seconds'] for fold in folds), 2),
+    }
+
+
+def run_search(X, y, days, data_dir, n_splits=4, model_names=None, workers=None, progress=None):
+    """Evaluate every candidate on every fold; returns summaries sorted best (lowest MAE) first.
+
+    X, y are written once to `data_dir` and memory-mapped by the workers, so
+    the pool shares one copy of the feature matrix. With workers <= 1 the
+    folds run in this process.
+    """
+    order = np.argsort(days, kind='stable')
+    np.save(os.path.join(data_dir, FEATURES_FILE), np.ascontiguousarray(X[order], dtype=np.float64))
+    np.save(os.path.join(data_dir, TARGETS_FILE), np.ascontiguousarray(y[order], dtype=np.float64))
+    splits = forward_chaining_splits(np.asarray(days)[order], n_splits)
+
+    candidates = expand_grid(model_names)
+    tasks = [
+        ((index, fold), (data_dir, path, params, train_end, valid_end))
+        for index, (name, path, params) in enumerate(candidates)
+        for fold, (train_end, valid_end) in enumerate(splits)
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    folds = [[None] * len(splits) for _ in candidates]
+
+    if workers <= 1:
+        for done, ((index, fold), args) in enumerate(tasks, 1):
+            folds[index][fold] = evaluate_fold(*args)
+            if progress:
+                progress(done, len(tasks))
+    else:
+        # Spawned workers: safer than fork next to BLAS/OpenMP thread pools
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+            futures = {pool.submit(evaluate_fold, *args): key for key, args in tasks}
+            for done, future in enumerate(as_completed(futures), 1):
+                index, fold = futures[future]
+                folds[index][fold] = future.result()
+                if progress:
+                    progress(done, len(tasks))
+
+    summaries = [
+        summarize(name, path, params, candidate_folds)
+        for (name, path, params), candidate_folds in zip(candidates, folds)
+    ]
+    summaries.sort(key=lambda summary: summary['mae'])
+    return summaries, splits
@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import time
+from .utils.utils import normalize_phone_number
 
 class State(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -75,10 +76,20 @@ class Patient(models.Model):
     name = models.CharField(max_length=100)
     age = models.IntegerField()
     phone_number = models.CharField(max_length=15, null=True, blank=True)
+    # Indexed copy of normalize_phone_number(phone_number) so IVR and web
+    # accounts sharing a number can be matched with one query.
+    normalized_phone = models.CharField(max_length=15, blank=True, default='', db_index=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalized_phone = normalize_phone_number(self.phone_number) or ''
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'normalized_phone'}
+        super(Patient, self).save(*args, **kwargs)
+
 class Token(models.Model):
     STATUS_CHOICES = [
         ('waiting', 'Waiting'),
@@ -158,8 +169,28 @@ class Token(models.Model):
         if self.status == 'completed' and self.completed_at is None:
             self.completed_at = timezone.now()
 
+        previous_slot = getattr(self, '_loaded_slot', None)
         super(Token, self).save(*args, **kwargs)
 
+        # Invalidate cached predictions for the queue(s) this token is (or was) in
+        from .prediction_cache import QueueVersion, PatientTokenVersion
+        QueueVersion.bump_on_commit((self.doctor_id, self.date), previous_slot[:2] if previous_slot else (None, None))
+        PatientTokenVersion.bump_on_commit(self.patient_id)
+        # ...and move it within the in-process ordered queues (after the bump above)
+        from .queue_state import queue_state
+        queue_state.apply_on_commit(self, previous_slot)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the slot this token held when loaded so moving it can free the old slot
+        instance._loaded_slot = (instance.__dict__.get('doctor_id'), instance.__dict__.get('date'), instance.__dict__.get('appointment_time'))
+        # ...and the completion it contributed to the service-time stats
+        instance._loaded_completion = tuple(
+            instance.__dict__.get(name) for name in ('status', 'doctor_id', 'date', 'appointment_time', 'completed_at')
+        )
+        return instance
+
 class Consultation(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE)
@@ -182,6 +213,87 @@ class DoctorSchedule(models.Model):
     def __str__(self):
         return f"Schedule for Dr. {self.doctor.name}"
 
+class DoctorSlotOccupancy(models.Model):
+    """Booked-slot bitmap for one doctor's day; bit i is set when slot i is taken."""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='slot_occupancy')
+    date = models.DateField()
+    # Copy of the schedule grid the bitmap was built against
+    start_time = models.TimeField()
+    slot_duration_minutes = models.IntegerField()
+    slot_count = models.IntegerField()
+    bitmap = models.BinaryField(default=b'')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('doctor', 'date')]
+
+    def __str__(self):
+        return f"Slot occupancy for Dr. {self.doctor_id} on {self.date}"
+
+
+class DoctorServiceStats(models.Model):
+    """Running totals of completion delay for one doctor, weekday and appointment hour.
+
+    Delay is completed_at minus the booked appointment time, in minutes;
+    negative values are early completions.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='service_stats')
+    weekday = models.PositiveSmallIntegerField(help_text="Monday=0 ... Sunday=6")
+    hour = models.PositiveSmallIntegerField(help_text="Hour of the appointment time")
+    count = models.IntegerField(default=0)
+    delay_sum = models.FloatField(default=0)
+    delay_sum_sq = models.FloatField(default=0)
+    early_count = models.IntegerField(default=0)
+    early_minutes_sum = models.FloatField(default=0)
+    late_count = models.IntegerField(default=0, help_text="Completions at or after the appointment time")
+    late_minutes_sum = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('doctor', 'weekday', 'hour')]
+
+    def __str__(self):
+        return f"Service stats for Dr. {self.doctor_id} on weekday {self.weekday} at {self.hour}:00"
+
+
+class TrainingJob(models.Model):
+    """One background run of the waiting time model training pipeline."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    PHASE_CHOICES = [
+        ('queued', 'Queued'),
+        ('loading', 'Loading data'),
+        ('features', 'Building features'),
+        ('fit', 'Fitting model'),
+        ('eval', 'Evaluating'),
+        ('save', 'Saving model'),
+        ('done', 'Done'),
+    ]
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    phase = models.CharField(max_length=20, choices=PHASE_CHOICES, default='queued')
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percent complete")
+    trigger = models.CharField(max_length=30, default='manual')
+    message = models.TextField(blank=True, default='')
+    model_version = models.CharField(max_length=64, blank=True, default='')
+    metrics = models.JSONField(default=dict, blank=True)
+    # Set while the job is queued or running; the unique constraint allows one active job
+    active_lock = models.CharField(max_length=10, null=True, blank=True, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Training job {self.pk} ({self.status}, {self.phase} {self.progress}%)"
+
 
 
 class PrescriptionItem(models.Model):
@@ -0,0 +1,275 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Token, DoctorSchedule
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Versions outlive the day they describe; an evicted counter restarts at a fresh value
+QUEUE_VERSION_TIMEOUT = 2 * 24 * 60 * 60
+# Predictions depend on the clock (hour of day), so they are bucketed by this many seconds
+BUCKET_SECONDS = getattr(settings, 'PREDICTION_CACHE_BUCKET_SECONDS', 60)
+PREDICTION_TIMEOUT = getattr(settings, 'PREDICTION_CACHE_TIMEOUT', 5 * 60)
+LOCAL_CACHE_SIZE = getattr(settings, 'PREDICTION_CACHE_SIZE', 2048)
+CACHE_ALIAS = getattr(settings, 'PREDICTION_CACHE_ALIAS', 'default')
+# Backends whose contents live in (and die with) a single process
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared(alias=CACHE_ALIAS):
+    """Whether the counters' cache is seen by every process (all web workers and the Q cluster)"""
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def warn_if_cache_is_local():
+    if not cache_is_shared():
+        logger.warning(
+            f"Cache '{CACHE_ALIAS}' is process-local ({settings.CACHES[CACHE_ALIAS]['BACKEND']}): "
+            "queue versions bumped by one process (another web worker, the Q cluster) are not "
+            "seen by the others. Set CACHE_REDIS_URL to share them."
+        )
+
+
+def _initial_version():
+    # Not 0: if a counter is evicted, restarting from a new value avoids reusing old versions
+    return time.time_ns() // 1000
+
+
+def get_counter(key):
+    """Current value of a version counter in the counters' cache, creating it if missing"""
+    cache = caches[CACHE_ALIAS]
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), QUEUE_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_counters(keys):
+    """Values of several version counters in one cache round trip: {key: version}"""
+    cache = caches[CACHE_ALIAS]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = get_counter(key)
+    return versions
+
+
+def bump_counter(key):
+    cache = caches[CACHE_ALIAS]
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing: start a new counter (or increment one created concurrently)
+        if cache.add(key, _initial_version(), QUEUE_VERSION_TIMEOUT):
+            return cache.get(key)
+        return cache.incr(key)
+
+
+class QueueVersion:
+    """Per-(doctor, date) counter that changes whenever that doctor's queue changes.
+
+    Stored in the configured Django cache. Every process sees the same value
+    only when that cache is shared (cache_is_shared(), i.e. CACHE_REDIS_URL is
+    set); with a process-local cache a bump is only visible to the process
+    that made it. Anything derived from the queue can be cached under the
+    current version and is implicitly invalidated by the next bump.
+    """
+
+    @staticmethod
+    def _key(doctor_id, day):
+        return f"queue_version:{doctor_id}:{day.isoformat()}"
+
+    @staticmethod
+    def get(doctor_id, day):
+        return get_counter(QueueVersion._key(doctor_id, day))
+
+    @staticmethod
+    def bump(doctor_id, day):
+        return bump_counter(QueueVersion._key(doctor_id, day))
+
+    @staticmethod
+    def bump_on_commit(*slots):
+        """Bump the given (doctor_id, date) queues once the current transaction commits"""
+        to_date = Token._meta.get_field('date').to_python
+        slots = {(doctor_id, to_date(day)) for doctor_id, day in slots if doctor_id and day}
+
+        def apply():
+            for doctor_id, day in slots:
+                try:
+                    QueueVersion.bump(doctor_id, day)
+                except Exception as e:
+                    logger.error(f"Failed to bump queue version for doctor {doctor_id} on {day}: {e}")
+
+        if slots:
+            transaction.on_commit(apply)
+
+
+class PatientTokenVersion:
+    """Per-patient counter bumped whenever one of the patient's tokens changes"""
+
+    @staticmethod
+    def _key(patient_id):
+        return f"patient_token_version:{patient_id}"
+
+    @staticmethod
+    def get_many(patient_ids):
+        """{patient_id: version} for the given patients"""
+        keys = {PatientTokenVersion._key(patient_id): patient_id for patient_id in patient_ids}
+        return {keys[key]: version for key, version in get_counters(list(keys)).items()}
+
+    @staticmethod
+    def bump_on_commit(*patient_ids):
+        patient_ids = {patient_id for patient_id in patient_ids if patient_id}
+
+        def apply():
+            for patient_id in patient_ids:
+                try:
+                    bump_counter(PatientTokenVersion._key(patient_id))
+                except Exception as e:
+                    logger.error(f"Failed to bump token version for patient {patient_id}: {e}")
+
+        if patient_ids:
+            transaction.on_commit(apply)
+
+
+class ScheduleVersion:
+    """Per-doctor counter bumped when the doctor's schedule (slot grid) changes"""
+
+    @staticmethod
+    def _key(doctor_id):
+        return f"schedule_version:{doctor_id}"
+
+    @staticmethod
+    def get(doctor_id):
+        return get_counter(ScheduleVersion._key(doctor_id))
+
+    @staticmethod
+    def bump_on_commit(doctor_id):
+        def apply():
+            try:
+                bump_counter(ScheduleVersion._key(doctor_id))
+            except Exception as e:
+                logger.error(f"Failed to bump schedule version for doctor {doctor_id}: {e}")
+
+        transaction.on_commit(apply)
+
+
+class PredictionCache:
+    """Waiting time predictions keyed by (doctor, date, queue version, time bucket, appointment time).
+
+    A small in-process LRU sits in front of the Django cache (shared between
+    processes when cache_is_shared()); entries from older queue versions are
+    never read again and age out of both. Changes made by other processes
+    are only seen through a shared cache; otherwise predictions can lag them
+    by up to one time bucket. Hit/miss counters are per process.
+    """
+
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE, alias=CACHE_ALIAS, timeout=PREDICTION_TIMEOUT):
+        self.maxsize = maxsize
+        self.alias = alias
+        self.timeout = timeout
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _model_version(predictor):
+        bundle = predictor.holder.get()
+        return bundle.version if bundle is not None else 'fallback'
+
+    def key(self, doctor_id, current_time, appointment_time, model_version):
+        day = timezone.localdate(current_time)
+        bucket = int(current_time.timestamp()) // BUCKET_SECONDS
+        appointment = appointment_time.strftime('%H:%M') if appointment_time else 'walkin'
+        return (
+            f"wait_prediction:{model_version}:{doctor_id}:{day.isoformat()}:"
+            f"{QueueVersion.get(doctor_id, day)}:{bucket}:{appointment}"
+        )
+
+    def _get_local(self, key):
+        with self._lock:
+            value = self._local.get(key)
+            if value is not None:
+                self._local.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def _put_local(self, key, value):
+        with self._lock:
+            self._local[key] = value
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def interval(self, doctor_id, current_time=None, appointment_time=None, predictor=None):
+        """Cached equivalent of WaitingTimePredictor.predict_waiting_time_interval"""
+        if predictor is None:
+            from .waiting_time_predictor import waiting_time_predictor as predictor
+        current_time = current_time or timezone.now()
+        key = self.key(doctor_id, current_time, appointment_time, self._model_version(predictor))
+
+        value = self._get_local(key)
+        if value is not None:
+            return dict(value)
+
+        shared = caches[self.alias]
+        value = shared.get(key)
+        if value is not None:
+            with self._lock:
+                self.shared_hits += 1
+        else:
+            with self._lock:
+                self.misses += 1
+            value = predictor.predict_waiting_time_interval(
+                doctor_id, current_time=current_time, for_appointment_time=appointment_time
+            )
+            shared.set(key, value, self.timeout)
+        self._put_local(key, value)
+        return dict(value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else None,
+                'size': len(self._local),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self.hits = self.shared_hits = self.misses = 0
+
+
+prediction_cache = PredictionCache()
+
+
+@receiver(post_delete, sender=Token)
+def bump_queue_version_on_token_delete(sender, instance, **kwargs):
+    QueueVersion.bump_on_commit((instance.doctor_id, instance.date))
+    PatientTokenVersion.bump_on_commit(instance.patient_id)
+    from .queue_state import queue_state
+    queue_state.apply_on_commit(instance, deleted=True)
+
+
+@receiver(post_save, sender=DoctorSchedule)
+@receiver(post_delete, sender=DoctorSchedule)
+def bump_schedule_version(sender, instance, **kwargs):
+    ScheduleVersion.bump_on_commit(instance.doctor_id)
@@ -0,0 +1,41 @@
+from django.db.models import Case, F, IntegerField, Value, When, Window
+from django.db.models.functions import RowNumber
+from .models import Token
+from .queue_state import OTHER_PRIORITY, STATUS_PRIORITY, WAITING_STATUSES
+
+
+def status_priority():
+    return Case(
+        *[When(status=status, then=Value(priority)) for status, priority in STATUS_PRIORITY.items()],
+        default=Value(OTHER_PRIORITY),
+        output_field=IntegerField(),
+    )
+
+
+def queue_order():
+    """ORDER BY of a doctor's queue; the same order as queue_state.sort_key"""
+    return [status_priority().asc(), F('appointment_time').asc(nulls_last=True), F('created_at').asc(), F('id').asc()]
+
+
+def ranked_tokens(day, doctor_ids=None, statuses=WAITING_STATUSES):
+    """Tokens on `day` with one of `statuses`, each annotated with `queue_rank`.
+
+    queue_rank is the 1-based place in the doctor's queue among the selected
+    statuses, computed for every token in the same statement with
+    ROW_NUMBER() OVER (PARTITION BY doctor ORDER BY ...). With the default
+    statuses it is the position shown to patients (queue_state.position).
+    doctor_ids=None covers every doctor. Filtering on queue_rank (e.g. the
+    first three) is done after ranking; filters on other fields are not, so
+    narrow the statuses here rather than on the result.
+    """
+    tokens = Token.objects.filter(date=day, status__in=list(statuses))
+    if doctor_ids is not None:
+        tokens = tokens.filter(doctor_id__in=list(doctor_ids))
+    return tokens.annotate(
+        queue_rank=Window(RowNumber(), partition_by=[F('doctor_id')], order_by=queue_order()),
+    ).order_by('doctor_id', 'queue_rank')
+
+
+def queue_ranks(day, doctor_ids=None, statuses=WAITING_STATUSES):
+    """{token_id: queue_rank} for ranked_tokens(day, doctor_ids, statuses)"""
+    return dict(ranked_tokens(day, doctor_ids, statuses).values_list('id', 'queue_rank'))
@@ -0,0 +1,202 @@
+from django.db.models import Case, When, Value, IntegerField, F
+from django.utils import timezone
+from datetime import datetime, timedelta
+from .models import Token
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Monte Carlo runs per forecast
+DEFAULT_RUNS = 400
+# Days of completed consultations used as the empirical service-time distribution
+SERVICE_HISTORY_DAYS = 30
+# Doctors with fewer samples than this borrow the pooled distribution
+MIN_DOCTOR_SAMPLES = 5
+# Plausible consultation length in minutes; outside this a record is treated as bad data
+SERVICE_MINUTES_RANGE = (1, 180)
+# Remaining time assumed when a consultation has outlasted every recorded sample
+OVERRUN_MINUTES = 2.0
+# Each doctor's history is summarised as this many evenly spaced quantiles, so every
+# doctor's distribution has the same shape and can be sampled with one index draw
+SAMPLE_GRID_SIZE = 256
+# Used when there is no history at all: spread around a 12 minute consultation
+DEFAULT_SERVICE_MINUTES = np.random.default_rng(0).lognormal(mean=np.log(12), sigma=0.35, size=1000)
+
+QUEUED_STATUSES = ['waiting', 'confirmed']
+
+
+class QueueSimulator:
+    """Monte Carlo forecast of consultation start times for every queued token.
+
+    Service times are drawn from each doctor's recent consultation lengths.
+    The in-progress consultation is conditioned on the time it has already run,
+    and a booked patient is not seen before their appointment time. All doctors
+    and runs are simulated together, one vectorised step per queue position.
+    """
+
+    @staticmethod
+    def service_samples(doctor_ids, now=None, days=SERVICE_HISTORY_DAYS):
+        """Empirical distribution of recent consultation lengths (minutes) per doctor, in one query.
+
+        Each value is a sorted array of SAMPLE_GRID_SIZE quantiles of that doctor's history.
+        """
+        now = now or timezone.now()
+        rows = Token.objects.filter(
+            doctor_id__in=doctor_ids,
+            status='completed',
+            consultation_start_time__isnull=False,
+            completed_at__isnull=False,
+            date__gte=now.date() - timedelta(days=days)
+        ).values_list('doctor_id', 'consultation_start_time', 'completed_at')
+
+        low, high = SERVICE_MINUTES_RANGE
+        durations = {}
+        for doctor_id, started, finished in rows:
+            minutes = (finished - started).total_seconds() / 60
+            if low <= minutes <= high:
+                durations.setdefault(doctor_id, []).append(minutes)
+
+        pooled = np.concatenate([np.asarray(v) for v in durations.values()]) if durations else np.array([])
+        if len(pooled) < MIN_DOCTOR_SAMPLES:
+            pooled = DEFAULT_SERVICE_MINUTES
+        pooled = QueueSimulator.quantile_grid(pooled)
+
+        return {
+            doctor_id: QueueSimulator.quantile_grid(durations[doctor_id])
+            if len(durations.get(doctor_id, ())) >= MIN_DOCTOR_SAMPLES else pooled
+            for doctor_id in doctor_ids
+        }
+
+    @staticmethod
+    def quantile_grid(values):
+        levels = (np.arange(SAMPLE_GRID_SIZE) + 0.5) / SAMPLE_GRID_SIZE
+        return np.quantile(np.asarray(values, dtype=float), levels)
+
+    @staticmethod
+    def load_queues(doctor_ids, now=None):
+        """Current queue per doctor, in one query.
+
+        Returns {doctor_id: {'elapsed': minutes the current consultation has run (or None),
+        'tokens': [(token_id, minutes until appointment or 0), ...] in queue order}}.
+        """
+        now = now or timezone.now()
+        queues = {doctor_id: {'elapsed': None, 'tokens': []} for doctor_id in doctor_ids}
+        rows = Token.objects.filter(
+            doctor_id__in=doctor_ids,
+            date=now.date(),
+            status__in=['in_consultancy'] + QUEUED_STATUSES
+        ).annotate(
+            status_priority=Case(
+                When(status='in_consultancy', then=Value(1)),
+                When(status='confirmed', then=Value(2)),
+                When(status='waiting', then=Value(3)),
+                default=Value(4),
+                output_field=IntegerField(),
+            )
+        ).order_by('status_priority', F('appointment_time').asc(nulls_last=True), 'created_at').values_list(
+            'id', 'doctor_id', 'status', 'date', 'appointment_time', 'consultation_start_time'
+        )
+
+        for token_id, doctor_id, status, token_date, appointment_time, started in rows:
+            queue = queues[doctor_id]
+            if status == 'in_consultancy':
+                if queue['elapsed'] is None:
+                    queue['elapsed'] = max(0.0, (now - started).total_seconds() / 60) if started else 0.0
+                continue
+            offset = 0.0
+            if appointment_time:
+                appointment_at = timezone.make_aware(datetime.combine(token_date, appointment_time))
+                offset = max(0.0, (appointment_at - now).total_seconds() / 60)
+            queue['tokens'].append((token_id, offset))
+        return queues
+
+    @staticmethod
+    def simulate(queues, samples, runs=DEFAULT_RUNS, seed=None):
+        """Simulate all queues at once.
+
+        Returns {doctor_id: [{'token_id', 'position', 'expected_minutes', 'p10_minutes',
+        'p90_minutes'}, ...]} with minutes measured from now.
+        """
+        doctor_ids = [doctor_id for doctor_id, queue in queues.items() if queue['tokens']]
+        if not doctor_ids:
+            return {doctor_id: [] for doctor_id in queues}
+
+        rng = np.random.default_rng(seed)
+        n_doctors = len(doctor_ids)
+        depth = max(len(queues[doctor_id]['tokens']) for doctor_id in doctor_ids)
+
+        grid = np.stack([samples[doctor_id] for doctor_id in doctor_ids]).astype(np.float32)
+
+        appointment = np.zeros((n_doctors, depth), dtype=np.float32)
+        valid = np.zeros((n_doctors, depth), dtype=bool)
+        elapsed = np.full(n_doctors, np.nan)
+        for d, doctor_id in enumerate(doctor_ids):
+            queue = queues[doctor_id]
+            token_offsets = [offset for _, offset in queue['tokens']]
+            appointment[d, :len(token_offsets)] = token_offsets
+            valid[d, :len(token_offsets)] = True
+            if queue['elapsed'] is not None:
+                elapsed[d] = queue['elapsed']
+
+        # Service times for every doctor, queue position and run
+        draws = rng.integers(0, SAMPLE_GRID_SIZE, size=(n_doctors, depth, runs), dtype=np.uint16)
+        service = grid[np.arange(n_doctors)[:, None, None], draws]
+
+        # Remaining time of the current consultation, drawn from the part of the
+        # distribution longer than what has already elapsed
+        free_at = np.zeros((n_doctors, runs), dtype=np.float32)
+        busy = ~np.isnan(elapsed)
+        if busy.any():
+            first_longer = np.array([np.searchsorted(grid[d], elapsed[d], side='right') for d in range(n_doctors)])
+            longer = np.where(busy, SAMPLE_GRID_SIZE - first_longer, 0)
+            picks = np.minimum(
+                first_longer[:, None] + rng.integers(0, np.maximum(longer, 1)[:, None], size=(n_doctors, runs)),
+                SAMPLE_GRID_SIZE - 1
+            )
+            remaining = np.where(
+                (longer > 0)[:, None],
+                grid[np.arange(n_doctors)[:, None], picks] - np.nan_to_num(elapsed)[:, None],
+                OVERRUN_MINUTES
+            )
+            free_at = np.where(busy[:, None], remaining, 0.0).astype(np.float32)
+
+        starts = np.empty((n_doctors, depth, runs), dtype=np.float32)
+        for position in range(depth):
+            start = np.maximum(free_at, appointment[:, position, None])
+            starts[:, position] = start
+            free_at = np.where(valid[:, position, None], start + service[:, position], free_at)
+
+        expected = starts.mean(axis=2)
+        # Nearest-rank percentiles via a partial sort, much cheaper than np.percentile here
+        low_rank, high_rank = int(0.1 * (runs - 1)), int(0.9 * (runs - 1))
+        starts.partition((low_rank, high_rank), axis=2)
+        p10, p90 = starts[:, :, low_rank], starts[:, :, high_rank]
+
+        expected, p10, p90 = (np.round(values.astype(float), 1).tolist() for values in (expected, p10, p90))
+        forecasts = {doctor_id: [] for doctor_id in queues}
+        for d, doctor_id in enumerate(doctor_ids):
+            for position, (token_id, _) in enumerate(queues[doctor_id]['tokens']):
+                forecasts[doctor_id].append({
+                    'token_id': token_id,
+                    'position': position + 1,
+                    'expected_minutes': expected[d][position],
+                    'p10_minutes': p10[d][position],
+                    'p90_minutes': p90[d][position],
+                })
+        return forecasts
+
+    @staticmethod
+    def forecast(doctor_ids, now=None, runs=DEFAULT_RUNS, seed=None):
+        """Start-time forecasts for every queued token of the given doctors (two queries)"""
+        doctor_ids = list(doctor_ids)
+        now = now or timezone.now()
+        queues = QueueSimulator.load_queues(doctor_ids, now)
+        samples = QueueSimulator.service_samples(doctor_ids, now)
+        return QueueSimulator.simulate(queues, samples, runs=runs, seed=seed)
+
+    @staticmethod
+    def forecast_by_token(doctor_ids, now=None, runs=DEFAULT_RUNS, seed=None):
+        """Same as forecast(), flattened to {token_id: forecast}"""
+        forecasts = QueueSimulator.forecast(doctor_ids, now, runs=runs, seed=seed)
+        return {entry['token_id']: entry for entries in forecasts.values() for entry in entries}
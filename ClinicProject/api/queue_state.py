@@ -0,0 +1,205 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import time as dt_time
+from django.conf import settings
+from django.db import connection, transaction
+from .models import Token
+from .prediction_cache import QueueVersion, cache_is_shared
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Same order as the staff queue (TokenListCreate) and the live queue views
+STATUS_PRIORITY = {'in_consultancy': 1, 'confirmed': 2, 'waiting': 3}
+OTHER_PRIORITY = 4
+# Patients still to be called: what "position in queue" counts
+WAITING_STATUSES = ('waiting', 'confirmed')
+STATE_SIZE = getattr(settings, 'QUEUE_STATE_SIZE', 512)
+# How long a queue is trusted without a shared cache to signal other processes' changes
+LOCAL_TTL_SECONDS = getattr(settings, 'QUEUE_STATE_LOCAL_TTL_SECONDS', 5)
+
+
+def sort_key(status, appointment_time, created_at, token_id):
+    """Queue order: status priority, appointment time (walk-ins last), then arrival"""
+    return (
+        STATUS_PRIORITY.get(status, OTHER_PRIORITY),
+        appointment_time is None,
+        appointment_time or dt_time.min,
+        created_at,
+        token_id,
+    )
+
+
+def token_key(token):
+    appointment_time = Token._meta.get_field('appointment_time').to_python(token.appointment_time)
+    return sort_key(token.status, appointment_time, token.created_at, token.id)
+
+
+class DoctorQueue:
+    """One doctor's active queue for one day as a sorted list of sort keys.
+
+    Statuses occupy contiguous ranges of the list (they lead the key), so
+    counting tokens of given statuses ahead of any key is a few bisections.
+    """
+
+    def __init__(self, version, keys=()):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.keys = sorted(keys)
+        self.by_id = {key[-1]: key for key in self.keys}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def discard(self, token_id):
+        key = self.by_id.pop(token_id, None)
+        if key is not None:
+            del self.keys[bisect_left(self.keys, key)]
+
+    def insert(self, key):
+        self.discard(key[-1])
+        insort(self.keys, key)
+        self.by_id[key[-1]] = key
+
+    def rank(self, key):
+        """Number of queued tokens ordered before `key` (which need not be queued)"""
+        return bisect_left(self.keys, key)
+
+    def _status_range(self, status):
+        priority = STATUS_PRIORITY[status]
+        return bisect_left(self.keys, (priority,)), bisect_left(self.keys, (priority + 1,))
+
+    def count_ahead(self, key, statuses):
+        rank = self.rank(key)
+        ahead = 0
+        for status in statuses:
+            start, end = self._status_range(status)
+            ahead += max(0, min(rank, end) - start)
+        return ahead
+
+    def head(self, n):
+        return [key[-1] for key in self.keys[:n]]
+
+
+class QueueState:
+    """In-process ordered queues per (doctor, date), so position lookups need no SQL.
+
+    A queue is loaded with one query on first use and tagged with the doctor's
+    QueueVersion. Token saves and deletes in this process are applied to it
+    incrementally once they commit; any other change (another process, a
+    bulk update) shows up as a version the queue does not carry, and the
+    next lookup reloads it. Lookups cost one cache read for the version check
+    and O(log n) in the queue.
+
+    That relies on the counters being shared between processes. With a
+    process-local cache (no CACHE_REDIS_URL) changes from the Q cluster or
+    other workers never reach the version, so a kept queue is only trusted
+    for local_ttl seconds after it was loaded; after that the next lookup
+    reloads it. Positions may then lag such changes by up to local_ttl.
+    """
+
+    def __init__(self, maxsize=STATE_SIZE, local_ttl=LOCAL_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self._queues = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    @staticmethod
+    def _load(doctor_id, day):
+        rows = Token.objects.filter(
+            doctor_id=doctor_id, date=day, status__in=list(STATUS_PRIORITY)
+        ).values_list('status', 'appointment_time', 'created_at', 'id')
+        return [sort_key(*row) for row in rows]
+
+    def _is_fresh(self, queue):
+        return cache_is_shared() or time.monotonic() - queue.loaded_at < self.local_ttl
+
+    def queue(self, doctor_id, day):
+        """The current DoctorQueue for (doctor_id, day), reloading it if it is out of date"""
+        version = QueueVersion.get(doctor_id, day)
+        with self._lock:
+            queue = self._queues.get((doctor_id, day))
+            if queue is not None and queue.version == version and self._is_fresh(queue):
+                self._queues.move_to_end((doctor_id, day))
+                return queue
+        queue = DoctorQueue(version, self._load(doctor_id, day))
+        self.loads += 1
+        if connection.in_atomic_block:
+            # May include uncommitted rows that could still roll back: use it, do not keep it
+            return queue
+        with self._lock:
+            self._queues[(doctor_id, day)] = queue
+            self._queues.move_to_end((doctor_id, day))
+            while len(self._queues) > self.maxsize:
+                self._queues.popitem(last=False)
+        return queue
+
+    def patients_ahead(self, token, statuses=tuple(STATUS_PRIORITY)):
+        """Queued tokens with one of `statuses` that are ordered before this token"""
+        queue = self.queue(token.doctor_id, token.date)
+        with self._lock:
+            return queue.count_ahead(token_key(token), statuses)
+
+    def position(self, token):
+        """1-based place among the patients still waiting to be called (waiting or confirmed)"""
+        return self.patients_ahead(token, WAITING_STATUSES) + 1
+
+    def next_up(self, doctor_id, day, n=1):
+        """Ids of the first n tokens of the queue, in order"""
+        queue = self.queue(doctor_id, day)
+        with self._lock:
+            return queue.head(n)
+
+    def _apply(self, slot, token_id, key):
+        """Apply one committed change; only if it accounts for the whole version step"""
+        with self._lock:
+            queue = self._queues.get(slot)
+        if queue is None:
+            return
+        version = QueueVersion.get(*slot)
+        with self._lock:
+            if self._queues.get(slot) is not queue or version == queue.version:
+                # Replaced or reloaded since: already includes this change
+                return
+            if version != queue.version + 1:
+                # Other changes happened too; reload on the next lookup
+                del self._queues[slot]
+                return
+            queue.discard(token_id)
+            if key is not None:
+                queue.insert(key)
+            queue.version = version
+
+    def apply_on_commit(self, token, previous_slot=None, deleted=False):
+        """Move the token into its place (or out of the queue) after the transaction commits.
+
+        Must be registered after QueueVersion.bump_on_commit for the same change,
+        so the bump has happened when this runs.
+        """
+        to_date = Token._meta.get_field('date').to_python
+        current = (token.doctor_id, to_date(token.date))
+        key = token_key(token) if token.status in STATUS_PRIORITY and not deleted else None
+        slots = {current}
+        if previous_slot and previous_slot[0] and previous_slot[1]:
+            slots.add((previous_slot[0], to_date(previous_slot[1])))
+        token_id = token.id
+
+        def apply():
+            for slot in slots:
+                try:
+                    self._apply(slot, token_id, key if slot == current else None)
+                except Exception as e:
+                    logger.error(f"Failed to update queue state for doctor {slot[0]} on {slot[1]}: {e}")
+
+        transaction.on_commit(apply)
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+            self.loads = 0
+
+
+queue_state = QueueState()
@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.utils import timezone
+from .prediction_cache import QueueVersion
+from .queue_update_signals import queue_broadcaster
+from asgiref.sync import sync_to_async
+import asyncio
+import json
+import queue
+import time
+
+# A comment line is written when nothing else was sent for this long, so proxies keep the connection open
+HEARTBEAT_SECONDS = getattr(settings, 'QUEUE_STREAM_HEARTBEAT_SECONDS', 15)
+# How often an idle stream compares its version with QueueVersion (changes made by other processes)
+CHECK_SECONDS = getattr(settings, 'QUEUE_STREAM_CHECK_SECONDS', 5)
+# EventSource reconnect delay
+RETRY_MILLISECONDS = 5000
+
+
+class QueueEventStream:
+    """Server-Sent Events feed of one doctor's queue for one day.
+
+    Sends the same messages as the WebSocket consumer: a `snapshot` first,
+    then `delta` events handed over by the in-process queue broadcaster, each
+    with the queue version as its event id. A delta that does not follow the
+    version last sent is replaced by a snapshot. A reconnecting EventSource
+    sends Last-Event-ID; if the queue has not changed since, no snapshot is
+    repeated.
+
+    Updates broadcast by another process are not seen directly, so an idle
+    stream checks QueueVersion (a cache read) every CHECK_SECONDS and sends a
+    snapshot once its version has been behind for a whole check.
+    """
+
+    def __init__(self, doctor_id, day, last_event_id=None, broadcaster=None,
+                 heartbeat_seconds=HEARTBEAT_SECONDS, check_seconds=CHECK_SECONDS):
+        self.doctor_id = doctor_id
+        self.day = day
+        self.last_event_id = last_event_id
+        self.broadcaster = broadcaster or queue_broadcaster
+        self.heartbeat_seconds = heartbeat_seconds
+        self.check_seconds = check_seconds
+        self.version = None
+        self._behind = None
+        self._written_at = time.monotonic()
+
+    def _event(self, message, text=None):
+        self._written_at = time.monotonic()
+        data = text if text is not None else json.dumps(message)
+        return f"id: {message['version']}\nevent: {message['type']}\ndata: {data}\n\n"
+
+    def snapshot(self):
+        """Full queue; one query per queue version, shared by every stream in this process"""
+        message = self.broadcaster.snapshot(self.doctor_id, self.day)
+        self.version = message['version']
+        return [self._event(message)]
+
+    def opening(self):
+        chunks = [f"retry: {RETRY_MILLISECONDS}\n\n"]
+        if self.last_event_id and self.last_event_id == str(QueueVersion.get(self.doctor_id, self.day)):
+            self.version = int(self.last_event_id)
+            return chunks
+        return chunks + self.snapshot()
+
+    def receive(self, message, text):
+        """Events for one broadcast, and whether a snapshot must be sent instead"""
+        if message['date'] != self.day.isoformat():
+            return [], False
+        if message['type'] == 'delta' and message['base_version'] != self.version:
+            return [], True
+        self.version = message['version']
+        self._behind = None
+        return [self._event(message, text)], False
+
+    def idle(self):
+        """Heartbeat, and whether a snapshot is due because the queue changed elsewhere"""
+        current = QueueVersion.get(self.doctor_id, self.day)
+        if current == self.version:
+            self._behind = None
+        elif current == self._behind:
+            return [], True
+        else:
+            self._behind = current
+        if time.monotonic() - self._written_at < self.heartbeat_seconds:
+            return [], False
+        self._written_at = time.monotonic()
+        return [f": heartbeat {timezone.now().isoformat()}\n\n"], False
+
+    def events(self):
+        """Blocking generator for WSGI servers; holds one worker thread per viewer.
+
+        Only served when QUEUE_STREAM_ALLOW_WSGI is set (e.g. a threaded dev server).
+        """
+        inbox = queue.SimpleQueue()
+        callback = lambda message, text: inbox.put((message, text))
+        self.broadcaster.subscribe(self.doctor_id, callback)
+        try:
+            yield from self.opening()
+            while True:
+                try:
+                    chunks, resync = self.receive(*inbox.get(timeout=self.check_seconds))
+                except queue.Empty:
+                    chunks, resync = self.idle()
+                yield from chunks
+                if resync:
+                    yield from self.snapshot()
+        finally:
+            self.broadcaster.unsubscribe(self.doctor_id, callback)
+
+    async def async_events(self):
+        """Async generator for ASGI servers; database and cache reads run in threads"""
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue()
+        callback = lambda message, text: loop.call_soon_threadsafe(inbox.put_nowait, (message, text))
+        self.broadcaster.subscribe(self.doctor_id, callback)
+        try:
+            for chunk in await sync_to_async(self.opening)():
+                yield chunk
+            while True:
+                try:
+                    update = await asyncio.wait_for(inbox.get(), self.check_seconds)
+                except asyncio.TimeoutError:
+                    chunks, resync = await sync_to_async(self.idle)()
+                else:
+                    chunks, resync = self.receive(*update)
+                if resync:
+                    chunks = chunks + await sync_to_async(self.snapshot)()
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            self.broadcaster.unsubscribe(self.doctor_id, callback)
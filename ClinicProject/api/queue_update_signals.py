@@ -1,79 +1,306 @@
-from django.db.models.signals import post_save, post_delete
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from .models import Token
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .prediction_cache import QueueVersion
+from datetime import timedelta
+import asyncio
+import json
 import logging
+import threading
+import time
+
+try:
+    from channels.layers import InMemoryChannelLayer, get_channel_layer
+    from asgiref.sync import async_to_sync
+except ImportError:
+    get_channel_layer = None
 
 logger = logging.getLogger(__name__)
 
+# Saves for the same doctor and day within this many seconds go out as one broadcast
+COALESCE_SECONDS = getattr(settings, 'QUEUE_BROADCAST_COALESCE_SECONDS', 0.5)
+SEND_TIMEOUT_SECONDS = 10
+ACTIVE_STATUSES = ['in_consultancy', 'confirmed', 'waiting']
+
+
+def queue_group_name(doctor_id):
+    return f"queue_updates_{doctor_id}"
+
+
+class QueueBroadcaster:
+    """Coalesces token changes per (doctor, date) and broadcasts the new queue.
+
+    Signal handlers only record which queue changed, once the transaction
+    commits. A single daemon thread waits out the coalescing window, then
+    builds each changed queue with one query and one model call and sends it
+    to the doctor's channel-layer group, so neither the query nor the send
+    runs on the request thread.
+
+    Clients get a full snapshot on connect and then deltas. Both carry the
+    doctor's QueueVersion; a delta lists the rows that changed since
+    `base_version` (the previous broadcast) and the ids that left the queue.
+
+    Besides the channel layer, every update is handed to in-process listeners
+    (the Server-Sent Events streams), so all viewers of a doctor share the
+    one query per change.
+    """
+
+    def __init__(self, window=COALESCE_SECONDS):
+        self.window = window
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._loop = None
+        # (doctor_id, day) -> (version, rows) of the last broadcast / last snapshot built.
+        # Used by the broadcaster thread and by consumers asking for snapshots.
+        self._sent = {}
+        self._snapshots = {}
+        self._state_lock = threading.Lock()
+        self.broadcasts = 0
+        # doctor_id -> callbacks taking (message, text), called on the broadcaster thread
+        self._listeners = {}
+        self._listeners_lock = threading.Lock()
+
+    def schedule(self, doctor_id, day, event, token_id):
+        """Record a change to (doctor_id, day); it is broadcast within `window` seconds"""
+        with self._condition:
+            pending = self._pending.setdefault((doctor_id, day), {'due': time.monotonic() + self.window, 'changes': []})
+            pending['changes'].append({'event': event, 'token_id': token_id})
+            self._ensure_worker()
+            self._condition.notify()
+
+    def enabled(self):
+        """Whether anyone can receive updates; otherwise token changes cost nothing here.
+
+        An in-memory layer only reaches consumers in this process, so it counts
+        once a consumer has attached its loop; other layers (Redis) always do.
+        In-process listeners count too.
+        """
+        if self._listeners:
+            return True
+        if get_channel_layer is None or not getattr(settings, 'CHANNEL_LAYERS', None):
+            return False
+        if isinstance(get_channel_layer(), InMemoryChannelLayer):
+            return self._loop is not None and not self._loop.is_closed()
+        return True
+
+    def schedule_on_commit(self, doctor_id, day, event, token_id):
+        if not self.enabled():
+            return
+        day = Token._meta.get_field('date').to_python(day)
+        transaction.on_commit(lambda: self.schedule(doctor_id, day, event, token_id))
+
+    def subscribe(self, doctor_id, callback):
+        """Call callback(message, text) with every update of the doctor's queues (any date)"""
+        with self._listeners_lock:
+            self._listeners.setdefault(doctor_id, set()).add(callback)
+
+    def unsubscribe(self, doctor_id, callback):
+        with self._listeners_lock:
+            callbacks = self._listeners.get(doctor_id)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._listeners[doctor_id]
+
+    def notify_listeners(self, doctor_id, message):
+        with self._listeners_lock:
+            callbacks = list(self._listeners.get(doctor_id, ()))
+        if not callbacks:
+            return
+        text = json.dumps(message)
+        for callback in callbacks:
+            try:
+                callback(message, text)
+            except Exception as e:
+                logger.debug(f"Dropping queue update for a closed listener of doctor {doctor_id}: {e}")
+
+    def attach_loop(self, loop):
+        """Send through this event loop (the one serving the WebSocket consumers)"""
+        self._loop = loop
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='queue-broadcaster', daemon=True)
+            self._thread.start()
+
+    def _take_due(self, force=False):
+        """Pop the queues whose window has passed; caller holds the condition"""
+        now = time.monotonic()
+        due = [key for key, pending in self._pending.items() if force or pending['due'] <= now]
+        return {key: self._pending.pop(key)['changes'] for key in due}
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                batch = self._take_due()
+                if not batch:
+                    next_due = min(pending['due'] for pending in self._pending.values())
+                    self._condition.wait(max(0.0, next_due - time.monotonic()))
+                    continue
+            try:
+                self._broadcast(batch)
+            finally:
+                # This thread has its own DB connections; do not leave them open between flushes
+                connections.close_all()
+
+    def flush(self):
+        """Broadcast everything pending now, on the calling thread"""
+        with self._condition:
+            batch = self._take_due(force=True)
+        self._broadcast(batch)
+
+    def _broadcast(self, batch):
+        for (doctor_id, day), changes in batch.items():
+            try:
+                message = self.build_update(doctor_id, day, changes)
+                self.notify_listeners(doctor_id, message)
+                self.send(doctor_id, message)
+                self.broadcasts += 1
+            except Exception as e:
+                logger.error(f"Error broadcasting queue update for doctor {doctor_id} on {day}: {e}")
+
+    @staticmethod
+    def queue_rows(doctor_id, day):
+        """The doctor's active queue for `day` with positions and predicted waits, from one query"""
+        from .waiting_time_predictor import waiting_time_predictor
+
+        tokens = list(Token.objects.filter(doctor_id=doctor_id, date=day).annotate(
+            status_priority=Case(
+                When(status='in_consultancy', then=Value(1)),
+                When(status='confirmed', then=Value(2)),
+                When(status='waiting', then=Value(3)),
+                default=Value(4),
+                output_field=IntegerField(),
+            ),
+        ).order_by('status_priority', F('appointment_time').asc(nulls_last=True), 'created_at').values_list(
+            'id', 'token_number', 'status', 'appointment_time',
+        ))
+        queue = [token for token in tokens if token[2] in ACTIVE_STATUSES]
+        positions = list(range(1, len(queue) + 1))
+
+        now = timezone.now()
+        predictions = [None] * len(queue)
+        if day == timezone.localdate(now):
+            predictions = waiting_time_predictor.predict_queue_positions(doctor_id, len(tokens), positions, now)
+            if predictions is None:
+                # Same heuristic as the predictor's own fallback
+                predictions = [max(5, min(60, position * 10)) for position in positions]
+
+        return [
+            {
+                'id': token_id,
+                'token_number': token_number,
+                'status': status,
+                'appointment_time': appointment_time.isoformat() if appointment_time else None,
+                'position': position,
+                'predicted_wait': 0 if status == 'in_consultancy' else predicted,
+            }
+            for (token_id, token_number, status, appointment_time), position, predicted in zip(queue, positions, predictions)
+        ]
+
+    def _remember(self, store, doctor_id, day, version, rows):
+        # Caller holds _state_lock. Keep today and yesterday; older queues no longer change
+        oldest = timezone.localdate() - timedelta(days=1)
+        for key in [key for key in store if key[1] < oldest]:
+            store.pop(key, None)
+        store[(doctor_id, day)] = (version, rows)
+
+    def snapshot(self, doctor_id, day):
+        """Full-queue message for a new (or out of sync) client; built once per queue version"""
+        version = QueueVersion.get(doctor_id, day)
+        with self._state_lock:
+            cached = self._snapshots.get((doctor_id, day))
+        if cached is None or cached[0] != version:
+            # Built outside the lock; a concurrent build of the same version is harmless
+            cached = (version, self.queue_rows(doctor_id, day))
+            with self._state_lock:
+                self._remember(self._snapshots, doctor_id, day, *cached)
+        return {
+            'type': 'snapshot',
+            'doctor_id': doctor_id,
+            'date': day.isoformat(),
+            'version': cached[0],
+            'queue': cached[1],
+            'timestamp': timezone.now().isoformat(),
+        }
+
+    def build_update(self, doctor_id, day, changes):
+        """Delta against the newest state already sent, or a snapshot when there is none"""
+        version = QueueVersion.get(doctor_id, day)
+        rows = self.queue_rows(doctor_id, day)
+        # Diff against the newest state clients hold: the last broadcast or a later connect snapshot
+        with self._state_lock:
+            known = [state for state in (self._sent.get((doctor_id, day)), self._snapshots.get((doctor_id, day))) if state]
+            previous = max(known, key=lambda state: state[0]) if known else None
+            self._remember(self._sent, doctor_id, day, version, rows)
+            self._remember(self._snapshots, doctor_id, day, version, rows)
+
+        message = {'doctor_id': doctor_id, 'date': day.isoformat(), 'version': version}
+        if previous is None:
+            message.update(type='snapshot', queue=rows)
+        else:
+            old_rows = {row['id']: row for row in previous[1]}
+            new_ids = {row['id'] for row in rows}
+            message.update(
+                type='delta',
+                base_version=previous[0],
+                upserted=[row for row in rows if old_rows.get(row['id']) != row],
+                removed=[token_id for token_id in old_rows if token_id not in new_ids],
+            )
+        message.update(changes=changes, timestamp=timezone.now().isoformat())
+        return message
+
+    def send(self, doctor_id, message):
+        channel_layer = get_channel_layer() if get_channel_layer else None
+        if channel_layer is None:
+            logger.debug(f"No channel layer configured; dropping queue update for doctor {doctor_id}")
+            return
+        # Serialised once here instead of once per connected socket
+        args = (queue_group_name(doctor_id), {'type': 'queue.update', 'message': message, 'text': json.dumps(message)})
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            # The in-memory layer's queues belong to the consumers' loop
+            asyncio.run_coroutine_threadsafe(channel_layer.group_send(*args), loop).result(SEND_TIMEOUT_SECONDS)
+        else:
+            async_to_sync(channel_layer.group_send)(*args)
+
+
+queue_broadcaster = QueueBroadcaster()
+
+
+@receiver(pre_save, sender=Token)
+def remember_queue_before_save(sender, instance, **kwargs):
+    # The slot loaded from the DB; other post_save handlers overwrite it
+    instance._queue_before_save = getattr(instance, '_loaded_slot', None)
+
+
 @receiver(post_save, sender=Token)
 def queue_update_signal(sender, instance, created, **kwargs):
-    """Send real-time queue updates when token status changes"""
+    """Broadcast the doctor's queue after the token change commits"""
     try:
-        channel_layer = get_channel_layer()
-        
-        # Get affected tokens (same doctor, same date)
-        affected_tokens = Token.objects.filter(
-            doctor=instance.doctor,
-            appointment_date=instance.date,
-            status__in=['confirmed', 'in_progress']
-        ).order_by('appointment_time')
-        
-        # Calculate updated wait times
-        from .advanced_wait_predictor import advanced_wait_predictor
-        
-        updates = []
-        for token in affected_tokens:
-            new_wait_time = advanced_wait_predictor.get_predicted_wait_time(token.id)
-            updates.append({
-                'token_id': token.id,
-                'token_number': token.token_number,
-                'patient_name': token.patient.name,
-                'new_wait_time': new_wait_time,
-                'status': token.status,
-                'position_in_queue': list(affected_tokens).index(token) + 1
-            })
-        
-        # Broadcast to WebSocket
-        async_to_sync(channel_layer.group_send)(
-            f"queue_updates_{instance.doctor.id}",
-            {
-                'type': 'queue_update',
-                'message': {
-                    'event': 'token_updated' if not created else 'token_created',
-                    'doctor_id': instance.doctor.id,
-                    'updated_token_id': instance.id,
-                    'queue_updates': updates,
-                    'timestamp': timezone.now().isoformat()
-                }
-            }
+        queue_broadcaster.schedule_on_commit(
+            instance.doctor_id, instance.date, 'token_created' if created else 'token_updated', instance.id
         )
-        
-        logger.info(f"Queue update broadcast for doctor {instance.doctor.id}")
-        
+        previous = getattr(instance, '_queue_before_save', None)
+        current = (instance.doctor_id, Token._meta.get_field('date').to_python(instance.date))
+        if previous and previous[0] and previous[1] and previous[:2] != current:
+            # Moved to another doctor or day: the queue it left changed too
+            queue_broadcaster.schedule_on_commit(previous[0], previous[1], 'token_moved', instance.id)
     except Exception as e:
-        logger.error(f"Error broadcasting queue update: {e}")
+        logger.error(f"Error scheduling queue update for token {instance.pk}: {e}")
+
 
 @receiver(post_delete, sender=Token)
 def queue_delete_signal(sender, instance, **kwargs):
-    """Send updates when token is deleted/cancelled"""
+    """Broadcast the doctor's queue after a token is deleted"""
     try:
-        channel_layer = get_channel_layer()
-        
-        async_to_sync(channel_layer.group_send)(
-            f"queue_updates_{instance.doctor.id}",
-            {
-                'type': 'queue_update',
-                'message': {
-                    'event': 'token_cancelled',
-                    'doctor_id': instance.doctor.id,
-                    'cancelled_token_id': instance.id,
-                    'timestamp': timezone.now().isoformat()
-                }
-            }
-        )
-        
+        queue_broadcaster.schedule_on_commit(instance.doctor_id, instance.date, 'token_cancelled', instance.id)
     except Exception as e:
-        logger.error(f"Error broadcasting queue deletion: {e}")
\ No newline at end of file
+        logger.error(f"Error scheduling queue deletion update for token {instance.pk}: {e}")
@@ -3,6 +3,8 @@ from django.utils import timezone
 from datetime import timedelta
 from .models import Token, Doctor, Clinic
 from .waiting_time_predictor import waiting_time_predictor
+from .clinic_counts import clinic_totals, doctor_status_counts, empty_counts
+from .time_buckets import hourly_counts
 
 class RealTimeDashboard:
     """Enhanced real-time analytics for clinic operations"""
@@ -11,61 +13,59 @@ class RealTimeDashboard:
     def get_clinic_metrics(clinic_id):
         """Get comprehensive real-time metrics for a clinic"""
         today = timezone.now().date()
-        now = timezone.now()
         
-        # Basic counts
+        # Basic counts: every doctor x status count in one query
         today_tokens = Token.objects.filter(clinic_id=clinic_id, date=today)
+        counts_by_doctor = doctor_status_counts(clinic_id, today)
+        totals = clinic_totals(counts_by_doctor)
         
         metrics = {
-            'total_patients_today': today_tokens.count(),
-            'waiting_patients': today_tokens.filter(status='waiting').count(),
-            'confirmed_patients': today_tokens.filter(status='confirmed').count(),
-            'in_consultation': today_tokens.filter(status='in_consultancy').count(),
-            'completed_today': today_tokens.filter(status='completed').count(),
-            'cancelled_today': today_tokens.filter(status='cancelled').count(),
+            'total_patients_today': totals['total'],
+            'waiting_patients': totals['waiting'],
+            'confirmed_patients': totals['confirmed'],
+            'in_consultation': totals['in_consultancy'],
+            'completed_today': totals['completed'],
+            'cancelled_today': totals['cancelled'],
         }
         
         # Doctor workload
         doctor_stats = []
-        doctors = Doctor.objects.filter(clinic_id=clinic_id)
+        doctors = list(Doctor.objects.filter(clinic_id=clinic_id))
+        
+        # AI predictions for all doctors in one batch
+        try:
+            predicted_waits = dict(zip(
+                [doctor.id for doctor in doctors],
+                waiting_time_predictor.predict_many([(doctor.id, None) for doctor in doctors])
+            ))
+        except Exception:
+            predicted_waits = {}
         
         for doctor in doctors:
-            doctor_tokens = today_tokens.filter(doctor=doctor)
-            queue_length = doctor_tokens.filter(status__in=['waiting', 'confirmed']).count()
-            
-            # AI prediction
-            try:
-                predicted_wait = waiting_time_predictor.predict_waiting_time(doctor.id)
-            except:
-                predicted_wait = None
+            counts = counts_by_doctor.get(doctor.id) or empty_counts()
+            queue_length = counts['queue']
+            predicted_wait = predicted_waits.get(doctor.id)
             
             doctor_stats.append({
                 'doctor_id': doctor.id,
                 'doctor_name': doctor.name,
                 'specialization': doctor.specialization,
-                'total_patients': doctor_tokens.count(),
+                'total_patients': counts['total'],
                 'queue_length': queue_length,
-                'completed': doctor_tokens.filter(status='completed').count(),
+                'completed': counts['completed'],
                 'predicted_wait_time': predicted_wait,
                 'status': 'busy' if queue_length > 5 else 'available'
             })
         
         metrics['doctor_stats'] = doctor_stats
         
-        # Hourly distribution
+        # Hourly distribution, bucketed in one query
+        patients_by_hour = hourly_counts(today_tokens)
         hourly_data = []
         for hour in range(9, 18):  # 9 AM to 5 PM
-            hour_start = now.replace(hour=hour, minute=0, second=0, microsecond=0)
-            hour_end = hour_start + timedelta(hours=1)
-            
-            hour_tokens = today_tokens.filter(
-                created_at__gte=hour_start,
-                created_at__lt=hour_end
-            ).count()
-            
             hourly_data.append({
                 'hour': f"{hour}:00",
-                'patients': hour_tokens
+                'patients': patients_by_hour.get(hour, 0)
             })
         
         metrics['hourly_distribution'] = hourly_data
@@ -99,15 +99,12 @@ class RealTimeDashboard:
             same_weekday_dates.append(past_date)
         
         predictions = []
-        current_hour = timezone.now().hour
+        current_hour = timezone.localtime().hour
+        patients_by_hour = hourly_counts(Token.objects.filter(clinic_id=clinic_id, date__in=same_weekday_dates))
         
         for hour in range(current_hour + 1, min(current_hour + 4, 18)):
             # Average patients in this hour on same weekdays
-            avg_patients = Token.objects.filter(
-                clinic_id=clinic_id,
-                date__in=same_weekday_dates,
-                created_at__hour=hour
-            ).count() / len(same_weekday_dates)
+            avg_patients = patients_by_hour.get(hour, 0) / len(same_weekday_dates)
             
             predictions.append({
                 'hour': f"{hour}:00",
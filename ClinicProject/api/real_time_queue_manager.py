@@ -1,7 +1,11 @@
+from django.db.models import Count, Min, Q
 from django.utils import timezone
 from datetime import timedelta
 from .models import Token, Doctor
 from .waiting_time_predictor import waiting_time_predictor
+from .queue_simulator import QueueSimulator
+from .queue_ranks import ranked_tokens
+from .clinic_counts import doctor_status_counts, empty_counts
 from .utils.utils import send_sms_notification
 import logging
 
@@ -42,10 +46,14 @@ class RealTimeQueueManager:
                 'consultation_duration': int((now - current.consultation_start_time).total_seconds() / 60) if current.consultation_start_time else 0
             }
         
-        # Get next 3 patients
-        waiting_tokens = active_tokens.filter(status__in=['waiting', 'confirmed'])[:3]
+        # Get next 3 patients, with simulated start times for the whole queue
+        forecasts = QueueSimulator.forecast([doctor_id], now=now).get(doctor_id, [])
+        next_forecasts = {entry['token_id']: entry for entry in forecasts[:3]}
+        waiting_tokens = Token.objects.filter(id__in=next_forecasts)
+        waiting_tokens = sorted(waiting_tokens, key=lambda t: next_forecasts[t.id]['position'])
         for i, token in enumerate(waiting_tokens):
-            predicted_wait = RealTimeQueueManager._calculate_real_time_wait(token, i)
+            forecast = next_forecasts[token.id]
+            predicted_wait = RealTimeQueueManager._calculate_real_time_wait(token, i, forecast)
             
             queue_status['next_patients'].append({
                 'position': i + 1,
@@ -53,6 +61,10 @@ class RealTimeQueueManager:
                 'appointment_time': token.appointment_time.strftime('%H:%M') if token.appointment_time else 'Walk-in',
                 'status': token.status,
                 'predicted_wait_minutes': predicted_wait,
+                'predicted_wait_range': {
+                    'p10': max(0, int(forecast['p10_minutes'])),
+                    'p90': max(0, int(forecast['p90_minutes'])),
+                },
                 'can_arrive_early': RealTimeQueueManager._can_arrive_early(token)
             })
         
@@ -62,38 +74,15 @@ class RealTimeQueueManager:
         return queue_status
     
     @staticmethod
-    def _calculate_real_time_wait(token, position_in_queue):
+    def _calculate_real_time_wait(token, position_in_queue, forecast=None):
         """Calculate real-time wait based on current queue state"""
-        now = timezone.now()
-        
-        # Base calculation: 12 minutes per person ahead + current consultation time
-        base_wait = position_in_queue * 12
-        
-        # Add current consultation remaining time
-        current_consultation = Token.objects.filter(
-            doctor=token.doctor,
-            date=token.date,
-            status='in_consultancy'
-        ).first()
-        
-        if current_consultation and current_consultation.consultation_start_time:
-            consultation_duration = (now - current_consultation.consultation_start_time).total_seconds() / 60
-            # Assume 15 minutes average consultation, subtract elapsed time
-            remaining_current = max(0, 15 - consultation_duration)
-            base_wait += remaining_current
-        
-        # If it's an appointment, consider scheduled time
-        if token.appointment_time:
-            appointment_datetime = timezone.make_aware(
-                timezone.datetime.combine(token.date, token.appointment_time)
-            )
-            time_until_appointment = (appointment_datetime - now).total_seconds() / 60
-            
-            # If appointment is in future, use the later of calculated wait or time until appointment
-            if time_until_appointment > 0:
-                base_wait = max(base_wait, time_until_appointment)
+        if forecast is None:
+            forecast = QueueSimulator.forecast_by_token([token.doctor_id]).get(token.id)
+        if forecast is None:
+            return 5  # Not queued (already with the doctor or finished)
         
-        return max(5, int(base_wait))
+        # Simulated start time already accounts for the current consultation and booked times
+        return max(5, int(forecast['expected_minutes']))
     
     @staticmethod
     def _can_arrive_early(token):
@@ -139,40 +128,34 @@ class RealTimeQueueManager:
     def _can_accept_walkins(doctor_id):
         """Check if doctor can accept walk-in patients"""
         today = timezone.now().date()
-        now = timezone.now()
         
-        # Check current queue length
-        current_queue = Token.objects.filter(
-            doctor_id=doctor_id,
-            date=today,
-            status__in=['waiting', 'confirmed', 'in_consultancy']
-        ).count()
+        # Check current queue length, whether the doctor is free and the next booked time
+        counts = Token.objects.filter(doctor_id=doctor_id, date=today).aggregate(
+            active=Count('id', filter=Q(status__in=['waiting', 'confirmed', 'in_consultancy'])),
+            in_consultancy=Count('id', filter=Q(status='in_consultancy')),
+            next_appointment=Min('appointment_time', filter=Q(status__in=['waiting', 'confirmed'])),
+        )
+        return RealTimeQueueManager._walkins_open(
+            counts['active'], counts['in_consultancy'], counts['next_appointment'], today
+        )
+    
+    @staticmethod
+    def _walkins_open(active_count, in_consultancy_count, next_appointment, today):
+        """Walk-in rule on a doctor's counts for the day"""
+        now = timezone.now()
         
         # Don't accept walk-ins if queue is too long
-        if current_queue >= 8:
+        if active_count >= 8:
             return False
         
         # Check if doctor is currently free
-        doctor_busy = Token.objects.filter(
-            doctor_id=doctor_id,
-            date=today,
-            status='in_consultancy'
-        ).exists()
-        
-        if doctor_busy:
+        if in_consultancy_count:
             return False
         
         # Check if next appointment is more than 20 minutes away
-        next_appointment = Token.objects.filter(
-            doctor_id=doctor_id,
-            date=today,
-            status__in=['waiting', 'confirmed'],
-            appointment_time__isnull=False
-        ).order_by('appointment_time').first()
-        
         if next_appointment:
             next_appointment_datetime = timezone.make_aware(
-                timezone.datetime.combine(today, next_appointment.appointment_time)
+                timezone.datetime.combine(today, next_appointment)
             )
             time_until_next = (next_appointment_datetime - now).total_seconds() / 60
             
@@ -216,19 +199,16 @@ class RealTimeQueueManager:
         """Notify other patients about queue updates"""
         today = timezone.now().date()
         
-        waiting_patients = Token.objects.filter(
-            doctor_id=doctor_id,
-            date=today,
-            status__in=['waiting', 'confirmed']
-        ).order_by('appointment_time')[:3]
+        # First three patients in queue order, ranked in the same query
+        waiting_patients = ranked_tokens(today, [doctor_id]).filter(queue_rank__lte=3).select_related('patient', 'doctor')
         
-        for i, token in enumerate(waiting_patients):
+        for token in waiting_patients:
             if token.patient.phone_number:
-                if i == 0:
+                if token.queue_rank == 1:
                     message = f"You're next! Dr. {token.doctor.name} will see you shortly."
                 else:
-                    estimated_wait = (i + 1) * 10
-                    message = f"Queue update: You're #{i+1} for Dr. {token.doctor.name}. Estimated wait: {estimated_wait} min."
+                    estimated_wait = token.queue_rank * 10
+                    message = f"Queue update: You're #{token.queue_rank} for Dr. {token.doctor.name}. Estimated wait: {estimated_wait} min."
                 
                 try:
                     send_sms_notification(token.patient.phone_number, message)
@@ -250,35 +230,28 @@ class RealTimeQueueManager:
             'can_accept_walkins': False
         }
         
-        total_queue_length = 0
+        # Every doctor x status count in one query
+        counts_by_doctor = doctor_status_counts(clinic_id, today)
         
         for doctor in doctors:
-            doctor_status = RealTimeQueueManager.get_live_queue_status(doctor.id)
-            
-            # Get doctor's stats for today
-            doctor_tokens = Token.objects.filter(
-                doctor=doctor,
-                date=today
+            counts = counts_by_doctor.get(doctor.id) or empty_counts()
+            can_accept_walkins = RealTimeQueueManager._walkins_open(
+                counts['queue'] + counts['in_consultancy'], counts['in_consultancy'], counts['next_appointment'], today
             )
             
-            completed_today = doctor_tokens.filter(status='completed').count()
-            waiting_count = doctor_tokens.filter(status__in=['waiting', 'confirmed']).count()
-            
-            clinic_overview['total_patients_today'] += doctor_tokens.count()
-            clinic_overview['total_waiting'] += waiting_count
-            clinic_overview['total_completed'] += completed_today
-            
-            total_queue_length += waiting_count
+            clinic_overview['total_patients_today'] += counts['total']
+            clinic_overview['total_waiting'] += counts['queue']
+            clinic_overview['total_completed'] += counts['completed']
             
             clinic_overview['doctors_status'].append({
                 'doctor_id': doctor.id,
                 'doctor_name': doctor.name,
                 'specialization': doctor.specialization,
-                'patients_today': doctor_tokens.count(),
-                'completed_today': completed_today,
-                'current_waiting': waiting_count,
-                'status': 'busy' if doctor_status['current_patient'] else 'available',
-                'can_accept_walkins': doctor_status['can_accept_walkins']
+                'patients_today': counts['total'],
+                'completed_today': counts['completed'],
+                'current_waiting': counts['queue'],
+                'status': 'busy' if counts['in_consultancy'] else 'available',
+                'can_accept_walkins': can_accept_walkins
             })
         
         # Clinic can accept walk-ins if any doctor can
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/queue/<int:doctor_id>/', consumers.QueueConsumer.as_asgi()),
+    path('ws/queue/<int:doctor_id>/<str:date>/', consumers.QueueConsumer.as_asgi()),
+]
@@ -186,14 +186,15 @@ class ClinicWithDoctorsSerializer(serializers.ModelSerializer):
         total_predicted_wait = 0
         doctor_count = 0
         
-        for doctor in obj.doctors.all():
-            try:
-                predicted_wait = waiting_time_predictor.predict_waiting_time(doctor.id)
-                if predicted_wait:
-                    total_predicted_wait += predicted_wait
-                    doctor_count += 1
-            except Exception:
-                pass
+        try:
+            predicted_waits = waiting_time_predictor.predict_many([(doctor.id, None) for doctor in obj.doctors.all()])
+        except Exception:
+            predicted_waits = []
+        
+        for predicted_wait in predicted_waits:
+            if predicted_wait:
+                total_predicted_wait += predicted_wait
+                doctor_count += 1
         
         return round(total_predicted_wait / doctor_count) if doctor_count > 0 else 15
 
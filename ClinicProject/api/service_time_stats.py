@@ -0,0 +1,186 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from datetime import datetime, timedelta
+from .models import Token, DoctorServiceStats
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# How much history a rebuild folds into the rollup
+DEFAULT_WINDOW_DAYS = 60
+
+STAT_FIELDS = (
+    'count', 'delay_sum', 'delay_sum_sq',
+    'early_count', 'early_minutes_sum', 'late_count', 'late_minutes_sum',
+)
+
+
+class ServiceTimeStats:
+    """Per-doctor completion-delay rollup keyed by (doctor, weekday, appointment hour).
+
+    Rows are updated incrementally when a token becomes completed, so the
+    statistics used by the wait predictors are a small aggregate read instead
+    of a scan over weeks of tokens.
+    """
+
+    @staticmethod
+    def delay_minutes(token_date, appointment_time, completed_at):
+        """Minutes between the booked appointment time and completion (negative = early)"""
+        expected = timezone.make_aware(datetime.combine(token_date, appointment_time))
+        return (completed_at - expected).total_seconds() / 60
+
+    @staticmethod
+    def _increments(delay):
+        early = delay < 0
+        return {
+            'count': 1,
+            'delay_sum': delay,
+            'delay_sum_sq': delay * delay,
+            'early_count': 1 if early else 0,
+            'early_minutes_sum': -delay if early else 0.0,
+            'late_count': 0 if early else 1,
+            'late_minutes_sum': 0.0 if early else delay,
+        }
+
+    @staticmethod
+    def record(doctor_id, token_date, appointment_time, completed_at, sign=1):
+        """Add (sign=1) or remove (sign=-1) one completion from the rollup.
+
+        A removal only applies to a completion the rollup can hold: one inside
+        the rebuild window, in a row that has counts. Anything else (e.g. a token
+        completed before the window being reopened) is not in it to remove.
+        """
+        delay = ServiceTimeStats.delay_minutes(token_date, appointment_time, completed_at)
+        key = {'doctor_id': doctor_id, 'weekday': token_date.weekday(), 'hour': appointment_time.hour}
+        increments = ServiceTimeStats._increments(delay)
+
+        if sign < 0:
+            if token_date < timezone.localdate() - timedelta(days=DEFAULT_WINDOW_DAYS):
+                return
+            DoctorServiceStats.objects.filter(count__gt=0, **key).update(
+                **{field: F(field) - value for field, value in increments.items()}
+            )
+            return
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    DoctorServiceStats.objects.get_or_create(**key)
+            except IntegrityError:
+                pass  # Created concurrently
+            DoctorServiceStats.objects.filter(**key).update(
+                **{field: F(field) + value for field, value in increments.items()}
+            )
+
+    @staticmethod
+    def summary(doctor_id, weekday=None, hour=None):
+        """Totals for a doctor, optionally narrowed to a weekday and/or hour, plus mean and std"""
+        rows = DoctorServiceStats.objects.filter(doctor_id=doctor_id)
+        if weekday is not None:
+            rows = rows.filter(weekday=weekday)
+        if hour is not None:
+            rows = rows.filter(hour=hour)
+
+        totals = rows.aggregate(**{field: Sum(field) for field in STAT_FIELDS})
+        stats = {field: totals[field] or 0 for field in STAT_FIELDS}
+        count = stats['count']
+        stats['mean'] = stats['delay_sum'] / count if count else 0.0
+        stats['std'] = math.sqrt(max(0.0, stats['delay_sum_sq'] / count - stats['mean'] ** 2)) if count else 0.0
+        return stats
+
+    @staticmethod
+    def window_tokens(token_model, days=DEFAULT_WINDOW_DAYS):
+        """Completed tokens of the last `days` days that the rollup covers (any status case)"""
+        since = timezone.localdate() - timedelta(days=days)
+        return token_model.objects.filter(
+            status__iexact='completed',
+            completed_at__isnull=False,
+            appointment_time__isnull=False,
+            date__gte=since
+        )
+
+    @staticmethod
+    def rollup(completions):
+        """{(doctor_id, weekday, hour): stat fields} from (doctor_id, date, appointment_time, completed_at) rows"""
+        totals = {}
+        for doctor_id, token_date, appointment_time, completed_at in completions:
+            key = (doctor_id, token_date.weekday(), appointment_time.hour)
+            row = totals.setdefault(key, dict.fromkeys(STAT_FIELDS, 0))
+            delay = ServiceTimeStats.delay_minutes(token_date, appointment_time, completed_at)
+            for field, value in ServiceTimeStats._increments(delay).items():
+                row[field] += value
+        return totals
+
+    @staticmethod
+    def rebuild(days=DEFAULT_WINDOW_DAYS, doctor_ids=None):
+        """Recompute the rollup from the last `days` days of completed tokens"""
+        tokens = ServiceTimeStats.window_tokens(Token, days)
+        if doctor_ids:
+            tokens = tokens.filter(doctor_id__in=doctor_ids)
+        totals = ServiceTimeStats.rollup(tokens.values_list(
+            'doctor_id', 'date', 'appointment_time', 'completed_at'
+        ).iterator())
+
+        with transaction.atomic():
+            existing = DoctorServiceStats.objects.all()
+            if doctor_ids:
+                existing = existing.filter(doctor_id__in=doctor_ids)
+            existing.delete()
+            DoctorServiceStats.objects.bulk_create([
+                DoctorServiceStats(doctor_id=doctor_id, weekday=weekday, hour=hour, **row)
+                for (doctor_id, weekday, hour), row in totals.items()
+            ], batch_size=500)
+        return len(totals)
+
+
+def _completion_key(status, doctor_id, token_date, appointment_time, completed_at):
+    """Normalized (doctor_id, date, appointment_time, completed_at) for a completed token, else None"""
+    if (status or '').lower() != 'completed':
+        return None
+    token_date = Token._meta.get_field('date').to_python(token_date)
+    appointment_time = Token._meta.get_field('appointment_time').to_python(appointment_time)
+    completed_at = Token._meta.get_field('completed_at').to_python(completed_at)
+    if token_date is None or appointment_time is None or completed_at is None:
+        return None
+    return (doctor_id, token_date, appointment_time, completed_at)
+
+
+def _instance_completion(instance):
+    return (instance.status, instance.doctor_id, instance.date, instance.appointment_time, instance.completed_at)
+
+
+@receiver(post_save, sender=Token)
+def record_completion_on_token_save(sender, instance, **kwargs):
+    """Fold a token into the rollup when it becomes completed (and back out if it is reopened)."""
+    try:
+        current = _completion_key(*_instance_completion(instance))
+        loaded = getattr(instance, '_loaded_completion', None)
+        previous = _completion_key(*loaded) if loaded else None
+        instance._loaded_completion = _instance_completion(instance)
+        if previous == current:
+            return
+
+        def apply():
+            if previous:
+                ServiceTimeStats.record(*previous, sign=-1)
+            if current:
+                ServiceTimeStats.record(*current)
+
+        transaction.on_commit(apply)
+    except Exception as e:
+        logger.error(f"Failed to update service stats for token {instance.pk}: {e}")
+
+
+@receiver(post_delete, sender=Token)
+def remove_completion_on_token_delete(sender, instance, **kwargs):
+    try:
+        loaded = getattr(instance, '_loaded_completion', None) or _instance_completion(instance)
+        previous = _completion_key(*loaded)
+        if previous:
+            transaction.on_commit(lambda: ServiceTimeStats.record(*previous, sign=-1))
+    except Exception as e:
+        logger.error(f"Failed to update service stats for deleted token {instance.pk}: {e}")
@@ -0,0 +1,308 @@
+from django.db import transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from datetime import datetime, timedelta, time
+from .models import Token, Doctor, DoctorSchedule, DoctorSlotOccupancy
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Statuses that release a slot for rebooking
+RELEASED_STATUSES = ('cancelled', 'skipped')
+
+DEFAULT_SCHEDULE = {'start_time': time(9, 0), 'end_time': time(17, 0), 'slot_duration_minutes': 15, 'max_slots_per_day': None}
+
+
+def _slot_count(start_time, end_time, slot_duration_minutes, max_slots):
+    """Number of slots in the grid, matching the original datetime loop."""
+    if slot_duration_minutes <= 0:
+        return 0
+    span = (datetime.combine(datetime.min, end_time) - datetime.combine(datetime.min, start_time)).total_seconds()
+    if span <= 0:
+        return 0
+    count = math.ceil(span / (slot_duration_minutes * 60))
+    if max_slots:
+        count = min(count, max_slots)
+    return count
+
+
+def _is_released(status):
+    return (status or '').lower() in RELEASED_STATUSES
+
+
+class SlotOccupancy:
+    """Per-(doctor, date) booked-slot bitmaps derived from DoctorSchedule and Token"""
+
+    @staticmethod
+    def _schedule_for(doctor_id):
+        """Return the schedule grid for a doctor, or None if the doctor does not exist."""
+        schedule = DoctorSchedule.objects.filter(doctor_id=doctor_id).values(
+            'start_time', 'end_time', 'slot_duration_minutes', 'max_slots_per_day'
+        ).first()
+        if schedule is None:
+            if not Doctor.objects.filter(id=doctor_id).exists():
+                return None
+            schedule = DEFAULT_SCHEDULE
+        return schedule
+
+    @staticmethod
+    def _grid_fields(schedule):
+        return {
+            'start_time': schedule['start_time'],
+            'slot_duration_minutes': schedule['slot_duration_minutes'],
+            'slot_count': _slot_count(
+                schedule['start_time'], schedule['end_time'],
+                schedule['slot_duration_minutes'], schedule['max_slots_per_day']
+            ),
+        }
+
+    @staticmethod
+    def slot_index(row, appointment_time):
+        """Index of appointment_time in the row's grid, or None if it is off-grid."""
+        if appointment_time is None:
+            return None
+        offset = (datetime.combine(datetime.min, appointment_time) - datetime.combine(datetime.min, row.start_time)).total_seconds()
+        step = row.slot_duration_minutes * 60
+        if offset < 0 or step <= 0 or offset % step:
+            return None
+        index = int(offset // step)
+        return index if index < row.slot_count else None
+
+    @staticmethod
+    def grid_times(start_time, slot_duration_minutes, slot_count):
+        """Slot start times of a schedule grid, in order."""
+        start = datetime.combine(datetime.min, start_time)
+        step = timedelta(minutes=slot_duration_minutes)
+        return [(start + i * step).time() for i in range(slot_count)]
+
+    @staticmethod
+    def slot_times(row):
+        """All slot start times of the row's grid, in order."""
+        return SlotOccupancy.grid_times(row.start_time, row.slot_duration_minutes, row.slot_count)
+
+    @staticmethod
+    def _build_mask(row, booked_times):
+        mask = 0
+        for booked in booked_times:
+            index = SlotOccupancy.slot_index(row, booked)
+            if index is not None:
+                mask |= 1 << index
+        return mask
+
+    @staticmethod
+    def _encode(mask, slot_count):
+        return mask.to_bytes((slot_count + 7) // 8, 'little')
+
+    @staticmethod
+    def _decode(bitmap):
+        return int.from_bytes(bytes(bitmap), 'little')
+
+    @staticmethod
+    def _booked_times(doctor_id, target_date):
+        return Token.objects.filter(
+            doctor_id=doctor_id, date=target_date, appointment_time__isnull=False
+        ).exclude(status__iexact='cancelled').exclude(status__iexact='skipped').values_list('appointment_time', flat=True)
+
+    @staticmethod
+    def build(doctor_id, target_date):
+        """(Re)build the bitmap for one doctor/day from Token. Returns None for unknown doctors."""
+        schedule = SlotOccupancy._schedule_for(doctor_id)
+        if schedule is None:
+            return None
+        row = DoctorSlotOccupancy(doctor_id=doctor_id, date=target_date, **SlotOccupancy._grid_fields(schedule))
+        mask = SlotOccupancy._build_mask(row, SlotOccupancy._booked_times(doctor_id, target_date))
+        row.bitmap = SlotOccupancy._encode(mask, row.slot_count)
+        try:
+            with transaction.atomic():
+                row, _ = DoctorSlotOccupancy.objects.update_or_create(
+                    doctor_id=doctor_id, date=target_date,
+                    defaults={
+                        'start_time': row.start_time,
+                        'slot_duration_minutes': row.slot_duration_minutes,
+                        'slot_count': row.slot_count,
+                        'bitmap': row.bitmap,
+                    }
+                )
+        except IntegrityError:
+            # Another request built the same row concurrently
+            row = DoctorSlotOccupancy.objects.get(doctor_id=doctor_id, date=target_date)
+        return row
+
+    @staticmethod
+    def get(doctor_id, target_date):
+        """Return the bitmap row for a doctor/day, building it on first use."""
+        row = DoctorSlotOccupancy.objects.filter(doctor_id=doctor_id, date=target_date).first()
+        if row is None:
+            row = SlotOccupancy.build(doctor_id, target_date)
+        return row
+
+    @staticmethod
+    def free_slot_times(row):
+        """Unbooked slot times of a row, found by scanning the bitmap."""
+        mask = SlotOccupancy._decode(row.bitmap)
+        return [slot for i, slot in enumerate(SlotOccupancy.slot_times(row)) if not (mask >> i) & 1]
+
+    @staticmethod
+    def available_slots(doctor_id, target_date):
+        """Available HH:MM strings for a doctor/day, or None if the doctor does not exist."""
+        row = SlotOccupancy.get(doctor_id, target_date)
+        if row is None:
+            return None
+        return [slot.strftime('%H:%M') for slot in SlotOccupancy.free_slot_times(row)]
+
+    @staticmethod
+    def next_available_slots(doctor_ids, start_date=None, days=30, now=None):
+        """Earliest free slot per doctor within [start_date, start_date + days).
+
+        Loads schedules and every non-cancelled booking for all doctors over the
+        window in one query each. Slots at or before the current local time are
+        skipped. Returns {doctor_id: (date, 'HH:MM')}; doctors with nothing free
+        are omitted.
+        """
+        now = now or timezone.localtime()
+        start_date = start_date or now.date()
+        end_date = start_date + timedelta(days=days - 1)
+        doctor_ids = list(Doctor.objects.filter(id__in=doctor_ids).values_list('id', flat=True))
+        if not doctor_ids or days < 1:
+            return {}
+
+        schedules = {
+            s['doctor_id']: s for s in DoctorSchedule.objects.filter(doctor_id__in=doctor_ids).values(
+                'doctor_id', 'start_time', 'end_time', 'slot_duration_minutes', 'max_slots_per_day'
+            )
+        }
+        booked = {}
+        tokens = Token.objects.filter(
+            doctor_id__in=doctor_ids, date__gte=start_date, date__lte=end_date, appointment_time__isnull=False
+        ).exclude(status__iexact='cancelled').exclude(status__iexact='skipped').values_list('doctor_id', 'date', 'appointment_time')
+        for doctor_id, token_date, appointment_time in tokens:
+            booked.setdefault((doctor_id, token_date), set()).add(appointment_time)
+
+        results = {}
+        for doctor_id in doctor_ids:
+            grid = SlotOccupancy._grid_fields(schedules.get(doctor_id, DEFAULT_SCHEDULE))
+            slots = SlotOccupancy.grid_times(grid['start_time'], grid['slot_duration_minutes'], grid['slot_count'])
+            for offset in range(days):
+                day = start_date + timedelta(days=offset)
+                taken = booked.get((doctor_id, day), ())
+                cutoff = now.time() if day == now.date() else None
+                slot = next((t for t in slots if t not in taken and (cutoff is None or t > cutoff)), None)
+                if slot is not None:
+                    results[doctor_id] = (day, slot.strftime('%H:%M'))
+                    break
+        return results
+
+    @staticmethod
+    def earliest_available_slot(doctor_ids, start_date=None, days=30, now=None):
+        """Earliest free slot across doctors as (doctor_id, date, 'HH:MM'); ties keep doctor_ids order."""
+        doctor_ids = list(doctor_ids)
+        found = SlotOccupancy.next_available_slots(doctor_ids, start_date=start_date, days=days, now=now)
+        if not found:
+            return None, None, None
+        order = {doctor_id: i for i, doctor_id in enumerate(doctor_ids)}
+        doctor_id = min(found, key=lambda d: (found[d][0], found[d][1], order.get(d, 0)))
+        return (doctor_id,) + found[doctor_id]
+
+    @staticmethod
+    def set_slot(doctor_id, target_date, appointment_time, booked):
+        """Flip one slot bit. Days without a row are skipped; they are built from Token on first read."""
+        with transaction.atomic():
+            row = DoctorSlotOccupancy.objects.select_for_update().filter(doctor_id=doctor_id, date=target_date).first()
+            if row is None:
+                return
+            index = SlotOccupancy.slot_index(row, appointment_time)
+            if index is None:
+                return
+            mask = SlotOccupancy._decode(row.bitmap)
+            new_mask = mask | (1 << index) if booked else mask & ~(1 << index)
+            if new_mask != mask:
+                row.bitmap = SlotOccupancy._encode(new_mask, row.slot_count)
+                row.save(update_fields=['bitmap', 'updated_at'])
+
+    @staticmethod
+    def invalidate_doctor(doctor_id):
+        """Drop a doctor's bitmaps so they are rebuilt against the current schedule."""
+        DoctorSlotOccupancy.objects.filter(doctor_id=doctor_id).delete()
+
+    @staticmethod
+    def rebuild(start_date, end_date, doctor_ids=None):
+        """Rebuild all bitmaps for booked days in [start_date, end_date]. Returns rows written."""
+        doctors = Doctor.objects.all()
+        if doctor_ids:
+            doctors = doctors.filter(id__in=doctor_ids)
+        doctor_ids = list(doctors.values_list('id', flat=True))
+
+        schedules = {
+            s['doctor_id']: s for s in DoctorSchedule.objects.filter(doctor_id__in=doctor_ids).values(
+                'doctor_id', 'start_time', 'end_time', 'slot_duration_minutes', 'max_slots_per_day'
+            )
+        }
+        booked = {}
+        tokens = Token.objects.filter(
+            doctor_id__in=doctor_ids, date__gte=start_date, date__lte=end_date, appointment_time__isnull=False
+        ).exclude(status__iexact='cancelled').exclude(status__iexact='skipped').values_list('doctor_id', 'date', 'appointment_time')
+        for doctor_id, token_date, appointment_time in tokens.iterator():
+            booked.setdefault((doctor_id, token_date), []).append(appointment_time)
+
+        rows = []
+        for (doctor_id, token_date), times in booked.items():
+            schedule = schedules.get(doctor_id, DEFAULT_SCHEDULE)
+            row = DoctorSlotOccupancy(doctor_id=doctor_id, date=token_date, **SlotOccupancy._grid_fields(schedule))
+            row.bitmap = SlotOccupancy._encode(SlotOccupancy._build_mask(row, times), row.slot_count)
+            rows.append(row)
+
+        with transaction.atomic():
+            DoctorSlotOccupancy.objects.filter(
+                doctor_id__in=doctor_ids, date__gte=start_date, date__lte=end_date
+            ).delete()
+            DoctorSlotOccupancy.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
+
+
+def _as_slot_key(doctor_id, token_date, appointment_time):
+    return (
+        doctor_id,
+        Token._meta.get_field('date').to_python(token_date),
+        Token._meta.get_field('appointment_time').to_python(appointment_time),
+    )
+
+
+@receiver(post_save, sender=Token)
+def sync_slot_on_token_save(sender, instance, **kwargs):
+    """Keep the occupancy bitmap in step with token create/cancel/skip/reschedule."""
+    try:
+        current = _as_slot_key(instance.doctor_id, instance.date, instance.appointment_time)
+        previous = getattr(instance, '_loaded_slot', None)
+        if previous is not None:
+            previous = _as_slot_key(*previous)
+        booked = not _is_released(instance.status)
+        instance._loaded_slot = current
+
+        def apply():
+            if previous and previous != current and previous[2] is not None:
+                SlotOccupancy.set_slot(*previous, booked=False)
+            if current[2] is not None:
+                SlotOccupancy.set_slot(*current, booked=booked)
+
+        transaction.on_commit(apply)
+    except Exception as e:
+        logger.error(f"Failed to update slot occupancy for token {instance.pk}: {e}")
+
+
+@receiver(post_delete, sender=Token)
+def release_slot_on_token_delete(sender, instance, **kwargs):
+    try:
+        if instance.appointment_time is None:
+            return
+        key = _as_slot_key(instance.doctor_id, instance.date, instance.appointment_time)
+        transaction.on_commit(lambda: SlotOccupancy.set_slot(*key, booked=False))
+    except Exception as e:
+        logger.error(f"Failed to release slot occupancy for token {instance.pk}: {e}")
+
+
+@receiver(post_save, sender=DoctorSchedule)
+def reset_occupancy_on_schedule_change(sender, instance, **kwargs):
+    doctor_id = instance.doctor_id
+    transaction.on_commit(lambda: SlotOccupancy.invalidate_doctor(doctor_id))
@@ -3,6 +3,7 @@ from django.dispatch import receiver
 from django.utils import timezone
 from datetime import timedelta, time
 from .models import Token, Doctor
+from .queue_ranks import ranked_tokens
 from .utils.utils import send_sms_notification
 from django_q.tasks import async_task, schedule
 import logging
@@ -157,21 +158,17 @@ def notify_queue_progress(doctor_id):
     """Notify waiting patients that queue is moving faster"""
     today = timezone.now().date()
     
-    # Get all waiting patients for this doctor
-    waiting_patients = Token.objects.filter(
-        doctor_id=doctor_id,
-        date=today,
-        status__in=['waiting', 'confirmed']
-    ).order_by('appointment_time')
+    # Next three waiting patients for this doctor, in queue order with their positions
+    next_patients = list(ranked_tokens(today, [doctor_id]).filter(queue_rank__lte=3).select_related('patient', 'doctor'))
     
-    if waiting_patients.count() > 1:
+    if len(next_patients) > 1:
         # Notify next 2-3 patients
-        for i, token in enumerate(waiting_patients[:3]):
+        for token in next_patients:
             if token.patient.phone_number:
-                if i == 0:
+                if token.queue_rank == 1:
                     message = f"You're next! Dr. {token.doctor.name} will see you shortly."
                 else:
-                    message = f"Queue moving fast! You're #{i+1} for Dr. {token.doctor.name}. Estimated wait: {(i+1)*10} minutes."
+                    message = f"Queue moving fast! You're #{token.queue_rank} for Dr. {token.doctor.name}. Estimated wait: {token.queue_rank*10} minutes."
                 
                 try:
                     send_sms_notification(token.patient.phone_number, message)
@@ -1,7 +1,7 @@
 from django_q.tasks import schedule
 from django_q.models import Schedule
-from .waiting_time_predictor import waiting_time_predictor
 from .auto_training_triggers import AutoTrainingManager
+from .training_jobs import TrainingJobRunner
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,24 +10,34 @@ def train_waiting_time_model():
     """Nightly task to retrain the waiting time prediction model"""
     try:
         logger.info("Starting nightly model training...")
-        success = waiting_time_predictor.train_model()
+        job, ran = TrainingJobRunner.run_now(trigger='nightly')
         
-        if success:
+        if not ran:
+            return f"Training already running as job {job.id}"
+        if job.status == 'succeeded':
             logger.info("Model training completed successfully")
             return "Model trained successfully"
         else:
-            logger.error("Model training failed - insufficient data")
-            return "Training failed - insufficient data"
+            logger.error(f"Model training failed - {job.message}")
+            return f"Training failed - {job.message}"
             
     except Exception as e:
         logger.error(f"Model training error: {str(e)}")
         return f"Training error: {str(e)}"
 
+def rebuild_service_time_stats():
+    """Nightly task to roll the service-time stats window forward"""
+    from .service_time_stats import ServiceTimeStats
+    rows = ServiceTimeStats.rebuild()
+    logger.info(f"Rebuilt service-time stats: {rows} rows")
+    return f"Rebuilt {rows} service-time stat rows"
+
 def setup_ml_schedules():
     """Setup scheduled tasks for ML model training"""
     # Clear existing ML schedules
     Schedule.objects.filter(func='api.tasks_ml.train_waiting_time_model').delete()
     Schedule.objects.filter(name__startswith='auto_training_').delete()
+    Schedule.objects.filter(func='api.tasks_ml.rebuild_service_time_stats').delete()
     
     # Schedule nightly training at 2 AM (full retrain with all data)
     from datetime import datetime, time
@@ -46,6 +56,14 @@ def setup_ml_schedules():
         name='nightly_model_training_full'
     )
     
+    # Rebuild the service-time rollup shortly before training
+    schedule(
+        'api.tasks_ml.rebuild_service_time_stats',
+        schedule_type='D',
+        next_run=next_2am - timezone.timedelta(minutes=30),
+        name='nightly_service_stats_rebuild'
+    )
+    
     # Setup automatic training triggers
     AutoTrainingManager.setup_periodic_training()
     
@@ -1,6 +1,6 @@
 
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from .models import Patient, Clinic, Doctor, Receptionist, Token as ClinicToken
@@ -10,6 +10,21 @@ from unittest.mock import patch
 
 User = get_user_model()
 
+
+def use_shared_cache(test):
+	"""Run `test` against a cache every process can see (files in a temp dir), as with CACHE_REDIS_URL"""
+	import shutil
+	import tempfile
+	from django.test import override_settings
+	location = tempfile.mkdtemp(prefix='clinic-test-cache-')
+	override = override_settings(CACHES={'default': {
+		'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+		'LOCATION': location,
+	}})
+	override.enable()
+	test.addCleanup(shutil.rmtree, location, ignore_errors=True)
+	test.addCleanup(override.disable)
+
 class AuthTests(APITestCase):
 	def setUp(self):
 		self.patient_data = {
@@ -239,3 +254,1309 @@ class StructuredSummaryTests(APITestCase):
 			resp = self.client.get(url, format='json')
 			self.assertEqual(resp.status_code, 200)
 			self.assertIn('summary_text', resp.data)
+
+
+class PatientPhoneLookupTests(APITestCase):
+	def setUp(self):
+		self.web_user = User.objects.create_user(username='webphone', password='pw12345')
+		self.web_patient = Patient.objects.create(user=self.web_user, name='Web', age=30, phone_number='+91 98765-43210')
+		self.ivr_patient = Patient.objects.create(name='IVR', age=0, phone_number='9876543210')
+		self.other_patient = Patient.objects.create(name='Other', age=40, phone_number='+15550009999')
+
+	def test_normalized_phone_kept_in_sync_on_save(self):
+		self.assertEqual(self.web_patient.normalized_phone, '9876543210')
+		self.other_patient.phone_number = '+919812345678'
+		self.other_patient.save(update_fields=['phone_number'])
+		self.other_patient.refresh_from_db()
+		self.assertEqual(self.other_patient.normalized_phone, '9812345678')
+
+	def test_resolve_patient_ids_by_phone(self):
+		from .views import resolve_patient_ids_by_phone
+		ids = resolve_patient_ids_by_phone('+919876543210')
+		self.assertEqual(sorted(ids), sorted([self.web_patient.id, self.ivr_patient.id]))
+		self.assertEqual(resolve_patient_ids_by_phone(None), [])
+
+	def test_resolve_patient_ids_always_includes_the_patient(self):
+		from .views import resolve_patient_ids
+		self.assertEqual(sorted(resolve_patient_ids(self.web_patient)), sorted([self.web_patient.id, self.ivr_patient.id]))
+		# A phone that does not normalize still resolves to the caller's own record
+		odd = Patient.objects.create(name='No Phone', age=30, phone_number='')
+		self.assertEqual(resolve_patient_ids(odd), [odd.id])
+
+	def test_migration_backfills_existing_patients(self):
+		from importlib import import_module
+		from django.apps import apps
+		migration = import_module('api.migrations.0014_patient_normalized_phone')
+		Patient.objects.update(normalized_phone='')
+		migration.backfill_normalized_phones(apps, None)
+		self.web_patient.refresh_from_db()
+		self.assertEqual(self.web_patient.normalized_phone, '9876543210')
+
+	def test_backfill_command_fills_missing_values(self):
+		from django.core.management import call_command
+		from io import StringIO
+		Patient.objects.update(normalized_phone='')
+		call_command('backfill_normalized_phones', '--chunk-size', '2', stdout=StringIO())
+		self.assertEqual(
+			set(Patient.objects.values_list('normalized_phone', flat=True)),
+			{'9876543210', '5550009999'}
+		)
+
+
+class SlotOccupancyTests(APITestCase):
+	def setUp(self):
+		from .models import DoctorSchedule
+		self.clinic = Clinic.objects.create(name='Slot Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Slot', specialization='General', clinic=self.clinic)
+		DoctorSchedule.objects.create(doctor=self.doctor, start_time='09:00', end_time='10:00', slot_duration_minutes=15)
+		self.patient = Patient.objects.create(name='Slot Patient', age=30, phone_number='+15551112222')
+		self.day = timezone.now().date() + timezone.timedelta(days=1)
+		self.day_str = self.day.strftime('%Y-%m-%d')
+
+	def _slots(self):
+		from .views import _get_available_slots_for_doctor
+		return _get_available_slots_for_doctor(self.doctor.id, self.day_str)
+
+	def test_booking_and_cancelling_update_bitmap(self):
+		from datetime import time
+		self.assertEqual(self._slots(), ['09:00', '09:15', '09:30', '09:45'])
+		with self.captureOnCommitCallbacks(execute=True):
+			token = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.day, appointment_time=time(9, 15))
+		self.assertEqual(self._slots(), ['09:00', '09:30', '09:45'])
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'cancelled'
+			token.save(update_fields=['status'])
+		self.assertEqual(self._slots(), ['09:00', '09:15', '09:30', '09:45'])
+
+	def test_unknown_doctor_and_bad_date(self):
+		from .views import _get_available_slots_for_doctor
+		self.assertIsNone(_get_available_slots_for_doctor(999999, self.day_str))
+		self.assertIsNone(_get_available_slots_for_doctor(self.doctor.id, 'not-a-date'))
+
+	def test_schedule_change_and_rebuild_command(self):
+		from datetime import time
+		from django.core.management import call_command
+		from io import StringIO
+		self._slots()
+		# Bypass the signals to simulate a drifted bitmap, then rebuild from Token
+		ClinicToken.objects.bulk_create([ClinicToken(patient=self.patient, doctor=self.doctor, clinic=self.clinic, date=self.day, appointment_time=time(9, 30))])
+		self.assertIn('09:30', self._slots())
+		call_command('rebuild_slot_occupancy', '--from_date', self.day_str, '--days', '1', stdout=StringIO())
+		self.assertEqual(self._slots(), ['09:00', '09:15', '09:45'])
+		with self.captureOnCommitCallbacks(execute=True):
+			schedule = self.doctor.schedule
+			schedule.end_time = time(9, 30)
+			schedule.save()
+		self.assertEqual(self._slots(), ['09:00', '09:15'])
+
+
+class NextAvailableSlotTests(APITestCase):
+	def setUp(self):
+		from .models import DoctorSchedule
+		self.clinic = Clinic.objects.create(name='Range Clinic', address='Addr', city='City')
+		self.doc_a = Doctor.objects.create(name='Dr A', specialization='ENT', clinic=self.clinic)
+		self.doc_b = Doctor.objects.create(name='Dr B', specialization='ENT', clinic=self.clinic)
+		for doc in (self.doc_a, self.doc_b):
+			DoctorSchedule.objects.create(doctor=doc, start_time='09:00', end_time='09:30', slot_duration_minutes=15)
+		self.patient = Patient.objects.create(name='Range Patient', age=30, phone_number='+15553334444')
+		self.now = timezone.localtime().replace(hour=8, minute=0)
+		self.tomorrow = self.now.date() + timezone.timedelta(days=1)
+
+	def test_single_query_window_search(self):
+		from datetime import time
+		from .slot_occupancy import SlotOccupancy
+		# Doctor A is full today; doctor B has 09:15 free today
+		for t in (time(9, 0), time(9, 15)):
+			ClinicToken.objects.create(patient=self.patient, doctor=self.doc_a, date=self.now.date(), appointment_time=t)
+		ClinicToken.objects.create(patient=self.patient, doctor=self.doc_b, date=self.now.date(), appointment_time=time(9, 0))
+		with self.assertNumQueries(3):
+			found = SlotOccupancy.next_available_slots([self.doc_a.id, self.doc_b.id], now=self.now)
+		self.assertEqual(found[self.doc_a.id], (self.tomorrow, '09:00'))
+		self.assertEqual(found[self.doc_b.id], (self.now.date(), '09:15'))
+		self.assertEqual(
+			SlotOccupancy.earliest_available_slot([self.doc_a.id, self.doc_b.id], now=self.now),
+			(self.doc_b.id, self.now.date(), '09:15')
+		)
+
+	def test_past_slots_skipped_today(self):
+		from .slot_occupancy import SlotOccupancy
+		late = self.now.replace(hour=9, minute=20)
+		found = SlotOccupancy.next_available_slots([self.doc_a.id], now=late)
+		self.assertEqual(found[self.doc_a.id], (self.tomorrow, '09:00'))
+
+
+class ModelHolderTests(APITestCase):
+	def setUp(self):
+		import tempfile
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder
+		self.tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmpdir.cleanup)
+		self.registry = ModelRegistry(self.tmpdir.name, keep=2)
+		self.holder = ModelHolder(self.registry)
+		self.holder.CHECK_INTERVAL = 0
+
+	def _register(self, model, scaler, **kwargs):
+		return self.registry.register(model, scaler, metadata={'feature_spec': self.holder.feature_spec.to_dict()}, **kwargs)
+
+	def test_empty_registry_returns_none(self):
+		self.assertIsNone(self.holder.get())
+
+	def test_loads_once_until_pointer_moves(self):
+		self._register({'v': 1}, {'s': 1})
+		self.assertEqual(self.holder.get().model, {'v': 1})
+		self.holder.get()
+		self.assertEqual(self.holder.reloads, 1)
+
+		self._register({'v': 2}, {'s': 2})
+		bundle = self.holder.get()
+		self.assertEqual((bundle.model, bundle.scaler), ({'v': 2}, {'s': 2}))
+		self.assertEqual(self.holder.reloads, 2)
+
+	def test_unpromoted_version_is_not_loaded(self):
+		first = self._register({'v': 1}, {'s': 1})
+		self._register({'v': 2}, {'s': 2}, promote=False)
+		self.assertEqual(self.holder.get().version, first)
+
+	def test_incompatible_version_rejected_once(self):
+		import numpy as np
+		from sklearn.preprocessing import StandardScaler
+		self._register({'v': 1}, StandardScaler().fit(np.zeros((2, 11))))
+		with patch.object(self.registry, 'load', wraps=self.registry.load) as load:
+			self.assertIsNone(self.holder.get())
+			self.assertIsNone(self.holder.get())
+		self.assertEqual(load.call_count, 1)
+		self.assertEqual(self.holder.reloads, 0)
+
+	def test_publish_skips_disk_reload(self):
+		version = self._register({'v': 1}, {'s': 1})
+		self.holder.publish({'v': 'trained'}, {'s': 'trained'}, version)
+		self.assertEqual(self.holder.get().model, {'v': 'trained'})
+		self.assertEqual(self.holder.reloads, 0)
+
+	def test_rollback_and_retention(self):
+		versions = [self._register({'v': i}, {'s': i}) for i in range(3)]
+		# keep=2 prunes the oldest version
+		self.assertEqual(self.registry.versions(), versions[:0:-1])
+		self.assertEqual(self.registry.rollback(), versions[1])
+		self.assertEqual(self.holder.get().model, {'v': 1})
+		with self.assertRaises(ValueError):
+			self.registry.rollback()
+		self.registry.promote(versions[2])
+		self.assertEqual(self.holder.get().model, {'v': 2})
+		self.assertEqual([meta['current'] for meta in self.registry.list_versions()], [True, False])
+
+
+class TrainingDataMixin:
+	def _create_training_tokens(self):
+		from datetime import datetime, time, timedelta, timezone as dt_timezone
+		clinic = Clinic.objects.create(name='ML Clinic', address='Addr', city='City')
+		self.doctors = [
+			Doctor.objects.create(name=f'Dr ML {i}', specialization='GP', clinic=clinic) for i in range(2)
+		]
+		patient = Patient.objects.create(name='ML Patient', age=40, phone_number='+15557778888')
+		# Arrivals between 04:00 and 09:00 UTC so the UTC and clinic-local days agree
+		base = datetime(2025, 3, 3, 4, 0, tzinfo=dt_timezone.utc)
+		statuses = ['completed', 'completed', 'waiting', 'completed', 'cancelled', 'completed']
+		for day in range(3):
+			for slot in range(12):
+				doctor = self.doctors[slot % 2]
+				arrival = base + timedelta(days=day, minutes=25 * slot)
+				token = ClinicToken.objects.create(
+					patient=patient, doctor=doctor, date=arrival.date(),
+					appointment_time=time(9 + slot // 4, 15 * (slot % 4)),
+					status=statuses[slot % len(statuses)],
+				)
+				fields = {'created_at': arrival}
+				if token.status == 'completed':
+					fields.update(
+						consultation_start_time=arrival + timedelta(minutes=7 * slot - 10),
+						completed_at=arrival + timedelta(minutes=7 * slot),
+					)
+				ClinicToken.objects.filter(pk=token.pk).update(**fields)
+
+
+class TrainingDataBuilderTests(TrainingDataMixin, APITestCase):
+	def setUp(self):
+		self._create_training_tokens()
+
+	def _reference_features(self):
+		"""The original per-token implementation (two COUNT queries per row)"""
+		import numpy as np
+		features, targets = [], []
+		tokens = ClinicToken.objects.filter(
+			status='completed', completed_at__isnull=False,
+			appointment_time__isnull=False, consultation_start_time__isnull=False
+		).order_by('id')
+		for token in tokens:
+			day_tokens = ClinicToken.objects.filter(doctor=token.doctor, created_at__date=token.created_at.date())
+			features.append([
+				token.created_at.hour,
+				token.created_at.weekday(),
+				day_tokens.count(),
+				day_tokens.filter(created_at__lt=token.created_at).count() + 1,
+				token.doctor_id,
+			])
+			targets.append(max(0, (token.consultation_start_time - token.created_at).total_seconds() / 60))
+		return np.array(features), np.array(targets)
+
+	def test_matches_per_token_implementation(self):
+		import numpy as np
+		from .waiting_time_predictor import WaitingTimePredictor
+		expected_X, expected_y = self._reference_features()
+		with self.assertNumQueries(1):
+			X, y = WaitingTimePredictor().prepare_training_data(use_all_data=True)
+		np.testing.assert_array_equal(X, expected_X)
+		np.testing.assert_allclose(y, expected_y)
+
+	def test_trained_model_round_trip(self):
+		import tempfile
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, WaitingTimePredictor
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		trainer = WaitingTimePredictor(ModelHolder(ModelRegistry(tmpdir.name)))
+		self.assertTrue(trainer.train_model())
+		metadata = trainer.registry.list_versions()[0]
+		self.assertEqual(metadata['training_rows'], 24)
+		self.assertIn('mae', metadata['metrics'])
+
+		# A fresh process picks the version up from disk and accepts its saved spec
+		predictor = WaitingTimePredictor(ModelHolder(ModelRegistry(tmpdir.name)))
+		bundle = predictor.holder.get()
+		self.assertIsNotNone(bundle)
+
+		now = timezone.now()
+		doctor_id = self.doctors[0].id
+		load = ClinicToken.objects.filter(doctor_id=doctor_id, date=now.date()).count()
+		queue = ClinicToken.objects.filter(
+			doctor_id=doctor_id, date=now.date(), status__in=['waiting', 'confirmed', 'in_consultancy']
+		).count()
+		expected = bundle.model.predict(bundle.scaler.transform([[now.hour, now.weekday(), load, queue + 1, doctor_id]]))[0]
+		self.assertEqual(predictor.predict_waiting_time(doctor_id, current_time=now), round(max(0, min(120, expected))))
+		self.assertEqual(
+			predictor.predict_from_queue_state(doctor_id, load, queue + 1, current_time=now),
+			predictor.predict_many([(doctor_id, None), (self.doctors[1].id, None)], current_time=now)[0]
+		)
+
+	def test_interval_predictions_from_tree_spread(self):
+		import tempfile
+		import numpy as np
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, WaitingTimePredictor
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		predictor = WaitingTimePredictor(ModelHolder(ModelRegistry(tmpdir.name)))
+		self.assertTrue(predictor.train_model())
+
+		now = timezone.now()
+		requests = [(doctor.id, None) for doctor in self.doctors]
+		intervals = predictor.predict_intervals_many(requests, current_time=now)
+		self.assertEqual([i['expected'] for i in intervals], predictor.predict_many(requests, current_time=now))
+
+		bundle = predictor.holder.get()
+		load = ClinicToken.objects.filter(doctor_id=self.doctors[0].id, date=now.date()).count()
+		row = bundle.scaler.transform([[now.hour, now.weekday(), load, 1, self.doctors[0].id]])
+		per_tree = [tree.predict(row)[0] for tree in bundle.model.estimators_]
+		self.assertEqual(intervals[0]['p90'], round(min(120, max(0, np.percentile(per_tree, 90)))))
+		for interval in intervals:
+			self.assertLessEqual(interval['p10'], interval['p50'])
+			self.assertLessEqual(interval['p50'], interval['p90'])
+
+	def test_insufficient_data(self):
+		from .waiting_time_predictor import WaitingTimePredictor
+		ClinicToken.objects.filter(status='completed').update(status='waiting')
+		self.assertEqual(WaitingTimePredictor().prepare_training_data(), (None, None))
+
+
+class PredictManyTests(APITestCase):
+	def setUp(self):
+		import tempfile
+		from datetime import time
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, WaitingTimePredictor
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		# Empty registry, so the queue-based fallback is exercised
+		self.predictor = WaitingTimePredictor(ModelHolder(ModelRegistry(tmpdir.name)))
+		clinic = Clinic.objects.create(name='Batch Clinic', address='Addr', city='City')
+		self.busy = Doctor.objects.create(name='Dr Busy', specialization='GP', clinic=clinic)
+		self.idle = Doctor.objects.create(name='Dr Idle', specialization='GP', clinic=clinic)
+		patient = Patient.objects.create(name='Batch Patient', age=50, phone_number='+15552223333')
+		self.now = timezone.now()
+		for hour, status_value in ((9, 'waiting'), (10, 'confirmed'), (11, 'completed'), (12, 'waiting')):
+			ClinicToken.objects.create(
+				patient=patient, doctor=self.busy, date=self.now.date(),
+				appointment_time=time(hour, 0), status=status_value
+			)
+
+	def test_batch_matches_single_predictions(self):
+		from datetime import time
+		requests = [
+			(self.busy.id, None),
+			(self.busy.id, time(9, 0)),
+			(self.busy.id, time(11, 30)),
+			(self.idle.id, None),
+		]
+		expected = [
+			self.predictor.predict_waiting_time(doctor_id, current_time=self.now, for_appointment_time=appointment_time)
+			for doctor_id, appointment_time in requests
+		]
+		with self.assertNumQueries(2):
+			results = self.predictor.predict_many(requests, current_time=self.now)
+		self.assertEqual(results, expected)
+		self.assertEqual(results, [40, 10, 30, 5])
+
+	def test_fallback_interval_band(self):
+		interval = self.predictor.predict_waiting_time_interval(self.busy.id, current_time=self.now)
+		self.assertEqual(interval, {'expected': 40, 'p10': 20, 'p50': 40, 'p90': 60})
+
+	def test_walk_in_batch_uses_single_grouped_query(self):
+		with self.assertNumQueries(1):
+			self.predictor.predict_many([(self.busy.id, None), (self.idle.id, None)], current_time=self.now)
+		self.assertEqual(self.predictor.predict_many([]), [])
+
+
+class ServiceTimeStatsTests(APITestCase):
+	def setUp(self):
+		clinic = Clinic.objects.create(name='Stats Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Stats', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='Stats Patient', age=35, phone_number='+15554445555')
+		self.day = timezone.now().date() - timezone.timedelta(days=7)
+
+	def _complete(self, appointment_time, offset_minutes):
+		from datetime import datetime
+		token = ClinicToken.objects.create(
+			patient=self.patient, doctor=self.doctor, date=self.day, appointment_time=appointment_time
+		)
+		expected = timezone.make_aware(datetime.combine(self.day, appointment_time))
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'completed'
+			token.completed_at = expected + timezone.timedelta(minutes=offset_minutes)
+			token.save()
+		return token
+
+	def _rows(self):
+		from .models import DoctorServiceStats
+		return sorted(
+			DoctorServiceStats.objects.filter(count__gt=0).values_list('weekday', 'hour', 'count', 'delay_sum', 'early_count', 'late_count')
+		)
+
+	def test_incremental_updates_match_rebuild(self):
+		from datetime import time
+		from .service_time_stats import ServiceTimeStats
+		from .waiting_time_predictor import waiting_time_predictor
+		from .clinic_wait_stats import ClinicWaitStats
+		for appointment_time, offset in ((time(9, 0), -10), (time(9, 30), 20), (time(10, 0), 6), (time(10, 15), -4)):
+			self._complete(appointment_time, offset)
+
+		incremental = self._rows()
+		ServiceTimeStats.rebuild()
+		self.assertEqual(self._rows(), incremental)
+
+		weekday = self.day.weekday()
+		self.assertEqual(waiting_time_predictor.get_early_completion_rate(self.doctor.id, weekday), 0.5)
+		self.assertEqual(waiting_time_predictor.get_avg_early_time(self.doctor.id, weekday), 7.0)
+		self.assertEqual(ClinicWaitStats.get_doctor_avg_wait_time(self.doctor.id), 13)
+		self.assertEqual(ServiceTimeStats.summary(self.doctor.id, hour=9)['mean'], 5.0)
+
+	def test_reopened_and_deleted_tokens_are_backed_out(self):
+		from datetime import time
+		from .service_time_stats import ServiceTimeStats
+		token = self._complete(time(11, 0), 5)
+		self._complete(time(11, 30), -5)
+		self.assertEqual(ServiceTimeStats.summary(self.doctor.id)['count'], 2)
+
+		token = ClinicToken.objects.get(pk=token.pk)
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'waiting'
+			token.save()
+		self.assertEqual(ServiceTimeStats.summary(self.doctor.id)['delay_sum'], -5)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			ClinicToken.objects.filter(status='completed').delete()
+		self.assertEqual(ServiceTimeStats.summary(self.doctor.id)['count'], 0)
+
+	def test_backing_out_a_completion_outside_the_rollup_changes_nothing(self):
+		from datetime import time
+		from .service_time_stats import DEFAULT_WINDOW_DAYS, ServiceTimeStats
+		self.day = timezone.localdate() - timezone.timedelta(days=DEFAULT_WINDOW_DAYS + 5)
+		old = self._complete(time(11, 0), 5)
+		ServiceTimeStats.rebuild()
+		self.assertEqual(self._rows(), [])
+
+		# Reopening a token completed before the window must not create or drive a row negative
+		with self.captureOnCommitCallbacks(execute=True):
+			old.status = 'waiting'
+			old.save()
+		from .models import DoctorServiceStats
+		self.assertFalse(DoctorServiceStats.objects.filter(count__lt=0).exists())
+		self.assertEqual(ServiceTimeStats.summary(self.doctor.id)['count'], 0)
+
+	def test_rebuild_keeps_mixed_case_completions(self):
+		from datetime import time
+		from .service_time_stats import ServiceTimeStats
+		token = self._complete(time(9, 0), 10)
+		ClinicToken.objects.filter(pk=token.pk).update(status='Completed')
+		ServiceTimeStats.rebuild()
+		self.assertEqual(ServiceTimeStats.summary(self.doctor.id)['count'], 1)
+
+	def test_migrations_seed_the_rollup_and_schedule_the_rebuild(self):
+		from datetime import time
+		from importlib import import_module
+		from django.apps import apps
+		from django_q.models import Schedule
+		from .models import DoctorServiceStats
+		self.assertTrue(Schedule.objects.filter(func='api.tasks_ml.rebuild_service_time_stats').exists())
+
+		self._complete(time(9, 0), 10)
+		DoctorServiceStats.objects.all().delete()
+		import_module('api.migrations.0016_doctorservicestats').seed_service_stats(apps, None)
+		self.assertEqual(self._rows(), [(self.day.weekday(), 9, 1, 10.0, 0, 1)])
+
+
+class TrainingJobTests(TrainingDataMixin, APITestCase):
+	def setUp(self):
+		import tempfile
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, waiting_time_predictor
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		holder = ModelHolder(ModelRegistry(tmpdir.name))
+		for name, value in (('holder', holder), ('registry', holder.registry)):
+			patcher = patch.object(waiting_time_predictor, name, value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def test_concurrent_requests_coalesce(self):
+		from .training_jobs import TrainingJobRunner
+		with patch('api.training_jobs.async_task') as enqueue:
+			with self.captureOnCommitCallbacks(execute=True):
+				first, created = TrainingJobRunner.submit()
+				second, created_again = TrainingJobRunner.submit(trigger='auto')
+		self.assertTrue(created)
+		self.assertFalse(created_again)
+		self.assertEqual(first.id, second.id)
+		enqueue.assert_called_once()
+		self.assertEqual(enqueue.call_args.args[1], first.id)
+
+	def test_failed_job_releases_lock(self):
+		from .training_jobs import TrainingJobRunner
+		job, _ = TrainingJobRunner._claim('manual')
+		job = TrainingJobRunner.run(job.id)
+		self.assertEqual(job.status, 'failed')
+		self.assertIsNone(TrainingJobRunner.active_job())
+
+	def test_claim_retries_when_the_active_job_finishes_meanwhile(self):
+		from .training_jobs import TrainingJobRunner
+		running, _ = TrainingJobRunner._claim('manual')
+		lookup = TrainingJobRunner.active_job
+
+		def finished_before_lookup():
+			TrainingJobRunner._finish(running.id, 'succeeded')
+			return lookup()
+
+		with patch.object(TrainingJobRunner, 'active_job', side_effect=finished_before_lookup):
+			job, created = TrainingJobRunner._claim('auto')
+		self.assertTrue(created)
+		self.assertNotEqual(job.id, running.id)
+		self.assertEqual(TrainingJobRunner.active_job(), job)
+
+	def test_job_reports_phases_and_version(self):
+		from .training_jobs import TrainingJobRunner
+		from .waiting_time_predictor import waiting_time_predictor
+		self._create_training_tokens()
+		job, _ = TrainingJobRunner._claim('manual')
+		with patch.object(TrainingJobRunner, 'report', wraps=TrainingJobRunner.report) as report:
+			job = TrainingJobRunner.run(job.id)
+		self.assertEqual([c.args[1] for c in report.call_args_list], ['loading', 'features', 'fit', 'eval', 'save', 'done'])
+		self.assertEqual((job.status, job.phase, job.progress), ('succeeded', 'done', 100))
+		self.assertEqual(job.model_version, waiting_time_predictor.registry.current_version())
+		self.assertIn('mae', job.metrics)
+		# Fitted on every core, published single-threaded for the web workers
+		self.assertEqual(waiting_time_predictor.holder.get().model.n_jobs, 1)
+		self.assertEqual(waiting_time_predictor.registry.load(job.model_version, flat=False)[0].n_jobs, 1)
+
+	def test_train_endpoint_returns_job(self):
+		User = get_user_model()
+		staff = User.objects.create_user(username='trainer', password='pw', is_staff=True)
+		self.client.force_authenticate(staff)
+		with patch('api.training_jobs.async_task'):
+			response = self.client.post('/api/waiting-time/train/')
+		self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+		job_id = response.data['job']['job_id']
+		response = self.client.get(f'/api/waiting-time/train/{job_id}/')
+		self.assertEqual(response.data['job']['status'], 'queued')
+
+
+class QueueSimulatorTests(APITestCase):
+	def setUp(self):
+		clinic = Clinic.objects.create(name='Sim Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Sim', specialization='GP', clinic=clinic)
+		self.other = Doctor.objects.create(name='Dr Quiet', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='Sim Patient', age=40, phone_number='+15556667777')
+		self.now = timezone.now()
+
+	def _queue(self):
+		current = ClinicToken.objects.create(
+			patient=self.patient, doctor=self.doctor, date=self.now.date(), status='in_consultancy',
+			consultation_start_time=self.now - timezone.timedelta(minutes=5)
+		)
+		waiting = [
+			ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.now.date(), status='waiting')
+			for _ in range(3)
+		]
+		return current, waiting
+
+	def test_forecast_orders_queue_in_two_queries(self):
+		from .queue_simulator import QueueSimulator
+		_, waiting = self._queue()
+		with self.assertNumQueries(2):
+			forecasts = QueueSimulator.forecast([self.doctor.id, self.other.id], now=self.now, seed=7)
+		self.assertEqual(forecasts[self.other.id], [])
+		queue = forecasts[self.doctor.id]
+		self.assertEqual([entry['token_id'] for entry in queue], [token.id for token in waiting])
+		expected = [entry['expected_minutes'] for entry in queue]
+		self.assertEqual(expected, sorted(expected))
+		for entry in queue:
+			self.assertLessEqual(entry['p10_minutes'], entry['expected_minutes'])
+			self.assertLessEqual(entry['expected_minutes'], entry['p90_minutes'])
+		# Same seed, same forecast
+		self.assertEqual(QueueSimulator.forecast([self.doctor.id], now=self.now, seed=7)[self.doctor.id], queue)
+
+	def test_appointment_time_floors_start(self):
+		from .queue_simulator import QueueSimulator
+		queues = {1: {'elapsed': None, 'tokens': [(10, 0.0), (11, 90.0), (12, 0.0)]}}
+		samples = {1: QueueSimulator.quantile_grid([10.0] * 20)}
+		queue = QueueSimulator.simulate(queues, samples, seed=1)[1]
+		self.assertEqual([entry['expected_minutes'] for entry in queue], [0.0, 90.0, 100.0])
+
+	def test_current_consultation_uses_remaining_time(self):
+		from .queue_simulator import QueueSimulator
+		queues = {1: {'elapsed': 4.0, 'tokens': [(10, 0.0)]}}
+		samples = {1: QueueSimulator.quantile_grid([10.0] * 20)}
+		self.assertEqual(QueueSimulator.simulate(queues, samples, seed=1)[1][0]['expected_minutes'], 6.0)
+		# Overrunning every recorded consultation leaves only a short buffer
+		queues[1]['elapsed'] = 30.0
+		self.assertEqual(QueueSimulator.simulate(queues, samples, seed=1)[1][0]['expected_minutes'], 2.0)
+
+	def test_live_queue_status_uses_forecast(self):
+		from .real_time_queue_manager import RealTimeQueueManager
+		_, waiting = self._queue()
+		queue_status = RealTimeQueueManager.get_live_queue_status(self.doctor.id)
+		next_patients = queue_status['next_patients']
+		self.assertEqual([p['token_number'] for p in next_patients], [t.token_number for t in waiting])
+		for patient in next_patients:
+			self.assertGreaterEqual(patient['predicted_wait_minutes'], 5)
+			self.assertLessEqual(patient['predicted_wait_range']['p10'], patient['predicted_wait_range']['p90'])
+
+
+class PredictionCacheTests(APITestCase):
+	def setUp(self):
+		import tempfile
+		from django.core.cache import cache
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, WaitingTimePredictor
+		from .prediction_cache import PredictionCache
+		cache.clear()
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		self.predictor = WaitingTimePredictor(ModelHolder(ModelRegistry(tmpdir.name)))
+		self.cache = PredictionCache(maxsize=2)
+		clinic = Clinic.objects.create(name='Cache Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Cache', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='Cache Patient', age=30, phone_number='+15558889999')
+		self.now = timezone.now()
+
+	def _interval(self, appointment_time=None):
+		return self.cache.interval(self.doctor.id, current_time=self.now, appointment_time=appointment_time, predictor=self.predictor)
+
+	def test_repeat_lookup_hits_until_queue_changes(self):
+		first = self._interval()
+		with self.assertNumQueries(0):
+			self.assertEqual(self._interval(), first)
+		self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+		with self.captureOnCommitCallbacks(execute=True):
+			token = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=timezone.localdate(self.now))
+		self.assertNotEqual(self._interval(), first)
+		self.assertEqual(self.cache.misses, 2)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'cancelled'
+			token.save()
+		self.assertEqual(self._interval(), first)
+		self.assertEqual(self.cache.misses, 3)
+
+	def test_key_follows_the_local_day(self):
+		from datetime import datetime, timedelta
+		from zoneinfo import ZoneInfo
+		# 00:30 in Kolkata is still the previous day in UTC
+		self.now = datetime(2025, 3, 10, 0, 30, tzinfo=ZoneInfo('Asia/Kolkata')).astimezone(ZoneInfo('UTC'))
+		self.assertNotEqual(self.now.date(), timezone.localdate(self.now))
+		first = self._interval()
+		with self.captureOnCommitCallbacks(execute=True):
+			ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=timezone.localdate(self.now))
+		self.assertIn(f":{timezone.localdate(self.now).isoformat()}:", self.cache.key(self.doctor.id, self.now, None, 'v'))
+		self.assertEqual(self.cache.misses, 1)
+		self._interval()
+		self.assertEqual(self.cache.misses, 2)
+		# A booking for the UTC date is another day's queue
+		with self.captureOnCommitCallbacks(execute=True):
+			ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=timezone.localdate(self.now) - timedelta(days=1))
+		self._interval()
+		self.assertEqual(self.cache.misses, 2)
+
+	def test_local_lru_falls_back_to_shared_cache(self):
+		from datetime import time
+		self._interval()
+		self._interval(time(10, 0))
+		self._interval(time(11, 0))
+		self.assertEqual(self.cache.stats()['size'], 2)
+		# The walk-in entry was evicted locally but is still in the Django cache
+		self._interval()
+		self.assertEqual(self.cache.stats()['shared_hits'], 1)
+		self.assertEqual(self.cache.stats()['misses'], 3)
+
+
+class FlatForestTests(APITestCase):
+	def setUp(self):
+		import numpy as np
+		from sklearn.ensemble import RandomForestRegressor
+		rng = np.random.default_rng(3)
+		X = rng.normal(size=(400, 5))
+		y = 10 * X[:, 0] + X[:, 2] ** 2 + rng.normal(size=len(X))
+		self.model = RandomForestRegressor(n_estimators=20, random_state=0, n_jobs=1).fit(X, y)
+		self.X = rng.normal(size=(33, 5))
+
+	def test_matches_sklearn_exactly(self):
+		import numpy as np
+		from .forest_engine import FlatForest
+		forest = FlatForest.from_sklearn(self.model)
+		self.assertTrue(np.array_equal(forest.predict(self.X), self.model.predict(self.X)))
+		per_tree = np.stack([e.predict(self.X.astype(np.float32), check_input=False) for e in self.model.estimators_])
+		self.assertTrue(np.array_equal(forest.predict_per_tree(self.X), per_tree))
+		self.assertTrue(np.array_equal(forest.predict(self.X[:1]), self.model.predict(self.X[:1])))
+
+	def test_registry_loads_memory_mapped_forest(self):
+		import tempfile
+		import numpy as np
+		from sklearn.preprocessing import StandardScaler
+		from .forest_engine import FlatForest
+		from .model_registry import ModelRegistry
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		registry = ModelRegistry(tmpdir.name)
+		version = registry.register(self.model, StandardScaler().fit(self.X))
+		model, _, _ = registry.load(version)
+		self.assertIsInstance(model, FlatForest)
+		self.assertIsInstance(model.threshold, np.memmap)
+		self.assertTrue(np.array_equal(model.predict(self.X), self.model.predict(self.X)))
+		# The pickled sklearn model is still there for tools that need it
+		self.assertIs(type(registry.load(version, flat=False)[0]), type(self.model))
+
+	def test_registry_keeps_other_ensembles_pickled(self):
+		import tempfile
+		import numpy as np
+		from sklearn.ensemble import GradientBoostingRegressor
+		from sklearn.preprocessing import StandardScaler
+		from .forest_engine import FlatForest
+		from .model_registry import ModelRegistry
+		model = GradientBoostingRegressor(n_estimators=10, random_state=0).fit(self.X, self.X[:, 0])
+		self.assertFalse(FlatForest.supports(model))
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		registry = ModelRegistry(tmpdir.name)
+		version = registry.register(model, StandardScaler().fit(self.X))
+		loaded, _, _ = registry.load(version)
+		self.assertIsInstance(loaded, GradientBoostingRegressor)
+		self.assertTrue(np.array_equal(loaded.predict(self.X), model.predict(self.X)))
+
+
+class ModelSearchTests(TrainingDataMixin, APITestCase):
+	def test_forward_chaining_splits_train_on_the_past(self):
+		import numpy as np
+		from .model_search import forward_chaining_splits
+		days = np.repeat(np.arange(6), [3, 1, 2, 4, 2, 3])
+		splits = forward_chaining_splits(days, 2)
+		# Days {0, 1} | {2, 3} | {4, 5}
+		self.assertEqual(splits, [(4, 10), (10, 15)])
+		for train_end, valid_end in splits:
+			self.assertLess(days[train_end - 1], days[train_end])
+		with self.assertRaises(ValueError):
+			forward_chaining_splits(days, 6)
+
+	def test_search_registers_best_candidate(self):
+		import tempfile
+		from io import StringIO
+		from django.core.management import call_command
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, waiting_time_predictor
+		self._create_training_tokens()
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		registry = ModelRegistry(tmpdir.name)
+		with patch.object(waiting_time_predictor, 'registry', registry), \
+				patch.object(waiting_time_predictor, 'holder', ModelHolder(registry)):
+			call_command('search_wait_model', splits=2, models='ridge', workers=1, stdout=StringIO())
+			version = registry.current_version()
+		metadata = registry.metadata(version)
+		self.assertEqual(metadata['model_type'], 'Ridge')
+		self.assertEqual(metadata['search']['splits'], 2)
+		self.assertIn('mae', metadata['metrics'])
+
+
+class BacktesterTests(TrainingDataMixin, APITestCase):
+	def test_queue_state_is_rebuilt_at_each_event(self):
+		import numpy as np
+		from datetime import datetime, timezone as dt_timezone
+		from .backtester import queue_events
+		base = datetime(2025, 3, 3, tzinfo=dt_timezone.utc).timestamp()  # a Monday
+		nan, inf = np.nan, np.inf
+		# A walks in and starts at +10 min; B books, arrives at +5 min and starts at +20 min; C cancels
+		day = {
+			'token_id': np.array([1, 2, 3.]),
+			'doctor_id': np.array([7, 7, 7.]),
+			'created': base + np.array([0, 60, 120.]),
+			'arrival': base + np.array([nan, 300, nan]),
+			'start': base + np.array([600, 1200, nan]),
+			'leave': base + np.array([600, 1200, -inf]),
+			'appointment': np.array([nan, nan, nan]),
+			'stored_prediction': np.array([nan, 12, nan]),
+			'utc_offset': 19800.0,
+		}
+		features, meta = queue_events(day)
+		# hour, day_of_week, doctor_tokens_today, queue_position, doctor_id
+		self.assertEqual(features.tolist(), [
+			[0, 0, 0, 1, 7],
+			[0, 0, 1, 2, 7],
+			[0, 0, 3, 3, 7],
+		])
+		self.assertEqual(meta['event'].tolist(), ['created', 'created', 'arrival'])
+		self.assertEqual(meta['actual'].tolist(), [10, 19, 15])
+		self.assertEqual(meta['local_hour'].tolist(), [5, 5, 5])
+		self.assertTrue(np.isnan(meta['stored'][:2]).all())
+		self.assertEqual(meta['stored'][2], 12)
+
+	def test_backtest_scores_a_registered_version(self):
+		import json
+		import tempfile
+		from io import StringIO
+		from django.core.management import call_command
+		from .model_registry import ModelRegistry
+		from .waiting_time_predictor import ModelHolder, waiting_time_predictor
+		self._create_training_tokens()
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		registry = ModelRegistry(tmpdir.name)
+		with patch.object(waiting_time_predictor, 'registry', registry), \
+				patch.object(waiting_time_predictor, 'holder', ModelHolder(registry)), \
+				patch('api.management.commands.backtest_wait_model.model_registry', registry):
+			waiting_time_predictor.train_model()
+			version = registry.current_version()
+			report_path = f'{tmpdir.name}/backtest.json'
+			call_command(
+				'backtest_wait_model', start='2025-03-03', end='2025-03-05',
+				workers=1, report=report_path, stdout=StringIO(),
+			)
+		with open(report_path) as f:
+			report = json.load(f)
+		results = report['results'][version]
+		# 8 completed tokens per day, each scored at creation
+		self.assertEqual(report['days'], 3)
+		self.assertEqual(results['overall']['count'], 24)
+		self.assertEqual(sorted(results['by_doctor']), sorted(str(doctor.id) for doctor in self.doctors))
+		self.assertEqual(sum(row['count'] for row in results['by_doctor_hour']), 24)
+
+
+class QueueBroadcasterTests(APITestCase):
+	def setUp(self):
+		import tempfile
+		from django.core.cache import cache
+		from .model_registry import ModelRegistry
+		from .queue_update_signals import QueueBroadcaster
+		from .waiting_time_predictor import ModelHolder, waiting_time_predictor
+		cache.clear()
+		tmpdir = tempfile.TemporaryDirectory()
+		self.addCleanup(tmpdir.cleanup)
+		self.broadcaster = QueueBroadcaster()
+		for patcher in (
+			patch('api.queue_update_signals.queue_broadcaster', self.broadcaster),
+			patch.object(QueueBroadcaster, 'enabled', return_value=True),
+			patch.object(self.broadcaster, '_ensure_worker'),
+			patch.object(waiting_time_predictor, 'holder', ModelHolder(ModelRegistry(tmpdir.name))),
+		):
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		clinic = Clinic.objects.create(name='Broadcast Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Broadcast', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='Broadcast Patient', age=30, phone_number='+15551112222')
+
+	def _flush(self):
+		with patch.object(self.broadcaster, 'send') as send:
+			self.broadcaster.flush()
+		return [call.args for call in send.call_args_list]
+
+	def test_saves_are_coalesced_into_one_broadcast_after_commit(self):
+		from datetime import time
+		today = timezone.localdate()
+		with self.captureOnCommitCallbacks(execute=True):
+			later = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=today, appointment_time=time(11, 0))
+			first = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=today, appointment_time=time(10, 0))
+			later.status = 'in_consultancy'
+			later.save()
+			self.assertEqual(self.broadcaster._pending, {})
+		self.assertEqual(len(self.broadcaster._pending), 1)
+
+		with self.assertNumQueries(1):
+			sent = self._flush()
+		self.assertEqual(len(sent), 1)
+		doctor_id, message = sent[0]
+		self.assertEqual(doctor_id, self.doctor.id)
+		# Nothing was broadcast for this queue before, so clients get the full state
+		self.assertEqual(message['type'], 'snapshot')
+		self.assertEqual([change['token_id'] for change in message['changes']], [later.id, first.id, later.id])
+		# In consultation before waiting, then by appointment time
+		self.assertEqual([(row['id'], row['position']) for row in message['queue']], [(later.id, 1), (first.id, 2)])
+		self.assertEqual(self.broadcaster._pending, {})
+
+	def test_later_changes_are_sent_as_versioned_deltas(self):
+		from datetime import time
+		today = timezone.localdate()
+		with self.captureOnCommitCallbacks(execute=True):
+			current = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=today, appointment_time=time(9, 0), status='in_consultancy')
+			following = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=today, appointment_time=time(9, 15))
+		snapshot = self._flush()[0][1]
+
+		with self.captureOnCommitCallbacks(execute=True):
+			current.status = 'completed'
+			current.save()
+		delta = self._flush()[0][1]
+		self.assertEqual(delta['type'], 'delta')
+		self.assertEqual(delta['base_version'], snapshot['version'])
+		self.assertNotEqual(delta['version'], snapshot['version'])
+		self.assertEqual(delta['removed'], [current.id])
+		self.assertEqual([(row['id'], row['position']) for row in delta['upserted']], [(following.id, 1)])
+		# New clients get the same state from the cache, without a query
+		with self.assertNumQueries(0):
+			self.assertEqual(self.broadcaster.snapshot(self.doctor.id, today)['queue'], delta['upserted'])
+
+	def test_rolled_back_changes_are_not_broadcast(self):
+		from django.db import transaction
+		with self.captureOnCommitCallbacks(execute=True):
+			try:
+				with transaction.atomic():
+					ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=timezone.localdate())
+					raise RuntimeError('rollback')
+			except RuntimeError:
+				pass
+		self.assertEqual(self.broadcaster._pending, {})
+
+
+class QueueConsumerTests(APITestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		cache.clear()
+		clinic = Clinic.objects.create(name='Socket Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Socket', specialization='GP', clinic=clinic)
+		patient = Patient.objects.create(name='Socket Patient', age=30, phone_number='+15553334444')
+		self.token = ClinicToken.objects.create(patient=patient, doctor=self.doctor, date=timezone.localdate())
+
+	async def test_snapshot_on_connect_then_deltas_in_version_order(self):
+		from channels.layers import get_channel_layer
+		from channels.testing import WebsocketCommunicator
+		from channels.routing import URLRouter
+		from .routing import websocket_urlpatterns
+		from .queue_update_signals import queue_group_name
+		communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/queue/{self.doctor.id}/')
+		connected, _ = await communicator.connect()
+		self.assertTrue(connected)
+		snapshot = await communicator.receive_json_from()
+		self.assertEqual(snapshot['type'], 'snapshot')
+		self.assertEqual([row['id'] for row in snapshot['queue']], [self.token.id])
+
+		layer = get_channel_layer()
+		base = {'type': 'delta', 'doctor_id': self.doctor.id, 'date': timezone.localdate().isoformat(), 'upserted': [], 'removed': []}
+		delta = dict(base, base_version=snapshot['version'], version=snapshot['version'] + 1)
+		await layer.group_send(queue_group_name(self.doctor.id), {'type': 'queue.update', 'message': delta})
+		self.assertEqual(await communicator.receive_json_from(), delta)
+
+		# A delta that skips a version makes the server resend the full state
+		gap = dict(base, base_version=snapshot['version'] + 5, version=snapshot['version'] + 6)
+		await layer.group_send(queue_group_name(self.doctor.id), {'type': 'queue.update', 'message': gap})
+		self.assertEqual((await communicator.receive_json_from())['type'], 'snapshot')
+
+		# Other days of the same doctor are not this socket's business
+		other_day = dict(delta, date='2000-01-01')
+		await layer.group_send(queue_group_name(self.doctor.id), {'type': 'queue.update', 'message': other_day})
+		self.assertTrue(await communicator.receive_nothing())
+		await communicator.disconnect()
+
+
+class ConditionalGetTests(APITestCase):
+	def setUp(self):
+		use_shared_cache(self)
+		self.user = User.objects.create_user(username='etaguser', password='pw123')
+		self.patient = Patient.objects.create(user=self.user, name='ETag Patient', age=30, phone_number='+15553334444')
+		clinic = Clinic.objects.create(name='ETag Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr ETag', specialization='GP', clinic=clinic)
+		self.today = timezone.localdate()
+
+	def _revalidate(self, url, queries):
+		first = self.client.get(url)
+		self.assertEqual(first.status_code, status.HTTP_200_OK)
+		self.assertTrue(first['ETag'].startswith('W/"'))
+		with self.assertNumQueries(queries):
+			again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+		self.assertEqual(again['ETag'], first['ETag'])
+		return first['ETag']
+
+	def test_live_queue_is_not_modified_until_a_token_changes(self):
+		from datetime import time
+		token = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.today, appointment_time=time(10, 0))
+		url = f'/api/patient/queue/{self.doctor.id}/{self.today.isoformat()}/'
+		etag = self._revalidate(url, queries=0)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'in_consultancy'
+			token.save()
+		changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(changed.status_code, status.HTTP_200_OK)
+		self.assertNotEqual(changed['ETag'], etag)
+		self.assertEqual(changed.data[0]['status'], 'in_consultancy')
+
+	def test_available_slots_follow_bookings_and_schedule_changes(self):
+		from datetime import time
+		from .models import DoctorSchedule
+		url = f'/api/public/doctors/{self.doctor.id}/available-slots/{self.today.isoformat()}/'
+		etag = self._revalidate(url, queries=0)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.today, appointment_time=time(9, 0))
+		booked = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(booked.status_code, status.HTTP_200_OK)
+		self.assertNotIn('09:00', booked.data)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			DoctorSchedule.objects.create(doctor=self.doctor, start_time=time(14, 0), end_time=time(15, 0), slot_duration_minutes=30)
+		rescheduled = self.client.get(url, HTTP_IF_NONE_MATCH=booked['ETag'])
+		self.assertEqual(rescheduled.status_code, status.HTTP_200_OK)
+		self.assertEqual(rescheduled.data, ['14:00', '14:30'])
+
+	def test_patient_token_is_revalidated_without_reading_tokens(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		token = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.today)
+		self.client.force_authenticate(user=self.user)
+		url = '/api/tokens/get_my_token/'
+		first = self.client.get(url)
+		self.assertEqual(first.status_code, status.HTTP_200_OK)
+		with CaptureQueriesContext(connection) as queries:
+			again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+		self.assertFalse([q for q in queries.captured_queries if ClinicToken._meta.db_table in q['sql']])
+
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'cancelled'
+			token.save()
+		cancelled = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(cancelled.status_code, status.HTTP_404_NOT_FOUND)
+
+	def test_no_etags_when_the_cache_is_process_local(self):
+		from django.test import override_settings
+		url = f'/api/patient/queue/{self.doctor.id}/{self.today.isoformat()}/'
+		# Changes made by the Q cluster or another worker would not move this process's counters
+		with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+			response = self.client.get(url, HTTP_IF_NONE_MATCH='W/"queue-stale"')
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		self.assertFalse(response.has_header('ETag'))
+
+
+class QueueStreamTests(APITestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		from .queue_update_signals import QueueBroadcaster
+		cache.clear()
+		self.broadcaster = QueueBroadcaster()
+		for patcher in (
+			patch('api.queue_update_signals.queue_broadcaster', self.broadcaster),
+			patch('api.queue_stream.queue_broadcaster', self.broadcaster),
+			patch.object(self.broadcaster, '_ensure_worker'),
+			patch.object(self.broadcaster, 'send'),
+		):
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		clinic = Clinic.objects.create(name='Stream Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Stream', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='Stream Patient', age=30, phone_number='+15556667777')
+		self.today = timezone.localdate()
+
+	@staticmethod
+	def _parse(chunk):
+		chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+		fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines())
+		return fields.get('event'), json.loads(fields['data']) if 'data' in fields else None
+
+	def test_stream_is_refused_under_wsgi(self):
+		# The test client is WSGI: a stream would pin a worker, so the client is told to keep polling
+		response = self.client.get(f'/api/patient/queue/{self.doctor.id}/{self.today.isoformat()}/stream/')
+		self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+		self.assertEqual(self.broadcaster._listeners, {})
+
+	def test_stream_sends_snapshot_then_broadcast_deltas(self):
+		from datetime import time
+		from django.test import override_settings
+		token = ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.today, appointment_time=time(10, 0))
+		with override_settings(QUEUE_STREAM_ALLOW_WSGI=True):
+			response = self.client.get(f'/api/patient/queue/{self.doctor.id}/{self.today.isoformat()}/stream/')
+		self.assertEqual(response['Content-Type'], 'text/event-stream')
+		events = iter(response.streaming_content)
+		self.assertTrue(next(events).startswith(b'retry:'))
+		event, snapshot = self._parse(next(events))
+		self.assertEqual(event, 'snapshot')
+		self.assertEqual([(row['id'], row['status']) for row in snapshot['queue']], [(token.id, 'waiting')])
+
+		# The stream's listener makes token changes reach the broadcaster
+		with self.captureOnCommitCallbacks(execute=True):
+			token.status = 'in_consultancy'
+			token.save()
+		with self.assertNumQueries(1):
+			self.broadcaster.flush()
+		event, delta = self._parse(next(events))
+		self.assertEqual(event, 'delta')
+		self.assertEqual(delta['base_version'], snapshot['version'])
+		self.assertEqual([(row['id'], row['status']) for row in delta['upserted']], [(token.id, 'in_consultancy')])
+
+		response.close()
+		self.assertEqual(self.broadcaster._listeners, {})
+
+	def test_idle_stream_catches_up_on_changes_from_other_processes(self):
+		from .prediction_cache import QueueVersion
+		from .queue_stream import QueueEventStream
+		version = QueueVersion.get(self.doctor.id, self.today)
+		stream = QueueEventStream(self.doctor.id, self.today, last_event_id=str(version), broadcaster=self.broadcaster, heartbeat_seconds=0)
+		# Reconnecting at the current version: nothing to resend
+		self.assertEqual(len(stream.opening()), 1)
+
+		QueueVersion.bump(self.doctor.id, self.today)
+		chunks, resync = stream.idle()
+		self.assertTrue(chunks[0].startswith(': heartbeat'))
+		# Give the broadcast a whole check to arrive before falling back to a snapshot
+		self.assertFalse(resync)
+		self.assertTrue(stream.idle()[1])
+		event, snapshot = self._parse(stream.snapshot()[0])
+		self.assertEqual((event, snapshot['version']), ('snapshot', version + 1))
+		self.assertEqual(stream.idle()[1], False)
+
+
+class QueueStateTests(APITransactionTestCase):
+	# Transactional: the state only keeps queues loaded outside atomic blocks, and updates on commit
+
+	def setUp(self):
+		from .queue_state import queue_state
+		use_shared_cache(self)
+		queue_state.clear()
+		self.addCleanup(queue_state.clear)
+		clinic = Clinic.objects.create(name='State Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr State', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='State Patient', age=30, phone_number='+15558889999')
+		self.today = timezone.localdate()
+
+	def _token(self, status, appointment_time=None):
+		return ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.today, appointment_time=appointment_time, status=status)
+
+	def test_positions_follow_the_staff_queue_order_without_sql(self):
+		from datetime import time
+		from django.db.models import Case, F, Value, When
+		from .queue_state import queue_state
+		current = self._token('in_consultancy', time(9, 0))
+		arrived = self._token('confirmed', time(11, 0))
+		booked = self._token('waiting', time(10, 0))
+		walk_in = self._token('waiting')
+		self._token('completed', time(9, 30))
+
+		status_priority = Case(When(status='in_consultancy', then=Value(1)), When(status='confirmed', then=Value(2)), When(status='waiting', then=Value(3)), default=Value(4))
+		expected = list(ClinicToken.objects.filter(doctor=self.doctor, date=self.today, status__in=['in_consultancy', 'confirmed', 'waiting']).order_by(
+			status_priority, F('appointment_time').asc(nulls_last=True), 'created_at').values_list('id', flat=True))
+		self.assertEqual(queue_state.next_up(self.doctor.id, self.today, 10), expected)
+		self.assertEqual(expected, [current.id, arrived.id, booked.id, walk_in.id])
+
+		with self.assertNumQueries(0):
+			self.assertEqual(queue_state.position(arrived), 1)
+			self.assertEqual(queue_state.position(booked), 2)
+			self.assertEqual(queue_state.position(walk_in), 3)
+			self.assertEqual(queue_state.patients_ahead(walk_in), 3)
+			self.assertEqual(queue_state.patients_ahead(booked, ('confirmed', 'in_consultancy')), 2)
+
+		# Saves in this process are applied in place once committed
+		booked.status = 'in_consultancy'
+		booked.save()
+		walk_in.delete()
+		with self.assertNumQueries(0):
+			self.assertEqual(queue_state.next_up(self.doctor.id, self.today, 10), [current.id, booked.id, arrived.id])
+		self.assertEqual(queue_state.loads, 1)
+
+	def test_changes_it_did_not_see_force_a_reload(self):
+		from .prediction_cache import QueueVersion
+		from .queue_state import queue_state
+		first = self._token('waiting')
+		second = self._token('waiting')
+		self.assertEqual(queue_state.position(second), 2)
+
+		# A bulk update (or another process) bumps the version without telling this one
+		ClinicToken.objects.filter(pk=first.pk).update(status='cancelled')
+		QueueVersion.bump(self.doctor.id, self.today)
+		with self.assertNumQueries(1):
+			self.assertEqual(queue_state.position(second), 1)
+		self.assertEqual(queue_state.loads, 2)
+
+	def test_process_local_cache_reloads_after_the_ttl(self):
+		from django.test import override_settings
+		import time
+		from .queue_state import queue_state
+		first = self._token('waiting')
+		second = self._token('waiting')
+		with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+			self.assertEqual(queue_state.position(second), 2)
+			# The Q cluster cancels it; its version bump never reaches this process
+			ClinicToken.objects.filter(pk=first.pk).update(status='cancelled')
+			with self.assertNumQueries(0):
+				self.assertEqual(queue_state.position(second), 2)
+			with patch('api.queue_state.time.monotonic', return_value=time.monotonic() + queue_state.local_ttl):
+				with self.assertNumQueries(1):
+					self.assertEqual(queue_state.position(second), 1)
+		self.assertEqual(queue_state.loads, 2)
+
+class QueueRanksTests(APITestCase):
+
+	def setUp(self):
+		clinic = Clinic.objects.create(name='Rank Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Rank', specialization='GP', clinic=clinic)
+		self.other = Doctor.objects.create(name='Dr Other', specialization='GP', clinic=clinic)
+		self.patient = Patient.objects.create(name='Rank Patient', age=30, phone_number='+15557770000')
+		self.today = timezone.localdate()
+
+	def _token(self, doctor, status, appointment_time=None):
+		return ClinicToken.objects.create(patient=self.patient, doctor=doctor, date=self.today, appointment_time=appointment_time, status=status)
+
+	def test_ranks_every_doctor_queue_in_one_query(self):
+		from datetime import time
+		from .queue_ranks import queue_ranks, ranked_tokens
+		from .queue_state import queue_state
+		self._token(self.doctor, 'in_consultancy', time(9, 0))
+		arrived = self._token(self.doctor, 'confirmed', time(11, 0))
+		booked = self._token(self.doctor, 'waiting', time(10, 0))
+		walk_in = self._token(self.doctor, 'waiting')
+		other_walk_in = self._token(self.other, 'waiting')
+		other_booked = self._token(self.other, 'waiting', time(12, 0))
+		self._token(self.doctor, 'completed', time(9, 30))
+
+		with self.assertNumQueries(1):
+			ranks = queue_ranks(self.today)
+		self.assertEqual(ranks, {arrived.id: 1, booked.id: 2, walk_in.id: 3, other_booked.id: 1, other_walk_in.id: 2})
+		for token in (arrived, booked, walk_in, other_booked, other_walk_in):
+			self.assertEqual(ranks[token.id], queue_state.position(token))
+
+		# Filtering on the rank keeps the ranks computed over the whole queue
+		with self.assertNumQueries(1):
+			head = [(token.id, token.queue_rank) for token in ranked_tokens(self.today, [self.doctor.id]).filter(queue_rank__lte=2)]
+		self.assertEqual(head, [(arrived.id, 1), (booked.id, 2)])
+
+	def test_queue_notifications_use_ranked_positions(self):
+		from datetime import time
+		from .smart_queue_analytics import notify_queue_progress
+		self._token(self.doctor, 'waiting')
+		self._token(self.doctor, 'waiting', time(10, 0))
+		with patch('api.smart_queue_analytics.send_sms_notification') as send_sms:
+			notify_queue_progress(self.doctor.id)
+		messages = [call.args[1] for call in send_sms.call_args_list]
+		self.assertEqual(len(messages), 2)
+		self.assertIn("You're next!", messages[0])
+		self.assertIn("You're #2", messages[1])
+
+class ClinicCountsTests(APITestCase):
+
+	def setUp(self):
+		self.clinic = Clinic.objects.create(name='Count Clinic', address='Addr', city='City')
+		self.doctor = Doctor.objects.create(name='Dr Count', specialization='GP', clinic=self.clinic)
+		self.idle = Doctor.objects.create(name='Dr Idle', specialization='GP', clinic=self.clinic)
+		self.patient = Patient.objects.create(name='Count Patient', age=30, phone_number='+15556660000')
+		self.today = timezone.localdate()
+		for status in ('waiting', 'waiting', 'confirmed', 'in_consultancy', 'completed', 'cancelled'):
+			ClinicToken.objects.create(patient=self.patient, doctor=self.doctor, date=self.today, status=status)
+
+	def test_counts_every_doctor_and_status_in_one_query(self):
+		from .clinic_counts import clinic_totals, doctor_status_counts
+		with self.assertNumQueries(1):
+			counts = doctor_status_counts(self.clinic.id, self.today)
+		self.assertEqual(set(counts), {self.doctor.id})
+		self.assertEqual(counts[self.doctor.id]['waiting'], 2)
+		self.assertEqual(counts[self.doctor.id]['queue'], 3)
+		self.assertEqual(counts[self.doctor.id]['total'], 6)
+		totals = clinic_totals(counts)
+		self.assertEqual((totals['in_consultancy'], totals['completed'], totals['cancelled'], totals['skipped']), (1, 1, 1, 0))
+
+	def test_clinic_overview_query_count_does_not_grow_with_doctors(self):
+		from .real_time_queue_manager import RealTimeQueueManager
+		for i in range(5):
+			Doctor.objects.create(name=f'Dr Extra {i}', specialization='GP', clinic=self.clinic)
+		with self.assertNumQueries(2):
+			overview = RealTimeQueueManager.get_clinic_overview(self.clinic.id)
+		self.assertEqual((overview['total_patients_today'], overview['total_waiting'], overview['total_completed']), (6, 3, 1))
+		busy = next(doc for doc in overview['doctors_status'] if doc['doctor_id'] == self.doctor.id)
+		idle = next(doc for doc in overview['doctors_status'] if doc['doctor_id'] == self.idle.id)
+		self.assertEqual((busy['status'], busy['can_accept_walkins']), ('busy', False))
+		self.assertEqual((idle['status'], idle['can_accept_walkins'], idle['patients_today']), ('available', True, 0))
+		self.assertTrue(overview['can_accept_walkins'])
+
+class HeatmapTests(APITestCase):
+
+	def setUp(self):
+		self.clinic = Clinic.objects.create(name='Heat Clinic', address='Addr', city='City')
+		self.user = User.objects.create_user(username='heatdoc', password='pw')
+		self.doctor = Doctor.objects.create(name='Dr Heat', specialization='GP', clinic=self.clinic, user=self.user)
+		self.patient = Patient.objects.create(name='Heat Patient', age=30, phone_number='+15554440000')
+
+	def _token(self, created_at, status='waiting', completed_at=None, doctor=None):
+		token = ClinicToken.objects.create(patient=self.patient, doctor=doctor or self.doctor, date=created_at.date(), status=status)
+		ClinicToken.objects.filter(pk=token.pk).update(created_at=created_at, completed_at=completed_at)
+		return token
+
+	def test_heatmap_is_dense_and_bucketed_in_local_time(self):
+		from datetime import datetime, timedelta
+		from django.urls import reverse
+		# 2026-10-12 is a Monday
+		monday_10 = timezone.make_aware(datetime(2026, 10, 12, 10, 15))
+		self._token(monday_10, 'completed', monday_10 + timedelta(minutes=30))
+		self._token(monday_10 + timedelta(minutes=20), 'completed', monday_10 + timedelta(minutes=70))
+		self._token(monday_10 + timedelta(days=5, hours=-1))
+		other = Doctor.objects.create(name='Dr Cold', specialization='GP', clinic=self.clinic)
+		self._token(monday_10, doctor=other)
+
+		self.client.force_authenticate(user=self.user)
+		with self.assertNumQueries(1):
+			response = self.client.get(reverse('clinic-heatmap'), {'start_date': '2026-10-11', 'end_date': '2026-10-17', 'doctor_id': self.doctor.id})
+		self.assertEqual(response.status_code, status.HTTP_200_OK)
+		heatmap = response.data['heatmap']
+		self.assertEqual(len(heatmap['counts']), 7)
+		self.assertTrue(all(len(row) == 24 for row in heatmap['counts']))
+		self.assertEqual(heatmap['counts'][1][10], 2)
+		self.assertEqual(heatmap['avg_wait_minutes'][1][10], 40.0)
+		self.assertEqual(heatmap['counts'][6][9], 1)
+		self.assertIsNone(heatmap['avg_wait_minutes'][6][9])
+		self.assertEqual(heatmap['total'], 3)
+
+		response = self.client.get(reverse('clinic-heatmap'), {'start_date': 'not-a-date'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+	def test_peak_hours_use_database_buckets(self):
+		from datetime import datetime, timedelta
+		from .advanced_reports import AdvancedReports
+		morning = timezone.make_aware(datetime(2026, 10, 12, 9, 5))
+		for minutes in (0, 10, 20):
+			self._token(morning + timedelta(minutes=minutes))
+		self._token(morning + timedelta(hours=5))
+		with self.assertNumQueries(1):
+			peak = AdvancedReports._analyze_peak_hours(self.clinic.id, morning.date(), morning.date())
+		self.assertEqual(peak, [{'hour': '9:00', 'patient_count': 3}, {'hour': '14:00', 'patient_count': 1}])
@@ -0,0 +1,65 @@
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q
+from django.db.models.functions import ExtractHour, ExtractWeekDay
+from .models import Token
+
+# ExtractWeekDay numbering: 1 = Sunday ... 7 = Saturday
+WEEKDAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+HOURS = range(24)
+
+
+def filter_tokens(clinic_id=None, doctor_id=None, start_date=None, end_date=None):
+    """Tokens narrowed by any of clinic, doctor and an inclusive date range"""
+    tokens = Token.objects.all()
+    if clinic_id is not None:
+        tokens = tokens.filter(clinic_id=clinic_id)
+    if doctor_id is not None:
+        tokens = tokens.filter(doctor_id=doctor_id)
+    if start_date is not None:
+        tokens = tokens.filter(date__gte=start_date)
+    if end_date is not None:
+        tokens = tokens.filter(date__lte=end_date)
+    return tokens
+
+
+def hourly_counts(tokens):
+    """{hour: token count} by local hour of booking, from one grouped query; empty hours are absent"""
+    rows = tokens.annotate(hour=ExtractHour('created_at')).values('hour').annotate(count=Count('id')).order_by()
+    return {row['hour']: row['count'] for row in rows}
+
+
+def weekday_hour_heatmap(tokens, hours=HOURS):
+    """Dense weekday x hour matrix of bookings and average wait, from one grouped query.
+
+    Buckets are the local weekday and hour of created_at. 'counts' has one row
+    per weekday (Sunday first) and one column per hour in `hours`, zero where
+    nothing was booked; 'avg_wait_minutes' is the mean time from booking to
+    completion of the completed tokens in each cell, None where there are none.
+    """
+    hours = list(hours)
+    wait = ExpressionWrapper(F('completed_at') - F('created_at'), output_field=DurationField())
+    rows = tokens.annotate(
+        weekday=ExtractWeekDay('created_at'),
+        hour=ExtractHour('created_at'),
+    ).values('weekday', 'hour').annotate(
+        count=Count('id'),
+        avg_wait=Avg(wait, filter=Q(status='completed', completed_at__isnull=False)),
+    ).order_by()
+
+    columns = {hour: index for index, hour in enumerate(hours)}
+    counts = [[0] * len(hours) for _ in WEEKDAYS]
+    avg_wait_minutes = [[None] * len(hours) for _ in WEEKDAYS]
+    for row in rows:
+        column = columns.get(row['hour'])
+        if column is None:
+            continue
+        counts[row['weekday'] - 1][column] = row['count']
+        if row['avg_wait'] is not None:
+            avg_wait_minutes[row['weekday'] - 1][column] = round(row['avg_wait'].total_seconds() / 60, 1)
+
+    return {
+        'weekdays': WEEKDAYS,
+        'hours': hours,
+        'counts': counts,
+        'avg_wait_minutes': avg_wait_minutes,
+        'total': sum(map(sum, counts)),
+    }
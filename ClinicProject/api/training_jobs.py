@@ -0,0 +1,160 @@
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from django_q.tasks import async_task
+from .models import TrainingJob
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_LOCK = 'train'
+# An active job that has not reported progress for this long is treated as dead
+STALE_AFTER_MINUTES = 60
+# Per-task timeout for the Django-Q worker running the job
+TRAINING_TIMEOUT_SECONDS = 30 * 60
+# Inserts to retry when the job holding the lock finishes before it can be looked up
+CLAIM_ATTEMPTS = 3
+
+
+class TrainingJobRunner:
+    """Runs model training outside the request cycle, one job at a time.
+
+    A job row is claimed with a unique `active_lock` value, so concurrent
+    requests (from any process) coalesce onto the job already queued or running.
+    """
+
+    @staticmethod
+    def active_job():
+        return TrainingJob.objects.filter(active_lock=ACTIVE_LOCK).first()
+
+    @staticmethod
+    def _release_stale():
+        cutoff = timezone.now() - timezone.timedelta(minutes=STALE_AFTER_MINUTES)
+        stale = TrainingJob.objects.filter(active_lock=ACTIVE_LOCK, updated_at__lt=cutoff)
+        for job in stale:
+            logger.warning(f"Releasing stale training job {job.id} (last update {job.updated_at})")
+            TrainingJobRunner._finish(job.id, 'failed', message='Job stopped reporting progress')
+
+    @staticmethod
+    def _claim(trigger):
+        """Create the active job, or return (existing active job, False) if one is already claimed"""
+        TrainingJobRunner._release_stale()
+        for attempt in range(CLAIM_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return TrainingJob.objects.create(trigger=trigger, active_lock=ACTIVE_LOCK), True
+            except IntegrityError:
+                if attempt == CLAIM_ATTEMPTS - 1:
+                    raise
+                job = TrainingJobRunner.active_job()
+                if job is not None:
+                    return job, False
+                # The conflicting job finished between the insert and the lookup: the lock is free again
+                logger.info(f"Active training job finished while claiming; retrying {trigger} claim")
+
+    @staticmethod
+    def submit(trigger='manual'):
+        """Queue a training job on the Django-Q cluster; returns (job, created)"""
+        job, created = TrainingJobRunner._claim(trigger)
+        if created:
+            job_id = job.id
+            transaction.on_commit(lambda: async_task(
+                'api.training_jobs.run_training_job',
+                job_id,
+                timeout=TRAINING_TIMEOUT_SECONDS,
+                hook='api.training_jobs.training_job_hook',
+            ))
+            logger.info(f"Queued training job {job_id} ({trigger})")
+        else:
+            logger.info(f"Training already in progress as job {job.id}; coalescing {trigger} request")
+        return job, created
+
+    @staticmethod
+    def run_now(trigger):
+        """Claim and run a job in the current process (for code already running in a worker)"""
+        job, created = TrainingJobRunner._claim(trigger)
+        if not created:
+            logger.info(f"Training already in progress as job {job.id}; skipping {trigger} run")
+            return job, False
+        return TrainingJobRunner.run(job.id), True
+
+    @staticmethod
+    def report(job_id, phase, percent):
+        TrainingJob.objects.filter(id=job_id).update(
+            phase=phase, progress=percent, updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def _finish(job_id, status, message='', **fields):
+        TrainingJob.objects.filter(id=job_id).update(
+            status=status,
+            message=message,
+            active_lock=None,
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+            **fields
+        )
+
+    @staticmethod
+    def run(job_id):
+        """Execute a claimed job and record its outcome"""
+        from .waiting_time_predictor import waiting_time_predictor
+
+        TrainingJob.objects.filter(id=job_id).update(
+            status='running', started_at=timezone.now(), updated_at=timezone.now()
+        )
+        result = {}
+
+        def progress(phase, percent, **details):
+            result.update(details)
+            TrainingJobRunner.report(job_id, phase, percent)
+
+        try:
+            success = waiting_time_predictor.train_model(progress=progress)
+        except Exception as e:
+            logger.error(f"Training job {job_id} failed: {e}")
+            TrainingJobRunner._finish(job_id, 'failed', message=str(e))
+        else:
+            if success:
+                TrainingJobRunner._finish(
+                    job_id, 'succeeded', message='Model trained successfully',
+                    phase='done', progress=100,
+                    model_version=result.get('version') or '',
+                    metrics=result.get('metrics') or {},
+                )
+            else:
+                TrainingJobRunner._finish(job_id, 'failed', message='Insufficient training data or ML dependencies missing')
+        return TrainingJob.objects.get(id=job_id)
+
+    @staticmethod
+    def serialize(job):
+        return {
+            'job_id': job.id,
+            'status': job.status,
+            'phase': job.phase,
+            'progress': job.progress,
+            'trigger': job.trigger,
+            'message': job.message,
+            'model_version': job.model_version or None,
+            'metrics': job.metrics,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        }
+
+
+def run_training_job(job_id):
+    """Django-Q entry point"""
+    job = TrainingJobRunner.run(job_id)
+    return f"Training job {job.id}: {job.status}"
+
+
+def training_job_hook(task):
+    if not task.success:
+        # The task itself crashed or timed out before it could record an outcome
+        job_id = task.args[0] if task.args else None
+        logger.error(f"Training job task {job_id} failed: {task.result}")
+        if job_id:
+            TrainingJob.objects.filter(id=job_id, active_lock=ACTIVE_LOCK).update(
+                status='failed', message=str(task.result)[:500], active_lock=None,
+                finished_at=timezone.now(), updated_at=timezone.now()
+            )
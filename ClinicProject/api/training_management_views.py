@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework import status, permissions
 from django.utils import timezone
 from .auto_training_triggers import AutoTrainingManager
+from .training_jobs import TrainingJobRunner
 from .waiting_time_predictor import waiting_time_predictor
 from .models import Token
 import logging
@@ -46,18 +47,15 @@ class TrainingManagementView(APIView):
         
         try:
             if action == 'train':
-                # Force immediate training with all data
-                success = AutoTrainingManager.force_retrain_all_data()
+                # Queue a background retrain with all data
+                job, created = AutoTrainingManager.force_retrain_all_data()
                 
-                if success:
-                    return Response({
-                        'message': 'Model retrained successfully with ALL consultation data',
-                        'timestamp': timezone.now().isoformat()
-                    })
-                else:
-                    return Response({
-                        'error': 'Training failed - check logs for details'
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                return Response({
+                    'message': 'Training job queued' if created else 'Training already in progress',
+                    'job': TrainingJobRunner.serialize(job),
+                    'status_url': f'/api/waiting-time/train/{job.id}/',
+                    'timestamp': timezone.now().isoformat()
+                }, status=status.HTTP_202_ACCEPTED)
             
             elif action == 'setup_schedules':
                 # Setup/reset automatic training schedules
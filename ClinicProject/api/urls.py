@@ -1,8 +1,8 @@
 from django.urls import path
 from . import views
 from .views import *
-from .waiting_time_views import PredictWaitingTimeView, TrainModelView, WaitingTimeStatusView, PublicPredictWaitingTimeView
-from .enhanced_views import RealTimeDashboardView, SmartQueueView, CommunicationHubView, AdvancedReportsView, ClinicInsightsView
+from .waiting_time_views import PredictWaitingTimeView, TrainModelView, TrainingJobStatusView, WaitingTimeStatusView, PublicPredictWaitingTimeView
+from .enhanced_views import RealTimeDashboardView, SmartQueueView, CommunicationHubView, AdvancedReportsView, ClinicInsightsView, ClinicHeatmapView
 
 urlpatterns = [
     # Authentication
@@ -32,6 +32,7 @@ urlpatterns = [
     path('tokens/patient_create/', PatientCreateTokenView.as_view(), name='patient-create-alt'),
     path('tokens/patient_create', PatientCreateTokenView.as_view(), name='patient-create-alt-no-slash'),
     path('patient/queue/<int:doctor_id>/<str:date>/', PatientLiveQueueView.as_view(), name='patient-queue'),
+    path('patient/queue/<int:doctor_id>/<str:date>/stream/', patient_live_queue_stream, name='patient-queue-stream'),
     path('doctors/<int:doctor_id>/available-slots/<str:date>/', AvailableSlotsView.as_view(), name='doctor-available-slots'),
     path('public/doctors/<int:doctor_id>/available-slots/<str:date>/', PublicAvailableSlotsView.as_view(), name='public-doctor-available-slots'),
     path('history/<int:patient_id>/', PatientHistoryView.as_view(), name='patient-history-by-id'),
@@ -75,6 +76,8 @@ urlpatterns = [
     path('waiting-time/predict/<int:doctor_id>/', PredictWaitingTimeView.as_view(), name='predict-waiting-time'),
     path('public/waiting-time/predict/<int:doctor_id>/', PublicPredictWaitingTimeView.as_view(), name='public-predict-waiting-time'),
     path('waiting-time/train/', TrainModelView.as_view(), name='train-model'),
+    path('waiting-time/train/jobs/latest/', TrainingJobStatusView.as_view(), name='training-job-latest'),
+    path('waiting-time/train/<int:job_id>/', TrainingJobStatusView.as_view(), name='training-job-status'),
     path('waiting-time/status/', WaitingTimeStatusView.as_view(), name='waiting-time-status'),
     
     # Enhanced dashboard endpoints
@@ -83,6 +86,7 @@ urlpatterns = [
     path('communication/', CommunicationHubView.as_view(), name='communication-hub'),
     path('reports/advanced/', AdvancedReportsView.as_view(), name='advanced-reports'),
     path('insights/', ClinicInsightsView.as_view(), name='clinic-insights'),
+    path('analytics/heatmap/', ClinicHeatmapView.as_view(), name='clinic-heatmap'),
     
     # Schedule management
     path('schedules/', DoctorScheduleListView.as_view(), name='doctor-schedules'),
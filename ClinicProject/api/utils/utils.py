@@ -3,9 +3,30 @@
 from django.conf import settings
 # REMOVED: from twilio.rest import Client
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+def normalize_phone_number(phone):
+    """Normalize phone number by removing country codes, spaces, and special chars"""
+    if not phone:
+        return phone
+    # Remove all non-digits
+    digits_only = re.sub(r'\D', '', str(phone))
+    if not digits_only:
+        return phone
+    
+    # Remove country codes (91 for India, 1 for US, etc.)
+    if digits_only.startswith('91') and len(digits_only) == 12:
+        return digits_only[2:]
+    elif digits_only.startswith('1') and len(digits_only) == 11:
+        return digits_only[1:]
+    
+    # Return last 10 digits if more than 10
+    if len(digits_only) > 10:
+        return digits_only[-10:]
+    return digits_only
+
 def send_sms_notification(to_number, message):
     """
     Sends real SMS via Twilio or simulates if credentials not configured.
@@ -23,23 +23,33 @@ from django.utils import timezone
 from math import radians, sin, cos, sqrt, atan2
 from django.contrib.auth import authenticate, get_user_model
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.utils.decorators import method_decorator
 from twilio.twiml.voice_response import VoiceResponse
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import require_GET
 # --- MODIFIED: Added IntegrityError ---
 from django.db import transaction, IntegrityError
 import random
 
 # --- Core App Imports ---
-from .utils.utils import send_sms_notification
+from .utils.utils import send_sms_notification, normalize_phone_number
 from .waiting_time_predictor import waiting_time_predictor
 from .advanced_wait_predictor import advanced_wait_predictor
 from .clinic_wait_stats import ClinicWaitStats
+from .clinic_counts import clinic_totals, doctor_status_counts, empty_counts
+from .slot_occupancy import SlotOccupancy
+from .prediction_cache import cache_is_shared, prediction_cache, QueueVersion, PatientTokenVersion, ScheduleVersion
+from .queue_stream import QueueEventStream
+from .queue_state import queue_state
 # --- Imports for Django-Q Scheduling ---
 from django_q.tasks import async_task
 from datetime import datetime, timedelta, time
 # --- FIX: Import get_random_string ---
 from django.utils.crypto import get_random_string
+import hashlib
 import threading
 import logging
 import re
@@ -51,25 +61,18 @@ ivr_logger = logging.getLogger('api.ivr')
 User = get_user_model()
 
 # --- Helper Functions ---
-def normalize_phone_number(phone):
-    """Normalize phone number by removing country codes, spaces, and special chars"""
-    if not phone:
-        return phone
-    # Remove all non-digits
-    digits_only = re.sub(r'\D', '', str(phone))
-    if not digits_only:
-        return phone
-    
-    # Remove country codes (91 for India, 1 for US, etc.)
-    if digits_only.startswith('91') and len(digits_only) == 12:
-        return digits_only[2:]
-    elif digits_only.startswith('1') and len(digits_only) == 11:
-        return digits_only[1:]
-    
-    # Return last 10 digits if more than 10
-    if len(digits_only) > 10:
-        return digits_only[-10:]
-    return digits_only
+def resolve_patient_ids_by_phone(phone):
+    """Return ids of every Patient (IVR + web) sharing this phone's normalized form."""
+    normalized = normalize_phone_number(phone)
+    if not normalized:
+        return []
+    return list(Patient.objects.filter(normalized_phone=normalized).values_list('id', flat=True))
+
+def resolve_patient_ids(patient):
+    """Ids of every Patient sharing this patient's phone, always including the patient itself."""
+    ids = resolve_patient_ids_by_phone(patient.phone_number)
+    return ids if patient.id in ids else [patient.id, *ids]
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     R = 6371.0 # Radius of Earth in kilometers
     lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(radians, [lat1, lon1, lat2, lon2])
@@ -81,76 +84,53 @@ def _get_available_slots_for_doctor(doctor_id, date_str):
     """Returns list of available HH:MM strings for a single date."""
     try:
         target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        doctor = Doctor.objects.get(id=doctor_id)
-    except (ValueError, Doctor.DoesNotExist):
+    except ValueError:
         return None
-    
-    # Get doctor's schedule or use defaults
+    # Read from the per-day occupancy bitmap instead of re-querying schedule + tokens
+    return SlotOccupancy.available_slots(doctor_id, target_date)
+
+# --- Weak ETags for the polled endpoints ---
+# Built from cache counters (QueueVersion & co.), so a 304 never touches Token.
+# Returning None skips the conditional check and lets the view answer as usual;
+# that is always the case with a process-local cache, where changes made by the
+# Q cluster or another worker would not move this process's counters.
+def _etag_date(date_str):
     try:
-        schedule = DoctorSchedule.objects.get(doctor=doctor)
-        start_time = schedule.start_time
-        end_time = schedule.end_time
-        slot_duration_minutes = schedule.slot_duration_minutes
-        max_slots = schedule.max_slots_per_day
-    except DoctorSchedule.DoesNotExist:
-        # Default schedule if none exists
-        start_time = time(9, 0)
-        end_time = time(17, 0)
-        slot_duration_minutes = 15
-        max_slots = None
-    
-    slot_duration = timedelta(minutes=slot_duration_minutes)
-    all_slots = []
-    current_time = datetime.combine(target_date, start_time)
-    end_datetime = datetime.combine(target_date, end_time)
-    
-    while current_time < end_datetime:
-        all_slots.append(current_time.time())
-        current_time += slot_duration
-        
-        # Limit slots if max_slots is set
-        if max_slots and len(all_slots) >= max_slots:
-            break
-    
-    booked_tokens = Token.objects.filter(
-        doctor_id=doctor_id, date=target_date, appointment_time__isnull=False
-    ).exclude(status__iexact='cancelled').exclude(status__iexact='skipped')
-    booked_slots = {token.appointment_time for token in booked_tokens}
-    available_slots = [slot for slot in all_slots if slot not in booked_slots]
-    return [slot.strftime('%H:%M') for slot in available_slots]
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
 
-# --- Function to find the next earliest available slot across dates ---
-def _find_next_available_slot_for_doctor(doctor_id):
-    """Finds the next truly available slot (not expired)."""
-    try:
-        doctor = Doctor.objects.get(id=doctor_id)
-    except Doctor.DoesNotExist:
-        return None, None
+def _live_queue_etag(request, doctor_id=None, date=None, **kwargs):
+    day = _etag_date(date)
+    if day is None or not cache_is_shared():
+        return None
+    return f'W/"queue-{doctor_id}-{day.isoformat()}-{QueueVersion.get(doctor_id, day)}"'
 
-    now = timezone.now()
-    today = now.date()
-    current_time = now.time()
-    
-    # Check up to 30 days in the future
-    for i in range(30):
-        check_date = today + timedelta(days=i)
-        date_str = check_date.strftime('%Y-%m-%d')
-        available_slots = _get_available_slots_for_doctor(doctor_id, date_str)
+def _available_slots_etag(request, doctor_id=None, date=None, **kwargs):
+    """Free slots change with the doctor's tokens that day and with the doctor's schedule"""
+    day = _etag_date(date)
+    if day is None or not cache_is_shared():
+        return None
+    return f'W/"slots-{doctor_id}-{day.isoformat()}-{QueueVersion.get(doctor_id, day)}-{ScheduleVersion.get(doctor_id)}"'
 
-        if available_slots:
-            # If today, only return slots that are in the future
-            if check_date == today:
-                future_slots = [
-                    slot for slot in available_slots
-                    if datetime.strptime(slot, '%H:%M').time() > current_time
-                ]
-                if future_slots:
-                    return check_date, future_slots[0]
-            else:
-                # Future date - return first available slot
-                return check_date, available_slots[0]
+def _patient_token_etag(request, *args, **kwargs):
+    """Versions of every patient record sharing the caller's phone, plus the day the view calls today.
 
-    return None, None
+    Renaming a doctor or clinic does not change it; the token card catches up on the next token change.
+    """
+    user = request.user
+    if not hasattr(user, 'patient') or not cache_is_shared():
+        return None
+    versions = PatientTokenVersion.get_many(resolve_patient_ids(user.patient))
+    state = ','.join(f"{patient_id}:{versions[patient_id]}" for patient_id in sorted(versions))
+    digest = hashlib.sha1(f"{timezone.now().date().isoformat()}|{state}".encode()).hexdigest()[:20]
+    return f'W/"token-{digest}"'
+
+# --- Function to find the next earliest available slot across dates ---
+def _find_next_available_slot_for_doctor(doctor_id):
+    """Finds the next truly available slot (not expired) within 30 days."""
+    found = SlotOccupancy.next_available_slots([doctor_id], days=30)
+    return next(iter(found.values()), (None, None))
 
 # ====================================================================
 # --- START IVR USER CREATION ENHANCEMENT ---
@@ -182,11 +162,9 @@ def _create_ivr_token(doctor, appointment_date, appointment_time_str, caller_pho
             normalized_caller = normalize_phone_number(caller_phone_number)
             
             # Check if ANY user has a patient with this phone number (sync by phone, not username)
-            existing_patient_with_user = None
-            for patient in Patient.objects.filter(user__isnull=False):
-                if normalize_phone_number(patient.phone_number) == normalized_caller:
-                    existing_patient_with_user = patient
-                    break
+            existing_patient_with_user = Patient.objects.filter(
+                normalized_phone=normalized_caller, user__isnull=False
+            ).exclude(id=patient.id).select_related('user').first() if normalized_caller else None
             if existing_patient_with_user:
                 # Found existing patient with user - merge this IVR patient with the web patient
                 web_patient = existing_patient_with_user
@@ -251,11 +229,7 @@ def _create_ivr_token(doctor, appointment_date, appointment_time_str, caller_pho
 
 
     # Check for existing active token on ANY day across ALL patients with same phone number
-    normalized_caller = normalize_phone_number(caller_phone_number)
-    matching_patients = []
-    for p in Patient.objects.all():
-        if normalize_phone_number(p.phone_number) == normalized_caller:
-            matching_patients.append(p.id)
+    matching_patients = resolve_patient_ids_by_phone(caller_phone_number)
     
     existing_active_tokens = Token.objects.filter(patient_id__in=matching_patients).exclude(status__iexact='completed').exclude(status__iexact='cancelled').exclude(status__iexact='skipped')
     if existing_active_tokens.exists():
@@ -309,6 +283,7 @@ def _create_ivr_token(doctor, appointment_date, appointment_time_str, caller_pho
 
 # --- Standard API Views ---
 
+@method_decorator(condition(etag_func=_available_slots_etag), name='get')
 class AvailableSlotsView(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request, doctor_id, date):
@@ -317,6 +292,7 @@ class AvailableSlotsView(APIView):
             return Response({'error': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
         return Response(formatted_slots, status=status.HTTP_200_OK)
 
+@method_decorator(condition(etag_func=_available_slots_etag), name='get')
 class PublicAvailableSlotsView(APIView):
     permission_classes = [permissions.AllowAny]
     def get(self, request, doctor_id, date):
@@ -366,36 +342,43 @@ class ClinicAnalyticsView(APIView):
         avg_wait_minutes = round(avg_wait_data['avg_duration'].total_seconds() / 60, 1) if avg_wait_data['avg_duration'] else 0
 
         # Add AI predictions for each doctor
+        doctors = list(clinic.doctors.all())
+        try:
+            predicted_waits = dict(zip(
+                [doctor.id for doctor in doctors],
+                waiting_time_predictor.predict_many([(doctor.id, None) for doctor in doctors])
+            ))
+        except Exception:
+            predicted_waits = {}
+        counts_by_doctor = doctor_status_counts(clinic.id, today)
+        totals = clinic_totals(counts_by_doctor)
         doctor_predictions = []
-        for doctor in clinic.doctors.all():
-            try:
-                predicted_wait = waiting_time_predictor.predict_waiting_time(doctor.id)
-                current_queue = todays_tokens.filter(doctor=doctor, status__iregex=r'^(waiting|confirmed)$').count()
-                doctor_predictions.append({
-                    'doctor_name': doctor.name,
-                    'specialization': doctor.specialization,
-                    'predicted_waiting_time': predicted_wait,
-                    'current_queue_length': current_queue,
-                    'todays_patients': todays_tokens.filter(doctor=doctor).count()
-                })
-            except Exception:
-                doctor_predictions.append({
-                    'doctor_name': doctor.name,
-                    'specialization': doctor.specialization,
-                    'predicted_waiting_time': None,
-                    'current_queue_length': todays_tokens.filter(doctor=doctor, status__iregex=r'^(waiting|confirmed)$').count(),
-                    'todays_patients': todays_tokens.filter(doctor=doctor).count()
-                })
+        for doctor in doctors:
+            counts = counts_by_doctor.get(doctor.id) or empty_counts()
+            doctor_predictions.append({
+                'doctor_name': doctor.name,
+                'specialization': doctor.specialization,
+                'predicted_waiting_time': predicted_waits.get(doctor.id),
+                'current_queue_length': counts['queue'],
+                'todays_patients': counts['total']
+            })
+
+        # Busiest doctors first, as before; doctors without tokens today are left out
+        doctor_names = {doctor.id: doctor.name for doctor in doctors}
+        doctor_workload = sorted(
+            ({'doctor__name': doctor_names.get(doctor_id), 'count': counts['total']} for doctor_id, counts in counts_by_doctor.items()),
+            key=lambda row: -row['count']
+        )
 
         stats = {
             'clinic_name': clinic.name, 'date': today.strftime("%B %d, %Y"),
-            'total_patients': todays_tokens.count(),
+            'total_patients': totals['total'],
             'average_wait_time_minutes': avg_wait_minutes,
-            'doctor_workload': list(todays_tokens.values('doctor__name').annotate(count=Count('id')).order_by('-count')),
+            'doctor_workload': doctor_workload,
             'doctor_ai_predictions': doctor_predictions,
             'patient_status_breakdown': {
-                'waiting': todays_tokens.filter(status='waiting').count(),
-                'confirmed': todays_tokens.filter(status='confirmed').count(),
+                'waiting': totals['waiting'],
+                'confirmed': totals['confirmed'],
                 'completed': completed_tokens.count()
             }
         }
@@ -411,14 +394,8 @@ class PatientRegisterView(generics.CreateAPIView):
         
         # Check if patient already exists from IVR booking (sync by phone number)
         if phone_number:
-            # Normalize phone number for comparison
-            normalized_phone = normalize_phone_number(phone_number)
-            
             # Check for any patient with this phone number (with or without user)
-            existing_patients = []
-            for patient in Patient.objects.all():
-                if normalize_phone_number(patient.phone_number) == normalized_phone:
-                    existing_patients.append(patient)
+            existing_patients = list(Patient.objects.filter(id__in=resolve_patient_ids_by_phone(phone_number)))
             if existing_patients:
                 # Check if any of these patients already have a user account
                 patient_with_user = next((p for p in existing_patients if p.user is not None), None)
@@ -541,11 +518,7 @@ class ConfirmArrivalView(APIView):
         
         try:
             # Find tokens by normalized phone number
-            user_phone_normalized = normalize_phone_number(user.patient.phone_number)
-            matching_patients = []
-            for patient in Patient.objects.all():
-                if normalize_phone_number(patient.phone_number) == user_phone_normalized:
-                    matching_patients.append(patient.id)
+            matching_patients = resolve_patient_ids(user.patient)
             
             token = Token.objects.filter(
                 patient_id__in=matching_patients, 
@@ -644,11 +617,7 @@ class PatientCancelTokenView(APIView):
         today = timezone.now().date()
         try:
             # Find tokens by normalized phone number
-            user_phone_normalized = normalize_phone_number(user.patient.phone_number)
-            matching_patients = []
-            for patient in Patient.objects.all():
-                if normalize_phone_number(patient.phone_number) == user_phone_normalized:
-                    matching_patients.append(patient.id)
+            matching_patients = resolve_patient_ids(user.patient)
             
             token = Token.objects.filter(
                 patient_id__in=matching_patients,
@@ -666,6 +635,7 @@ class PatientCancelTokenView(APIView):
             return Response({'error': 'You do not have an active token to cancel.'}, status=status.HTTP_404_NOT_FOUND)
 
 # --- CORRECTED GetPatientTokenView ---
+@method_decorator(condition(etag_func=_patient_token_etag), name='get')
 class GetPatientTokenView(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request, *args, **kwargs):
@@ -674,13 +644,9 @@ class GetPatientTokenView(APIView):
             return Response({'error': 'No patient profile found.'}, status=status.HTTP_400_BAD_REQUEST)
         try:
             today = timezone.now().date()
-            user_phone_normalized = normalize_phone_number(user.patient.phone_number)
 
             # Find tokens by normalized phone number (not just patient ID)
-            matching_patients = []
-            for patient in Patient.objects.all():
-                if normalize_phone_number(patient.phone_number) == user_phone_normalized:
-                    matching_patients.append(patient.id)
+            matching_patients = resolve_patient_ids(user.patient)
 
             # Get today's token first, then future tokens (case-insensitive status check)
             token = Token.objects.filter(
@@ -736,11 +702,7 @@ class PatientCreateTokenView(APIView):
             return Response({'error': 'Invalid data provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Check for active appointments across all patients with same phone number
-        user_phone_normalized = normalize_phone_number(user.patient.phone_number)
-        matching_patients = []
-        for patient in Patient.objects.all():
-            if normalize_phone_number(patient.phone_number) == user_phone_normalized:
-                matching_patients.append(patient.id)
+        matching_patients = resolve_patient_ids(user.patient)
         
         active_tokens = Token.objects.filter(
             patient_id__in=matching_patients
@@ -771,22 +733,7 @@ class PatientCreateTokenView(APIView):
                 for_appointment_time=appointment_time
             )
             
-            # Calculate queue position more accurately
-            if appointment_time:
-                # For scheduled appointments, count patients before this time
-                queue_position = Token.objects.filter(
-                    doctor=doctor,
-                    date=appointment_date,
-                    status__iregex=r'^(waiting|confirmed)$',
-                    appointment_time__lt=appointment_time
-                ).count() + 1
-            else:
-                # For walk-ins, count all active patients
-                queue_position = Token.objects.filter(
-                    doctor=doctor,
-                    date=appointment_date,
-                    status__iregex=r'^(waiting|confirmed)$'
-                ).count() + 1
+            queue_position = queue_state.position(new_appointment)
                 
             logger.info(f"Token creation prediction: {predicted_wait} min, queue position: {queue_position}")
         except Exception as e:
@@ -943,21 +890,7 @@ class TokenListCreate(generics.ListCreateAPIView):
                     for_appointment_time=appointment_time
                 )
                 
-                if appointment_time:
-                    queue_position = Token.objects.filter(
-                        doctor=doctor,
-                        date=today,
-                        status__iregex=r'^(waiting|confirmed)$',
-                        appointment_time__lt=appointment_time
-                    ).count() + 1
-                else:
-                    # Walk-in patient
-                    queue_position = Token.objects.filter(
-                        doctor=doctor,
-                        date=today,
-                        status__iregex=r'^(waiting|confirmed)$',
-                        created_at__lt=new_token.created_at
-                    ).count() + 1
+                queue_position = queue_state.position(new_token)
                     
                 logger.info(f"Receptionist token prediction: {predicted_wait} min, queue position: {queue_position}")
             except Exception as e:
@@ -1136,13 +1069,9 @@ class PatientHistoryView(generics.ListAPIView):
             # Get the patient and find all patients with same normalized phone number
             try:
                 patient = Patient.objects.get(id=patient_id)
-                normalized_phone = normalize_phone_number(patient.phone_number)
                 
                 # Find all patients with same phone number (IVR + web accounts)
-                matching_patients = []
-                for p in Patient.objects.all():
-                    if normalize_phone_number(p.phone_number) == normalized_phone:
-                        matching_patients.append(p.id)
+                matching_patients = resolve_patient_ids(patient)
                 
                 # Return consultations from ALL matching patients
                 return Consultation.objects.filter(patient_id__in=matching_patients).order_by('-date')
@@ -1164,13 +1093,9 @@ class PatientHistorySearchView(APIView):
         try:
             # Normalize phone number for search
             normalized_phone = normalize_phone_number(phone_number)
-            matching_patients = []
             
             # Find all patients with matching normalized phone
-            for patient in Patient.objects.all():
-                patient_normalized = normalize_phone_number(patient.phone_number)
-                if patient_normalized == normalized_phone:
-                    matching_patients.append(patient.id)
+            matching_patients = resolve_patient_ids_by_phone(phone_number)
             
             # Also try direct phone number match as fallback
             if not matching_patients:
@@ -1243,6 +1168,7 @@ class PatientHistorySearchView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+@method_decorator(condition(etag_func=_live_queue_etag), name='get')
 class PatientLiveQueueView(generics.ListAPIView):
     serializer_class = AnonymizedTokenSerializer
     permission_classes = [permissions.AllowAny]
@@ -1256,6 +1182,26 @@ class PatientLiveQueueView(generics.ListAPIView):
         status_priority = Case(When(status='in_consultancy', then=Value(1)), When(status='confirmed', then=Value(2)), When(status='waiting', then=Value(3)), default=Value(4))
         return Token.objects.filter(doctor_id=doctor_id, date=target_date, status__in=active_statuses).order_by(status_priority, F('appointment_time').asc(nulls_last=True), 'created_at')
 
+@require_GET
+def patient_live_queue_stream(request, doctor_id, date):
+    """PatientLiveQueueView as a Server-Sent Events stream, for networks where WebSockets are blocked"""
+    try:
+        target_date = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+    is_asgi = isinstance(request, ASGIRequest)
+    if not is_asgi and not getattr(settings, 'QUEUE_STREAM_ALLOW_WSGI', False):
+        # Under WSGI an open stream pins a worker for as long as the page is open.
+        # 204 makes EventSource give up without reconnecting; the client keeps polling over REST.
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+    stream = QueueEventStream(doctor_id, target_date, last_event_id=request.headers.get('Last-Event-ID'))
+    events = stream.async_events() if is_asgi else stream.events()
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 class ConsultationCreateView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -1575,19 +1521,10 @@ def ivr_handle_next_available_spec(request, clinic_id):
         specializations = list(Doctor.objects.filter(clinic=clinic).values_list('specialization', flat=True).distinct())
         spec = specializations[int(choice) - 1]
         
-        # Find next available doctor in this specialization
-        doctors = Doctor.objects.filter(clinic=clinic, specialization=spec)
-        best_doctor = None
-        earliest_date = None
-        earliest_slot = None
-        
-        for doctor in doctors:
-            app_date, slot_str = _find_next_available_slot_for_doctor(doctor.id)
-            if app_date and slot_str:
-                if earliest_date is None or app_date < earliest_date:
-                    earliest_date = app_date
-                    earliest_slot = slot_str
-                    best_doctor = doctor
+        # Find next available doctor in this specialization (one search across all of them)
+        doctors = {d.id: d for d in Doctor.objects.filter(clinic=clinic, specialization=spec)}
+        best_doctor_id, earliest_date, earliest_slot = SlotOccupancy.earliest_available_slot(doctors.keys(), days=30)
+        best_doctor = doctors.get(best_doctor_id)
         
         if best_doctor:
             today = timezone.now().date()
@@ -1715,32 +1652,12 @@ def ivr_handle_date_input(request, clinic_id, spec):
         doctors = Doctor.objects.filter(clinic=clinic, specialization=spec)
         
         if booking_type == 'next':  # Next available doctor for this date
-            best_doctor = None
-            best_slot = None
-            
-            for doctor in doctors:
-                # Get fresh available slots (checks for bookings in real-time)
-                available_slots = _get_available_slots_for_doctor(doctor.id, target_date.strftime('%Y-%m-%d'))
-                if available_slots:
-                    # Filter out past slots if it's today
-                    if target_date == today:
-                        # Get current time in local timezone
-                        now_local = timezone.localtime(timezone.now())
-                        current_time = now_local.time()
-                        future_slots = [
-                            slot for slot in available_slots
-                            if datetime.strptime(slot, '%H:%M').time() > current_time
-                        ]
-                        if future_slots:
-                            best_doctor = doctor
-                            best_slot = future_slots[0]
-                            ivr_logger.info(f"IVR: Found available slot {best_slot} with Dr. {doctor.name} on {target_date}")
-                            break
-                    else:
-                        best_doctor = doctor
-                        best_slot = available_slots[0]
-                        ivr_logger.info(f"IVR: Found available slot {best_slot} with Dr. {doctor.name} on {target_date}")
-                        break
+            # Single-day search across the specialization (past slots are skipped for today)
+            doctors_by_id = {d.id: d for d in doctors}
+            best_doctor_id, _, best_slot = SlotOccupancy.earliest_available_slot(doctors_by_id.keys(), start_date=target_date, days=1)
+            best_doctor = doctors_by_id.get(best_doctor_id)
+            if best_doctor:
+                ivr_logger.info(f"IVR: Found available slot {best_slot} with Dr. {best_doctor.name} on {target_date}")
             
             if best_doctor and best_slot:
                 date_spoken = "today" if target_date == today else target_date.strftime("%B %d")
@@ -2537,11 +2454,7 @@ class TokenWaitTimeView(APIView):
                 return Response({'error': 'Only patients can check wait times.'}, status=status.HTTP_403_FORBIDDEN)
             
             # Find token by ID and ensure it belongs to this patient (or same phone number)
-            user_phone_normalized = normalize_phone_number(user.patient.phone_number)
-            matching_patients = []
-            for patient in Patient.objects.all():
-                if normalize_phone_number(patient.phone_number) == user_phone_normalized:
-                    matching_patients.append(patient.id)
+            matching_patients = resolve_patient_ids(user.patient)
             
             token = Token.objects.filter(
                 id=token_id,
@@ -2551,32 +2464,17 @@ class TokenWaitTimeView(APIView):
             if not token:
                 return Response({'error': 'Token not found.'}, status=status.HTTP_404_NOT_FOUND)
             
-            # Get AI prediction for waiting time
+            # Get AI prediction for waiting time, with its p10/p50/p90 range
+            wait_range = None
             try:
-                predicted_wait = waiting_time_predictor.predict_waiting_time(
-                    token.doctor.id,
-                    current_time=timezone.now(),
-                    for_appointment_time=token.appointment_time
-                )
+                prediction = prediction_cache.interval(token.doctor_id, appointment_time=token.appointment_time)
+                predicted_wait = prediction['expected']
+                wait_range = {'p10': prediction['p10'], 'p50': prediction['p50'], 'p90': prediction['p90']}
             except Exception as e:
                 logger.error(f"Failed to predict waiting time for token {token_id}: {e}")
                 predicted_wait = 15  # Fallback
             
-            # Calculate queue position
-            if token.appointment_time:
-                queue_position = Token.objects.filter(
-                    doctor=token.doctor,
-                    date=token.date,
-                    status__iregex=r'^(waiting|confirmed)$',
-                    appointment_time__lt=token.appointment_time
-                ).count() + 1
-            else:
-                queue_position = Token.objects.filter(
-                    doctor=token.doctor,
-                    date=token.date,
-                    status__iregex=r'^(waiting|confirmed)$',
-                    created_at__lt=token.created_at
-                ).count() + 1
+            queue_position = queue_state.position(token)
             
             # Format appointment time
             appointment_time_str = None
@@ -2586,6 +2484,7 @@ class TokenWaitTimeView(APIView):
             return Response({
                 'success': True,
                 'predicted_wait_minutes': predicted_wait,
+                'predicted_wait_range': wait_range,
                 'queue_position': queue_position,
                 'appointment_time': appointment_time_str,
                 'doctor_name': token.doctor.name if token.doctor else 'Unknown',
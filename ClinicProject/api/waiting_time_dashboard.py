@@ -5,6 +5,9 @@ from django.utils import timezone
 from django.db.models import Avg, Count
 from .models import Token, Doctor, Clinic
 from .waiting_time_predictor import waiting_time_predictor
+from .slot_occupancy import SlotOccupancy
+from .queue_simulator import QueueSimulator
+from .queue_state import queue_state
 from datetime import datetime, timedelta
 import logging
 
@@ -30,8 +33,29 @@ class ClinicWaitingTimeDashboardView(APIView):
                 doctors_data = []
                 clinic_avg_wait = 0
                 total_queue = 0
+                clinic_doctors = list(Doctor.objects.filter(clinic=clinic))
                 
-                for doctor in Doctor.objects.filter(clinic=clinic):
+                # Next free slot for every doctor of the clinic in one search
+                next_slots = SlotOccupancy.next_available_slots([d.id for d in clinic_doctors], days=30)
+                
+                # AI prediction for a new patient, for every doctor in one batch
+                predicted_waits = {}
+                try:
+                    predicted_waits = dict(zip(
+                        [d.id for d in clinic_doctors],
+                        waiting_time_predictor.predict_many([(d.id, None) for d in clinic_doctors], current_time=current_time)
+                    ))
+                except Exception as e:
+                    logger.error(f"Prediction error for clinic {clinic.id}: {e}")
+                
+                # Simulated start times for every queued token of the clinic
+                queue_forecasts = None
+                try:
+                    queue_forecasts = QueueSimulator.forecast([d.id for d in clinic_doctors], now=current_time)
+                except Exception as e:
+                    logger.error(f"Queue simulation error for clinic {clinic.id}: {e}")
+                
+                for doctor in clinic_doctors:
                     # Current queue length
                     current_queue = Token.objects.filter(
                         doctor=doctor,
@@ -39,12 +63,7 @@ class ClinicWaitingTimeDashboardView(APIView):
                         status__in=['waiting', 'confirmed', 'in_consultation']
                     ).count()
                     
-                    # AI prediction for new patient
-                    predicted_wait = None
-                    try:
-                        predicted_wait = waiting_time_predictor.predict_waiting_time(doctor.id)
-                    except Exception as e:
-                        logger.error(f"Prediction error for doctor {doctor.id}: {e}")
+                    predicted_wait = predicted_waits.get(doctor.id)
                     
                     # Today's average actual waiting time
                     today_completed = Token.objects.filter(
@@ -66,10 +85,10 @@ class ClinicWaitingTimeDashboardView(APIView):
                         actual_avg_wait = round(total_wait / count) if count > 0 else 0
                     
                     # Next available slot time
-                    next_slot_info = self._get_next_available_slot(doctor, current_time)
+                    next_slot_info = self._get_next_available_slot(doctor, current_time, next_slots)
                     
                     # Expected consultation start for current queue
-                    expected_start = self._calculate_expected_start_time(doctor, current_time)
+                    expected_start = self._calculate_expected_start_time(doctor, current_time, queue_forecasts)
                     
                     doctor_data = {
                         'doctor_id': doctor.id,
@@ -114,19 +133,20 @@ class ClinicWaitingTimeDashboardView(APIView):
             logger.error(f"Dashboard error: {e}")
             return Response({'error': 'Failed to load waiting times'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    def _get_next_available_slot(self, doctor, current_time):
+    def _get_next_available_slot(self, doctor, current_time, next_slots=None):
         """Get next available appointment slot for doctor"""
-        from .views import _find_next_available_slot_for_doctor
-        
         try:
-            next_date, next_time = _find_next_available_slot_for_doctor(doctor.id)
+            if next_slots is None:
+                next_slots = SlotOccupancy.next_available_slots([doctor.id], days=30)
+            next_date, next_time = next_slots.get(doctor.id, (None, None))
             if next_date and next_time:
                 slot_datetime = datetime.combine(next_date, datetime.strptime(next_time, '%H:%M').time())
                 slot_datetime = timezone.make_aware(slot_datetime)
                 
-                if next_date == current_time.date():
+                local_today = timezone.localtime(current_time).date()
+                if next_date == local_today:
                     date_text = "Today"
-                elif next_date == current_time.date() + timedelta(days=1):
+                elif next_date == local_today + timedelta(days=1):
                     date_text = "Tomorrow"
                 else:
                     date_text = next_date.strftime('%b %d')
@@ -142,45 +162,29 @@ class ClinicWaitingTimeDashboardView(APIView):
         
         return None
     
-    def _calculate_expected_start_time(self, doctor, current_time):
+    def _calculate_expected_start_time(self, doctor, current_time, forecasts=None, limit=5):
         """Calculate when current queue will likely start consultation"""
         try:
-            # Get current queue in order
-            queue_tokens = Token.objects.filter(
-                doctor=doctor,
-                date=current_time.date(),
-                status__in=['waiting', 'confirmed']
-            ).order_by('created_at')
+            if forecasts is None:
+                forecasts = QueueSimulator.forecast([doctor.id], now=current_time)
+            queue_forecast = forecasts.get(doctor.id) or []
             
-            if not queue_tokens.exists():
+            if not queue_forecast:
                 return None
             
-            # Estimate 15 minutes per consultation
-            avg_consultation_time = 15
-            
-            # If doctor is currently consulting, add remaining time
-            current_consultation = Token.objects.filter(
-                doctor=doctor,
-                date=current_time.date(),
-                status='in_consultation'
-            ).first()
-            
-            start_time = current_time
-            if current_consultation:
-                # Assume 10 minutes remaining for current consultation
-                start_time = current_time + timedelta(minutes=10)
-            
-            # Calculate expected start for each token in queue
+            # Expected start for each token in queue, with the simulated 10th-90th percentile range
             expected_times = []
-            for i, token in enumerate(queue_tokens):
-                expected_start = start_time + timedelta(minutes=i * avg_consultation_time)
+            for entry in queue_forecast[:limit]:
+                expected_start = current_time + timedelta(minutes=entry['expected_minutes'])
                 expected_times.append({
-                    'token_id': token.id,
+                    'token_id': entry['token_id'],
                     'expected_start': expected_start.strftime('%I:%M %p'),
-                    'minutes_from_now': int((expected_start - current_time).total_seconds() / 60)
+                    'minutes_from_now': int(entry['expected_minutes']),
+                    'earliest_start': (current_time + timedelta(minutes=entry['p10_minutes'])).strftime('%I:%M %p'),
+                    'latest_start': (current_time + timedelta(minutes=entry['p90_minutes'])).strftime('%I:%M %p'),
                 })
             
-            return expected_times[:5]  # Return first 5 in queue
+            return expected_times  # First `limit` in queue
             
         except Exception as e:
             logger.error(f"Expected start calculation error: {e}")
@@ -200,14 +204,8 @@ class MyTokenWaitingTimeView(APIView):
             current_time = timezone.now()
             
             # Find user's active token
-            from .views import normalize_phone_number
-            user_phone_normalized = normalize_phone_number(user.patient.phone_number)
-            
-            matching_patients = []
-            from .models import Patient
-            for patient in Patient.objects.all():
-                if normalize_phone_number(patient.phone_number) == user_phone_normalized:
-                    matching_patients.append(patient.id)
+            from .views import resolve_patient_ids
+            matching_patients = resolve_patient_ids(user.patient)
             
             token = Token.objects.filter(
                 patient_id__in=matching_patients,
@@ -219,12 +217,7 @@ class MyTokenWaitingTimeView(APIView):
                 return Response({'error': 'No active token found for today'}, status=status.HTTP_404_NOT_FOUND)
             
             # Calculate position in queue
-            queue_position = Token.objects.filter(
-                doctor=token.doctor,
-                date=today,
-                status__in=['waiting', 'confirmed'],
-                created_at__lt=token.created_at
-            ).count() + 1
+            queue_position = queue_state.position(token)
             
             # Get AI prediction
             predicted_wait = None
@@ -235,7 +228,7 @@ class MyTokenWaitingTimeView(APIView):
             
             # Calculate expected consultation start
             dashboard_view = ClinicWaitingTimeDashboardView()
-            expected_times = dashboard_view._calculate_expected_start_time(token.doctor, current_time)
+            expected_times = dashboard_view._calculate_expected_start_time(token.doctor, current_time, limit=None)
             
             my_expected_time = None
             if expected_times:
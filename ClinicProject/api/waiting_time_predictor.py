@@ -11,28 +11,197 @@ except ImportError as e:
     ML_AVAILABLE = False
     print(f"ML dependencies not available: {e}")
     print("Install with: pip install pandas scikit-learn joblib")
-import os
-from datetime import datetime, timedelta
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from django.db.models import Count, Q
 from django.utils import timezone
 from .models import Token, Doctor
+from .model_registry import MODEL_FILE, SCALER_FILE, model_registry
+from .service_time_stats import ServiceTimeStats
 import logging
 
 logger = logging.getLogger(__name__)
 
+ACTIVE_QUEUE_STATUSES = ['waiting', 'confirmed', 'in_consultancy']
+
+# Percentiles reported by the interval predictions
+PREDICTION_QUANTILES = (10, 50, 90)
+# Band used when the model cannot provide a spread (heuristic fallback or non-forest model)
+FALLBACK_INTERVAL_FACTORS = {10: 0.5, 50: 1.0, 90: 1.5}
+
+
+class FeatureSpec:
+    """Ordered list of model inputs shared by training and inference.
+
+    The spec is stored in the registry metadata of every trained model and
+    compared on load, so a model trained on different columns is rejected once
+    instead of failing inside every prediction.
+    """
+
+    def __init__(self, features, version=1):
+        self.features = tuple(features)
+        self.version = version
+
+    def __len__(self):
+        return len(self.features)
+
+    def to_dict(self):
+        return {'version': self.version, 'features': list(self.features)}
+
+    def matches(self, data):
+        return bool(data) and data.get('version') == self.version and tuple(data.get('features', ())) == self.features
+
+    def matrix(self, columns):
+        """Build an (n, len(spec)) matrix from a mapping of feature name -> column"""
+        return np.column_stack([np.asarray(columns[name]) for name in self.features])
+
+    def row(self, values):
+        """Fast path for a single (1, len(spec)) row from a mapping of feature name -> value"""
+        return np.array([[values[name] for name in self.features]], dtype=float)
+
+
+FEATURE_SPEC = FeatureSpec([
+    'hour',
+    'day_of_week',
+    'doctor_tokens_today',
+    'queue_position',
+    'doctor_id',
+])
+
+
+class ModelBundle(namedtuple('ModelBundle', ['model', 'scaler', 'version', 'mean', 'scale'])):
+    """A loaded (model, scaler) pair plus the scaler's parameters for fast scaling"""
+
+    @classmethod
+    def create(cls, model, scaler, version):
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        return cls(model, scaler, version, mean, scale)
+
+    def transform(self, features):
+        if self.mean is None or self.scale is None:
+            return self.scaler.transform(features)
+        return (features - self.mean) / self.scale
+
+
+class ModelHolder:
+    """Process-wide cache of the current registry version of the model.
+
+    The artifacts are loaded once and kept in memory. At most every
+    CHECK_INTERVAL seconds the registry's CURRENT pointer is re-read, and only
+    a different version triggers a reload. Readers always get a complete
+    (model, scaler) pair because the bundle reference is swapped in one step.
+    Versions that do not match the feature spec are rejected until the pointer moves.
+    """
+    CHECK_INTERVAL = 5.0
+
+    def __init__(self, registry, feature_spec=FEATURE_SPEC):
+        self.registry = registry
+        self.feature_spec = feature_spec
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._bundle = None
+        self._checked_at = None
+        self._rejected_version = None
+
+    def _is_fresh(self):
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self.CHECK_INTERVAL
+
+    def _check_compatible(self, scaler, metadata):
+        saved_spec = (metadata or {}).get('feature_spec')
+        if not self.feature_spec.matches(saved_spec):
+            return f"saved features {saved_spec} != expected {self.feature_spec.to_dict()}"
+        n_features = getattr(scaler, 'n_features_in_', None)
+        if n_features is not None and n_features != len(self.feature_spec):
+            return f"scaler expects {n_features} features, spec has {len(self.feature_spec)}"
+        return None
+
+    def get(self):
+        """Return the current ModelBundle, or None when no usable model is registered"""
+        bundle = self._bundle
+        if self._is_fresh():
+            return bundle
+
+        with self._lock:
+            if self._is_fresh():
+                return self._bundle
+
+            version = self.registry.current_version()
+            self._checked_at = time.monotonic()
+            if version is None:
+                self._bundle = None
+                return None
+            if self._bundle is not None and self._bundle.version == version:
+                return self._bundle
+            if version == self._rejected_version:
+                return None
+
+            try:
+                model, scaler, metadata = self.registry.load(version)
+            except Exception as e:
+                logger.error(f"Failed to load waiting time model version {version}: {e}")
+                return self._bundle
+
+            problem = self._check_compatible(scaler, metadata)
+            if problem:
+                logger.error(f"Ignoring waiting time model version {version}: {problem}")
+                self._rejected_version = version
+                self._bundle = None
+                return None
+
+            self._bundle = ModelBundle.create(model, scaler, version)
+            self.reloads += 1
+            logger.info(f"Loaded waiting time model version {version} (reload #{self.reloads})")
+            return self._bundle
+
+    def publish(self, model, scaler, version):
+        """Swap in a freshly trained model without re-reading it from disk"""
+        with self._lock:
+            self._bundle = ModelBundle.create(model, scaler, version)
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Force the next get() to re-read the CURRENT pointer"""
+        with self._lock:
+            self._checked_at = None
+
+
+model_holder = ModelHolder(model_registry)
+
+
+def _no_progress(phase, percent, **details):
+    pass
+
+
 class WaitingTimePredictor:
-    def __init__(self):
+    def __init__(self, holder=None):
+        self.holder = holder or model_holder
+        self.registry = self.holder.registry
         if not ML_AVAILABLE:
             self.model = None
             self.scaler = None
-            self.model_path = 'waiting_time_model.pkl'
-            self.scaler_path = 'waiting_time_scaler.pkl'
             return
         
         self.model = LinearRegression()
         self.scaler = StandardScaler()
-        self.model_path = 'waiting_time_model.pkl'
-        self.scaler_path = 'waiting_time_scaler.pkl'
         
+    def _current_artifact(self, name):
+        version = self.registry.current_version()
+        return self.registry.artifact_path(version, name) if version else ''
+    
+    @property
+    def model_path(self):
+        """Path of the current registry version's model file ('' when none is promoted)"""
+        return self._current_artifact(MODEL_FILE)
+    
+    @property
+    def scaler_path(self):
+        """Path of the current registry version's scaler file ('' when none is promoted)"""
+        return self._current_artifact(SCALER_FILE)
+    
     def extract_features(self, tokens_data):
         """Extract features from token data for prediction"""
         features = []
@@ -68,49 +237,20 @@ class WaitingTimePredictor:
     def get_early_completion_rate(self, doctor_id, weekday):
         """Get rate of early completions for doctor on specific weekday"""
         try:
-            tokens = Token.objects.filter(
-                doctor_id=doctor_id,
-                date__week_day=weekday + 1,
-                status='completed',
-                completed_at__isnull=False,
-                appointment_time__isnull=False,
-                date__gte=timezone.now().date() - timedelta(days=60)
-            )
-            
-            if not tokens.exists():
+            stats = ServiceTimeStats.summary(doctor_id, weekday=weekday)
+            if not stats['count']:
                 return 0.0
-            
-            early_count = 0
-            for t in tokens:
-                expected = timezone.make_aware(datetime.combine(t.date, t.appointment_time))
-                if t.completed_at < expected:
-                    early_count += 1
-            
-            return early_count / tokens.count()
+            return stats['early_count'] / stats['count']
         except:
             return 0.0
     
     def get_avg_early_time(self, doctor_id, weekday):
         """Get average early completion time for doctor on specific weekday"""
         try:
-            tokens = Token.objects.filter(
-                doctor_id=doctor_id,
-                date__week_day=weekday + 1,
-                status='completed',
-                completed_at__isnull=False,
-                appointment_time__isnull=False,
-                date__gte=timezone.now().date() - timedelta(days=60)
-            )
-            
-            early_times = []
-            for t in tokens:
-                expected = timezone.make_aware(datetime.combine(t.date, t.appointment_time))
-                actual = t.completed_at
-                diff = (actual - expected).total_seconds() / 60
-                if diff < 0:  # Early completion
-                    early_times.append(abs(diff))
-            
-            return np.mean(early_times) if early_times else 0.0
+            stats = ServiceTimeStats.summary(doctor_id, weekday=weekday)
+            if not stats['early_count']:
+                return 0.0
+            return stats['early_minutes_sum'] / stats['early_count']
         except:
             return 0.0
     
@@ -126,44 +266,21 @@ class WaitingTimePredictor:
                 status='completed',
                 completed_at__isnull=False,
                 appointment_time__isnull=False
-            )
+            ).values_list('date', 'appointment_time', 'completed_at')
             
-            if today_completed.count() < 2:  # Need at least 2 consultations for trend
+            today_times = [ServiceTimeStats.delay_minutes(*row) for row in today_completed]
+            if len(today_times) < 2:  # Need at least 2 consultations for trend
                 return 1.0  # Neutral factor
             
-            # Calculate today's average consultation time
-            today_times = []
-            for t in today_completed:
-                expected = timezone.make_aware(datetime.combine(t.date, t.appointment_time))
-                actual = t.completed_at
-                consultation_time = (actual - expected).total_seconds() / 60
-                today_times.append(consultation_time)
-            
             today_avg = np.mean(today_times)
             
-            # Get historical average for this doctor on same weekday
-            weekday = today_date.weekday()
-            historical_tokens = Token.objects.filter(
-                doctor_id=doctor_id,
-                date__week_day=weekday + 1,
-                status='completed',
-                completed_at__isnull=False,
-                appointment_time__isnull=False,
-                date__gte=today_date - timedelta(days=60),
-                date__lt=today_date  # Exclude today
-            )
-            
-            if historical_tokens.count() < 5:  # Need historical data
+            # Historical average for this doctor on same weekday, excluding today's completions
+            stats = ServiceTimeStats.summary(doctor_id, weekday=today_date.weekday())
+            historical_count = stats['count'] - len(today_times)
+            if historical_count < 5:  # Need historical data
                 return 1.0
             
-            historical_times = []
-            for t in historical_tokens:
-                expected = timezone.make_aware(datetime.combine(t.date, t.appointment_time))
-                actual = t.completed_at
-                consultation_time = (actual - expected).total_seconds() / 60
-                historical_times.append(consultation_time)
-            
-            historical_avg = np.mean(historical_times)
+            historical_avg = (stats['delay_sum'] - sum(today_times)) / historical_count
             
             # Calculate trend factor
             if historical_avg != 0:
@@ -180,83 +297,91 @@ class WaitingTimePredictor:
             logger.error(f"Error calculating daily trend: {e}")
             return 1.0
     
-    def prepare_training_data(self, use_all_data=True, days_back=30):
-        """Prepare training data from historical tokens including early completion patterns"""
+    def prepare_training_data(self, use_all_data=True, days_back=30, progress=None, with_days=False):
+        """Prepare training data from historical tokens including early completion patterns
+
+        Everything comes from a single values() query: per-day workload is a
+        group-by size and the queue position is the rank of the token's
+        arrival within its doctor's day. `progress(phase, percent)` is called
+        as the loading and feature phases start. With `with_days`, the local
+        date of each row is returned as a third array (for time-ordered splits).
+        """
+        progress = progress or _no_progress
+        progress('loading', 5)
+        tokens = Token.objects.all()
         if use_all_data:
-            tokens = Token.objects.filter(
-                status='Completed',
-                completed_at__isnull=False,
-                appointment_time__isnull=False,
-                consultation_start_time__isnull=False
-            ).select_related('doctor')
-            logger.info(f"Using ALL consultation data: {tokens.count()} records")
+            label = "ALL consultation data"
         else:
             end_date = timezone.now().date()
             start_date = end_date - timedelta(days=days_back)
-            tokens = Token.objects.filter(
-                created_at__date__gte=start_date,
-                created_at__date__lt=end_date,
-                status='Completed',
-                completed_at__isnull=False,
-                appointment_time__isnull=False,
-                consultation_start_time__isnull=False
-            ).select_related('doctor')
-            logger.info(f"Using recent data ({days_back} days): {tokens.count()} records")
+            tokens = tokens.filter(created_at__date__gte=start_date, created_at__date__lt=end_date)
+            label = f"recent data ({days_back} days)"
+        
+        rows = list(tokens.order_by('id').values_list(
+            'doctor_id', 'created_at', 'status', 'completed_at',
+            'appointment_time', 'consultation_start_time'
+        ))
+        frame = pd.DataFrame(rows, columns=[
+            'doctor_id', 'created_at', 'status', 'completed_at',
+            'appointment_time', 'consultation_start_time'
+        ])
         
-        if tokens.count() < 10:
+        is_training_row = (
+            (frame['status'].str.lower() == 'completed')
+            & frame['completed_at'].notna()
+            & frame['appointment_time'].notna()
+            & frame['consultation_start_time'].notna()
+        )
+        logger.info(f"Using {label}: {int(is_training_row.sum())} records")
+        
+        if is_training_row.sum() < 10:
             logger.warning("Insufficient training data")
-            return None, None
+            return (None, None, None) if with_days else (None, None)
         
-        features = []
-        targets = []
+        # Workload and queue position are counted over every token the doctor
+        # had that (local) day, not just the completed ones
+        progress('features', 20)
+        created_at = pd.to_datetime(frame['created_at'], utc=True)
+        frame['day'] = created_at.dt.tz_convert(timezone.get_current_timezone_name()).dt.date
+        frame['arrival'] = created_at
+        day_groups = frame.groupby(['doctor_id', 'day'], sort=False)['arrival']
+        frame['doctor_tokens_today'] = day_groups.transform('size')
+        frame['queue_position'] = day_groups.rank(method='min')
         
-        for current_token in tokens:
-            try:
-                # Calculate actual waiting time from arrival to consultation start
-                arrival_time = current_token.created_at
-                consultation_start = current_token.consultation_start_time
-                waiting_time = (consultation_start - arrival_time).total_seconds() / 60
-                
-                # Extract enhanced features including early completion patterns
-                hour = current_token.created_at.hour
-                day_of_week = current_token.created_at.weekday()
-                
-                # Doctor workload that day
-                doctor_tokens_today = Token.objects.filter(
-                    doctor=current_token.doctor,
-                    created_at__date=current_token.created_at.date()
-                ).count()
-                
-                # Queue position
-                queue_position = Token.objects.filter(
-                    doctor=current_token.doctor,
-                    created_at__date=current_token.created_at.date(),
-                    created_at__lt=current_token.created_at
-                ).count() + 1
-                
-                features.append([
-                    hour,
-                    day_of_week,
-                    doctor_tokens_today,
-                    queue_position,
-                    current_token.doctor.id
-                ])
-                targets.append(max(0, waiting_time))  # Ensure non-negative wait times
-            except Exception as e:
-                logger.error(f"Error processing token {current_token.id}: {e}")
-                continue
+        training = frame[is_training_row]
+        arrival = training['arrival']
+        consultation_start = pd.to_datetime(training['consultation_start_time'], utc=True)
+        waiting_time = (consultation_start - arrival).dt.total_seconds() / 60
+        
+        features = self.holder.feature_spec.matrix({
+            'hour': arrival.dt.hour,
+            'day_of_week': arrival.dt.weekday,
+            'doctor_tokens_today': training['doctor_tokens_today'],
+            'queue_position': training['queue_position'],
+            'doctor_id': training['doctor_id'],
+        }).astype(np.int64)
+        targets = np.maximum(0, waiting_time.to_numpy())  # Ensure non-negative wait times
         
-        return np.array(features), np.array(targets)
+        if with_days:
+            return features, targets, training['day'].to_numpy()
+        return features, targets
     
-    def train_model(self):
-        """Train the waiting time prediction model"""
+    def train_model(self, progress=None):
+        """Train the waiting time prediction model
+
+        `progress(phase, percent, **details)` is called as training moves through
+        the loading, features, fit, eval and save phases; the final 'done' call
+        carries the registered version and metrics.
+        """
         if not ML_AVAILABLE:
             logger.error("ML dependencies not available. Install pandas, scikit-learn, joblib")
             return False
             
         logger.info("Starting model training...")
+        started = time.monotonic()
+        progress = progress or _no_progress
         
-        X, y = self.prepare_training_data(use_all_data=True)
+        X, y = self.prepare_training_data(use_all_data=True, progress=progress)
         if X is None or len(X) < 10:
             logger.error("Insufficient training data")
             return False
@@ -264,126 +389,259 @@ class WaitingTimePredictor:
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
-        # Scale features
+        # Scale features (fresh scaler so the cached one is never mutated in place)
+        self.scaler = StandardScaler()
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
         
         # Train model with parameters suitable for handling negative values
+        progress('fit', 40)
         from sklearn.ensemble import RandomForestRegressor
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+        self.model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
         self.model.fit(X_train_scaled, y_train)
         
         # Evaluate
+        progress('eval', 80)
         y_pred = self.model.predict(X_test_scaled)
         mae = mean_absolute_error(y_test, y_pred)
         r2 = r2_score(y_test, y_pred)
         
         logger.info(f"Model trained - MAE: {mae:.2f} minutes, R2: {r2:.3f}")
         
-        # Save model
-        self.save_model()
+        # Register the new version and hand it to the in-memory cache
+        progress('save', 90)
+        metrics = {'mae': round(float(mae), 3), 'r2': round(float(r2), 4)}
+        version = self.save_model(
+            metrics=metrics,
+            training_rows=len(X),
+            training_seconds=round(time.monotonic() - started, 2),
+        )
+        progress('done', 100, version=version, metrics=metrics)
         return True
     
-    def save_model(self):
-        """Save trained model and scaler"""
-        joblib.dump(self.model, self.model_path)
-        joblib.dump(self.scaler, self.scaler_path)
-        logger.info("Model saved successfully")
+    def save_model(self, metrics=None, training_rows=None, training_seconds=None, promote=True, details=None):
+        """Register the trained model and scaler as a new registry version
+
+        `details` is merged into the version metadata (e.g. search results).
+        Fitting may use every core, but the stored model predicts single-threaded:
+        it is served inside web workers, one prediction per request.
+        """
+        if 'n_jobs' in self.model.get_params():
+            self.model.set_params(n_jobs=1)
+        version = self.registry.register(self.model, self.scaler, metadata=dict(details or {}, **{
+            'model_type': type(self.model).__name__,
+            'feature_spec': self.holder.feature_spec.to_dict(),
+            'metrics': metrics or {},
+            'training_rows': training_rows,
+            'training_seconds': training_seconds,
+        }), promote=promote)
+        if promote:
+            self.holder.publish(self.model, self.scaler, version)
+        logger.info(f"Model saved successfully as version {version}")
+        return version
     
     def load_model(self):
-        """Load trained model and scaler"""
-        if os.path.exists(self.model_path) and os.path.exists(self.scaler_path):
-            self.model = joblib.load(self.model_path)
-            self.scaler = joblib.load(self.scaler_path)
-            return True
-        return False
+        """Load trained model and scaler from the process-wide cache"""
+        bundle = self.holder.get()
+        if bundle is None:
+            return False
+        self.model = bundle.model
+        self.scaler = bundle.scaler
+        return True
     
-    def predict_waiting_time(self, doctor_id, current_time=None, for_appointment_time=None):
-        """Predict waiting time using improved ML model with enhanced features"""
+    def _queue_snapshot(self, doctor_ids, day, with_appointments=False):
+        """Queue counts (and optionally booked appointment times) for many doctors at once"""
+        snapshot = {doctor_id: {'load': 0, 'queue': 0, 'appointments': []} for doctor_id in doctor_ids}
+        
+        counts = Token.objects.filter(doctor_id__in=doctor_ids, date=day).values('doctor_id').annotate(
+            load=Count('id'),
+            queue=Count('id', filter=Q(status__in=ACTIVE_QUEUE_STATUSES)),
+        )
+        for row in counts:
+            snapshot[row['doctor_id']]['load'] = row['load']
+            snapshot[row['doctor_id']]['queue'] = row['queue']
+        
+        if with_appointments:
+            booked = Token.objects.filter(
+                doctor_id__in=doctor_ids,
+                date=day,
+                status__in=ACTIVE_QUEUE_STATUSES,
+                appointment_time__isnull=False
+            ).values_list('doctor_id', 'appointment_time')
+            appointments = defaultdict(list)
+            for doctor_id, appointment_time in booked:
+                appointments[doctor_id].append(appointment_time)
+            for doctor_id, times in appointments.items():
+                snapshot[doctor_id]['appointments'] = sorted(times)
+        
+        return snapshot
+    
+    def predict_many(self, requests, current_time=None):
+        """Predict waiting times for many (doctor_id, appointment_time) pairs at once
+
+        appointment_time may be None to predict for a new walk-in. Queue data for
+        all doctors is read in one grouped query and the model is called once;
+        results are returned in the same order as the requests.
+        """
+        return self._predict(requests, current_time)
+    
+    def predict_intervals_many(self, requests, current_time=None):
+        """Like predict_many, but each result is {'expected', 'p10', 'p50', 'p90'} in minutes.
+
+        With a forest model the quantiles are the spread of the per-tree
+        predictions, computed from a single pass over the trees ('expected' is
+        their mean, i.e. the usual point prediction). Otherwise a fixed band
+        around the point estimate is returned.
+        """
+        return self._predict(requests, current_time, intervals=True)
+    
+    def predict_waiting_time_interval(self, doctor_id, current_time=None, for_appointment_time=None):
+        return self.predict_intervals_many([(doctor_id, for_appointment_time)], current_time=current_time)[0]
+    
+    @staticmethod
+    def _tree_predictions(model, features_scaled):
+        """(n_trees, n_rows) matrix of per-tree predictions, or None for non-ensemble models"""
+        if hasattr(model, 'predict_per_tree'):
+            return model.predict_per_tree(features_scaled)
+        estimators = getattr(model, 'estimators_', None)
+        if not estimators or not hasattr(estimators[0], 'tree_'):
+            return None
+        X = np.ascontiguousarray(features_scaled, dtype=np.float32)
+        return np.stack([estimator.predict(X, check_input=False) for estimator in estimators])
+    
+    @staticmethod
+    def _interval_from_trees(per_tree):
+        expected = np.clip(per_tree.mean(axis=0), 0, 120)
+        quantiles = np.clip(np.percentile(per_tree, PREDICTION_QUANTILES, axis=0), 0, 120)
+        return [
+            dict({'expected': round(expected[i])}, **{
+                f'p{q}': round(quantiles[j, i]) for j, q in enumerate(PREDICTION_QUANTILES)
+            })
+            for i in range(per_tree.shape[1])
+        ]
+    
+    @staticmethod
+    def _interval_from_point(value):
+        return dict({'expected': value}, **{
+            f'p{q}': round(value * factor) for q, factor in FALLBACK_INTERVAL_FACTORS.items()
+        })
+    
+    def _predict(self, requests, current_time=None, intervals=False):
+        requests = list(requests)
+        if not requests:
+            return []
         if current_time is None:
             current_time = timezone.now()
         
-        # Get current active queue
-        current_queue = Token.objects.filter(
-            doctor_id=doctor_id,
-            date=current_time.date(),
-            status__in=['waiting', 'confirmed', 'in_consultancy']
-        ).order_by('appointment_time', 'created_at')
-        
-        queue_count = current_queue.count()
+        doctor_ids = {doctor_id for doctor_id, _ in requests}
+        with_appointments = any(appointment_time for _, appointment_time in requests)
+        snapshot = self._queue_snapshot(doctor_ids, current_time.date(), with_appointments)
         
-        # Calculate queue position
-        if for_appointment_time:
-            patients_before = current_queue.filter(
-                appointment_time__lt=for_appointment_time
-            ).count()
-            queue_position = patients_before + 1
-        else:
-            queue_position = queue_count + 1
+        queue_positions = []
+        for doctor_id, appointment_time in requests:
+            doctor_queue = snapshot[doctor_id]
+            if appointment_time:
+                queue_positions.append(bisect_left(doctor_queue['appointments'], appointment_time) + 1)
+            else:
+                queue_positions.append(doctor_queue['queue'] + 1)
         
         # PRIORITY: Use improved ML model
-        if ML_AVAILABLE and self.load_model():
+        bundle = self.holder.get() if ML_AVAILABLE else None
+        if bundle is not None:
             try:
-                # Enhanced feature extraction
-                hour = current_time.hour
-                minute = current_time.minute
-                day_of_week = current_time.weekday()
-                is_weekend = 1 if day_of_week >= 5 else 0
-                
-                # Appointment time features
-                if for_appointment_time:
-                    appt_hour = for_appointment_time.hour
-                    appt_minute = for_appointment_time.minute
+                spec = self.holder.feature_spec
+                if len(requests) == 1:
+                    doctor_id = requests[0][0]
+                    features = spec.row(self._feature_values(
+                        doctor_id, snapshot[doctor_id]['load'], queue_positions[0], current_time
+                    ))
                 else:
-                    appt_hour = hour
-                    appt_minute = minute
-                
-                # Doctor workload
-                doctor_load = Token.objects.filter(
-                    doctor_id=doctor_id,
-                    date=current_time.date()
-                ).count()
-                
-                # Time since clinic start
-                clinic_start = current_time.replace(hour=9, minute=0, second=0)
-                minutes_since_start = (current_time - clinic_start).total_seconds() / 60
+                    features = spec.matrix({
+                        'hour': np.full(len(requests), current_time.hour),
+                        'day_of_week': np.full(len(requests), current_time.weekday()),
+                        'doctor_tokens_today': [snapshot[doctor_id]['load'] for doctor_id, _ in requests],
+                        'queue_position': queue_positions,
+                        'doctor_id': [doctor_id for doctor_id, _ in requests],
+                    })
                 
-                # Arrival offset (0 for new bookings)
-                arrival_offset = 0
+                features_scaled = bundle.transform(features)
+                logger.info(f"ML prediction for {len(requests)} request(s) across {len(doctor_ids)} doctor(s)")
                 
-                features = np.array([[
-                    hour,
-                    minute,
-                    day_of_week,
-                    is_weekend,
-                    appt_hour,
-                    appt_minute,
-                    queue_position,
-                    doctor_load,
-                    minutes_since_start,
-                    arrival_offset,
-                    doctor_id
-                ]])
-                
-                features_scaled = self.scaler.transform(features)
-                predicted_time = self.model.predict(features_scaled)[0]
+                if intervals:
+                    per_tree = self._tree_predictions(bundle.model, features_scaled)
+                    if per_tree is not None:
+                        return self._interval_from_trees(per_tree)
                 
                 # Ensure reasonable range
-                predicted_time = max(0, min(120, predicted_time))
-                
-                logger.info(f"ML prediction for doctor {doctor_id}: {predicted_time:.1f} min (queue: {queue_position})")
-                return round(predicted_time)
+                predicted = [round(value) for value in np.clip(bundle.model.predict(features_scaled), 0, 120)]
+                if intervals:
+                    return [self._interval_from_point(value) for value in predicted]
+                return predicted
                 
             except Exception as e:
                 logger.error(f"ML prediction failed: {e}")
         
         # Fallback only if ML completely fails
-        if queue_count == 0:
-            return 5
+        results = []
+        for (doctor_id, _), queue_position in zip(requests, queue_positions):
+            if snapshot[doctor_id]['queue'] == 0:
+                results.append(5)
+            else:
+                results.append(max(5, min(60, queue_position * 10)))
+        logger.warning(f"Using fallback prediction for doctor(s) {sorted(doctor_ids)}: {results}")
+        if intervals:
+            return [self._interval_from_point(value) for value in results]
+        return results
+    
+    def _feature_values(self, doctor_id, doctor_tokens_today, queue_position, current_time):
+        return {
+            'hour': current_time.hour,
+            'day_of_week': current_time.weekday(),
+            'doctor_tokens_today': doctor_tokens_today,
+            'queue_position': queue_position,
+            'doctor_id': doctor_id,
+        }
+    
+    def predict_from_queue_state(self, doctor_id, doctor_tokens_today, queue_position, current_time=None):
+        """Model prediction from queue state the caller already has; no queries.
+
+        Returns None when no compatible model is loaded.
+        """
+        bundle = self.holder.get() if ML_AVAILABLE else None
+        if bundle is None:
+            return None
+        if current_time is None:
+            current_time = timezone.now()
         
-        result = max(5, min(60, queue_position * 10))
-        logger.warning(f"Using fallback prediction for doctor {doctor_id}: {result} min")
-        return result
+        features = self.holder.feature_spec.row(
+            self._feature_values(doctor_id, doctor_tokens_today, queue_position, current_time)
+        )
+        predicted = bundle.model.predict(bundle.transform(features))[0]
+        return round(max(0, min(120, predicted)))
+
+    def predict_queue_positions(self, doctor_id, doctor_tokens_today, queue_positions, current_time=None):
+        """predict_from_queue_state for several positions in one doctor's queue, in one model call"""
+        bundle = self.holder.get() if ML_AVAILABLE else None
+        if bundle is None:
+            return None
+        if current_time is None:
+            current_time = timezone.now()
+        if not queue_positions:
+            return []
+
+        count = len(queue_positions)
+        features = self.holder.feature_spec.matrix({
+            'hour': np.full(count, current_time.hour),
+            'day_of_week': np.full(count, current_time.weekday()),
+            'doctor_tokens_today': np.full(count, doctor_tokens_today),
+            'queue_position': queue_positions,
+            'doctor_id': np.full(count, doctor_id),
+        })
+        return [round(value) for value in np.clip(bundle.model.predict(bundle.transform(features)), 0, 120)]
+
+    def predict_waiting_time(self, doctor_id, current_time=None, for_appointment_time=None):
+        """Predict waiting time using improved ML model with enhanced features"""
+        return self.predict_many([(doctor_id, for_appointment_time)], current_time=current_time)[0]
 
 # Global predictor instance
 waiting_time_predictor = WaitingTimePredictor()
\ No newline at end of file
@@ -3,7 +3,9 @@ from rest_framework.response import Response
 from rest_framework import status, permissions
 from django.utils import timezone
 from .waiting_time_predictor import waiting_time_predictor
-from .models import Token, Doctor
+from .models import Token, Doctor, TrainingJob
+from .training_jobs import TrainingJobRunner
+from .prediction_cache import prediction_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,10 +27,8 @@ class PredictWaitingTimeView(APIView):
                 except ValueError:
                     pass
             
-            predicted_time = waiting_time_predictor.predict_waiting_time(
-                doctor_id, 
-                for_appointment_time=appointment_time
-            )
+            prediction = prediction_cache.interval(doctor_id, appointment_time=appointment_time)
+            predicted_time = prediction['expected'] if prediction else None
             
             if predicted_time is None:
                 return Response({
@@ -46,6 +46,11 @@ class PredictWaitingTimeView(APIView):
                 'doctor_id': doctor_id,
                 'doctor_name': doctor.name,
                 'predicted_waiting_time_minutes': predicted_time,
+                'predicted_waiting_time_range': {
+                    'p10': prediction['p10'],
+                    'p50': prediction['p50'],
+                    'p90': prediction['p90'],
+                },
                 'current_queue_length': current_queue,
                 'appointment_time': appointment_time_str,
                 'prediction_timestamp': timezone.now().isoformat()
@@ -61,27 +66,41 @@ class TrainModelView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        """Manually trigger model training"""
+        """Queue model training as a background job"""
         try:
             # Only allow staff to trigger training
             if not (hasattr(request.user, 'doctor') or hasattr(request.user, 'receptionist') or request.user.is_staff):
                 return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
             
-            success = waiting_time_predictor.train_model()
+            job, created = TrainingJobRunner.submit(trigger='manual')
             
-            if success:
-                return Response({
-                    'message': 'Model training completed successfully',
-                    'timestamp': timezone.now().isoformat()
-                })
-            else:
-                return Response({
-                    'error': 'Model training failed - insufficient data or other error'
-                }, status=status.HTTP_400_BAD_REQUEST)
+            return Response({
+                'message': 'Model training queued' if created else 'Model training already in progress',
+                'job': TrainingJobRunner.serialize(job),
+                'status_url': f'/api/waiting-time/train/{job.id}/',
+                'timestamp': timezone.now().isoformat()
+            }, status=status.HTTP_202_ACCEPTED)
                 
         except Exception as e:
-            logger.error(f"Error training model: {e}")
-            return Response({'error': 'Failed to train model'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            logger.error(f"Error queueing model training: {e}")
+            return Response({'error': 'Failed to start model training'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class TrainingJobStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request, job_id=None):
+        """Poll a training job; without an id, return the active or most recent job"""
+        if job_id is None:
+            job = TrainingJobRunner.active_job() or TrainingJob.objects.first()
+            if job is None:
+                return Response({'job': None})
+        else:
+            try:
+                job = TrainingJob.objects.get(id=job_id)
+            except TrainingJob.DoesNotExist:
+                return Response({'error': 'Training job not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({'job': TrainingJobRunner.serialize(job)})
 
 class WaitingTimeStatusView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -89,8 +108,9 @@ class WaitingTimeStatusView(APIView):
     def get(self, request):
         """Get status of waiting time prediction system"""
         try:
-            # Check if model files exist
+            # Check if the registry has a promoted model version
             import os
+            current_version = waiting_time_predictor.registry.current_version()
             model_exists = os.path.exists(waiting_time_predictor.model_path)
             scaler_exists = os.path.exists(waiting_time_predictor.scaler_path)
             
@@ -110,6 +130,8 @@ class WaitingTimeStatusView(APIView):
                 'model_trained': model_exists and scaler_exists,
                 'model_file_exists': model_exists,
                 'scaler_file_exists': scaler_exists,
+                'model_version': current_version,
+                'prediction_cache': prediction_cache.stats(),
                 'training_data_available': training_data_count,
                 'minimum_data_required': 10,
                 'ready_for_predictions': model_exists and scaler_exists and training_data_count >= 10
@@ -136,10 +158,8 @@ class PublicPredictWaitingTimeView(APIView):
                 except ValueError:
                     pass
             
-            predicted_time = waiting_time_predictor.predict_waiting_time(
-                doctor_id, 
-                for_appointment_time=appointment_time
-            )
+            prediction = prediction_cache.interval(doctor_id, appointment_time=appointment_time)
+            predicted_time = prediction['expected'] if prediction else None
             
             if predicted_time is None:
                 return Response({
@@ -157,6 +177,11 @@ class PublicPredictWaitingTimeView(APIView):
                 'doctor_id': doctor_id,
                 'doctor_name': doctor.name,
                 'predicted_waiting_time_minutes': predicted_time,
+                'predicted_waiting_time_range': {
+                    'p10': prediction['p10'],
+                    'p50': prediction['p50'],
+                    'p90': prediction['p90'],
+                },
                 'current_queue_length': current_queue,
                 'appointment_time': appointment_time_str,
                 'prediction_timestamp': timezone.now().isoformat()
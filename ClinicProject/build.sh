@@ -2,6 +2,10 @@
 # Exit immediately if a command exits with a non-zero status.
 set -e
 
+if [ -z "$CACHE_REDIS_URL" ]; then
+  echo "--- WARNING: CACHE_REDIS_URL is not set; each process gets its own cache, so ETags are off and queue positions can lag other processes by a few seconds."
+fi
+
 echo "--- Running database migrations..."
 python manage.py migrate --noinput
 
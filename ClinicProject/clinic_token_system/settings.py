@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 # import dj_database_url # No longer needed for local
 import sys
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,6 +42,7 @@ ALLOWED_HOSTS = [
 
 INSTALLED_APPS = [
     # 'whitenoise.runserver_nostatic', # Removed - Not needed for standard local dev
+    'daphne',  # Must come first: makes runserver serve the ASGI app (WebSockets included)
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -51,6 +53,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
+    'channels',
     'api',
 ]
 
@@ -84,6 +87,45 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'clinic_token_system.wsgi.application'
+ASGI_APPLICATION = 'clinic_token_system.asgi.application'
+
+# --- Cache ---
+# Holds the queue/patient/schedule version counters and the shared layer of the
+# prediction cache (api/prediction_cache.py). Those must be visible to every
+# process - all web workers and the Django-Q cluster - so set CACHE_REDIS_URL
+# (e.g. redis://localhost:6379/1, see .env.example); Redis is required in any
+# deployment. Without it each process has its own in-memory cache, which is
+# only correct for a single process (ETags are then not sent at all);
+# api.prediction_cache.cache_is_shared() reports which case applies.
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', '')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    }
+
+# --- Channel layer for the live queue WebSocket feed ---
+# In-memory by default (single process). Set CHANNEL_REDIS_URL (and install
+# channels-redis) to share queue updates between several server processes.
+CHANNEL_REDIS_URL = config('CHANNEL_REDIS_URL', '')
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        # InMemoryChannelLayer tuned for large groups (see api/channel_layers.py)
+        'default': {'BACKEND': 'api.channel_layers.QueueChannelLayer'},
+    }
 
 
 # --- 2. DATABASE CONFIGURATION (Simplified for Local SQLite) ---
@@ -192,6 +234,9 @@ CORS_ALLOWED_ORIGINS = [
 ]
 # Removed the CORS_FRONTEND_URL logic as it's not needed locally
 CORS_ALLOW_CREDENTIALS = True
+# Polling clients revalidate with If-None-Match and need to read the ETag back
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match')
+CORS_EXPOSE_HEADERS = ['ETag']
 
 
 # --- 5. SMS/IVR CONFIGURATION (Dummy Keys for Simulation) ---
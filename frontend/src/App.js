@@ -9,6 +9,8 @@ import PatientAISummary from './components/PatientAISummary';
 import ScheduleManagement from './components/ScheduleManagement';
 import LiveQueueWidget from './components/LiveQueueWidget';
 import MedicalSummary from './components/MedicalSummary';
+import useLiveQueue from './useLiveQueue';
+import conditionalGet from './conditionalGet';
 
 import medqLogo from './logo.jpg'; // Assuming logo.png is in the src folder
 // Import Enhanced Components
@@ -225,7 +227,7 @@ const ReceptionistDashboardComponent = ({ loggedInUser, onLogout, onSelectPatien
             if (assignedDoctor) {
                 try {
                     // Fetch slots for today's date
-                    const response = await apiClient.get(`/doctors/${assignedDoctor}/available-slots/${today}/`);
+                    const response = await conditionalGet(apiClient, `/doctors/${assignedDoctor}/available-slots/${today}/`);
                     setAvailableSlots(response.data);
                 } catch (err) {
                     console.error("Failed to fetch slots for receptionist view:", err);
@@ -260,7 +262,7 @@ const ReceptionistDashboardComponent = ({ loggedInUser, onLogout, onSelectPatien
             // --- NEW: Refresh available slots after booking ---
             if (assignedDoctor) {
                 try {
-                    const response = await apiClient.get(`/doctors/${assignedDoctor}/available-slots/${today}/`);
+                    const response = await conditionalGet(apiClient, `/doctors/${assignedDoctor}/available-slots/${today}/`);
                     setAvailableSlots(response.data);
                 } catch (err) {
                     console.error("Failed to re-fetch slots:", err);
@@ -1028,7 +1030,6 @@ const PatientDashboardComponent = ({ loggedInUser, onLogout }) => {
     const [clinics, setClinics] = useState([]);
     const [selectedClinicId, setSelectedClinicId] = useState('');
     const [selectedDoctorId, setSelectedDoctorId] = useState('');
-    const [liveQueue, setLiveQueue] = useState([]);
     const [availableSlots, setAvailableSlots] = useState([]);
     const [selectedSlot, setSelectedSlot] = useState('');
     const today = new Date().toISOString().split('T')[0];
@@ -1045,8 +1046,8 @@ const PatientDashboardComponent = ({ loggedInUser, onLogout }) => {
     const ClinicIcon = () => <svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2" strokeLinecap="round" strokeLinejoin="round"><path d="M2.25 21h19.5m-18-18v18m10.5-18v18m6-13.5V21M6.75 6.75h.75m-.75 3h.75m-.75 3h.75m3-6h.75m-.75 3h.75m-.75 3h.75M6.75 21v-3.375c0-.621.504-1.125 1.125-1.125h2.25c.621 0 1.125.504 1.125 1.125V21M3 3h12m0 0v12m0-12L3 15" /></svg>;
     const StatusIcon = () => <svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2" strokeLinecap="round" strokeLinejoin="round"><path d="M9 12.75L11.25 15 15 9.75M21 12a9 9 0 11-18 0 9 9 0 0118 0z" /></svg>;
     
-    const fetchTodaysToken = useCallback(async (silent = false) => { try { const response = await apiClient.get('/tokens/get_my_token/'); setCurrentToken(response.data); } catch (err) { setCurrentToken(null); } }, []);
-    const fetchAllData = useCallback(async () => { try { const [tokenRes, clinicsRes, historyRes] = await Promise.all([ apiClient.get('/tokens/get_my_token/').catch(() => ({ data: null })), apiClient.get('/clinics_with_doctors/'), apiClient.get('/history/my_history/') ]); setCurrentToken(tokenRes.data); setClinics(clinicsRes.data); setHistory(historyRes.data); } catch (err) { setError('Could not load your dashboard data.'); } finally { setLoadingHistory(false); } }, []);
+    const fetchTodaysToken = useCallback(async (silent = false) => { try { const response = await conditionalGet(apiClient, '/tokens/get_my_token/'); setCurrentToken(response.data); } catch (err) { setCurrentToken(null); } }, []);
+    const fetchAllData = useCallback(async () => { try { const [tokenRes, clinicsRes, historyRes] = await Promise.all([ conditionalGet(apiClient, '/tokens/get_my_token/').catch(() => ({ data: null })), apiClient.get('/clinics_with_doctors/'), apiClient.get('/history/my_history/') ]); setCurrentToken(tokenRes.data); setClinics(clinicsRes.data); setHistory(historyRes.data); } catch (err) { setError('Could not load your dashboard data.'); } finally { setLoadingHistory(false); } }, []);
     
     useEffect(() => { 
         fetchAllData(); 
@@ -1061,7 +1062,7 @@ const PatientDashboardComponent = ({ loggedInUser, onLogout }) => {
             if (selectedDoctorId && bookingDate) {
                 try {
                     setError('');
-                    const response = await apiClient.get(`/doctors/${selectedDoctorId}/available-slots/${bookingDate}/`);
+                    const response = await conditionalGet(apiClient, `/doctors/${selectedDoctorId}/available-slots/${bookingDate}/`);
                     setAvailableSlots(response.data);
                 } catch (err) {
                     setError('Could not fetch available slots for the selected date.');
@@ -1074,38 +1075,12 @@ const PatientDashboardComponent = ({ loggedInUser, onLogout }) => {
         fetchSlots();
     }, [selectedDoctorId, bookingDate]);
     
-    useEffect(() => {
-        const fetchLiveQueue = async () => {
-            let doctorId = null;
-            let queueDate = today;
-            
-            // Always show queue if patient has any token or selecting doctor
-            if (currentToken && (currentToken.doctor_id || currentToken.doctor?.id)) {
-                doctorId = currentToken.doctor_id || currentToken.doctor?.id;
-                queueDate = currentToken.date || today;
-            } else if (selectedDoctorId) {
-                doctorId = selectedDoctorId;
-                queueDate = bookingDate;
-            }
-            
-            if (doctorId) {
-                try {
-                    const response = await apiClient.get(`/patient/queue/${doctorId}/${queueDate}`); 
-                    setLiveQueue(Array.isArray(response.data) ? response.data : []);
-                } catch (err) {
-                    console.error("Could not fetch live queue:", err);
-                    setLiveQueue([]); 
-                }
-            } else {
-                setLiveQueue([]); 
-            }
-        };
-        fetchLiveQueue();
-        const queueInterval = setInterval(() => {
-            fetchLiveQueue();
-        }, 3000);
-        return () => clearInterval(queueInterval);
-    }, [currentToken, selectedDoctorId, bookingDate, today]); 
+    // Always show queue if patient has any token or selecting doctor
+    const liveQueueDoctorId = (currentToken && (currentToken.doctor_id || currentToken.doctor?.id)) || selectedDoctorId || null;
+    const liveQueueDate = (currentToken && (currentToken.doctor_id || currentToken.doctor?.id))
+        ? (currentToken.date || today)
+        : bookingDate;
+    const [liveQueue, refreshLiveQueue] = useLiveQueue(apiClient, liveQueueDoctorId, liveQueueDate);
 
     // --- MODIFIED: Wrapped formatTime in useCallback ---
     const formatTime = useCallback((timeStr) => {
@@ -1259,18 +1234,8 @@ const PatientDashboardComponent = ({ loggedInUser, onLogout }) => {
             setCurrentToken(fullToken);
             // --- END OF FIX ---
 
-            // Force refresh live queue immediately
-            setTimeout(() => {
-                const fetchLiveQueue = async () => {
-                    try {
-                        const response = await apiClient.get(`/patient/queue/${selectedDoctorId}/${bookingDate}`); 
-                        setLiveQueue(response.data);
-                    } catch (err) {
-                        console.error("Could not fetch live queue after booking.");
-                    }
-                };
-                fetchLiveQueue();
-            }, 1000);
+            // The queue feed pushes the new token; this only covers the REST fallback
+            refreshLiveQueue();
 
             // Enhanced success message with AI predictions
             let successMsg = 'Appointment booked successfully!';
@@ -1288,7 +1253,7 @@ const PatientDashboardComponent = ({ loggedInUser, onLogout }) => {
             console.error("Booking error:", err.response || err);
             if (selectedDoctorId && bookingDate) {
                 try {
-                    const slotResponse = await apiClient.get(`/doctors/${selectedDoctorId}/available-slots/${bookingDate}/`);
+                    const slotResponse = await conditionalGet(apiClient, `/doctors/${selectedDoctorId}/available-slots/${bookingDate}/`);
                     setAvailableSlots(slotResponse.data);
                 } catch (slotErr) { /* Ignore slot fetch error here */ }
             }
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import axios from 'axios';
 import './PublicHomePage.css'; // Uses the enhanced CSS
+import conditionalGet from './conditionalGet';
 
 // Re-use the apiClient from your App.js
 const apiClient = axios.create({
@@ -53,7 +54,7 @@ const LiveQueueView = ({ doctor, onBack }) => {
         setError(''); 
         try {
             // Use the new URL format with the selected date
-            const response = await apiClient.get(`/patient/queue/${doctor.id}/${selectedDate}/`);
+            const response = await conditionalGet(apiClient, `/patient/queue/${doctor.id}/${selectedDate}/`);
             setQueue(response.data);
         } catch (err) {
             setError(`Could not fetch the queue for ${selectedDate}. Please try again later.`);
@@ -0,0 +1,32 @@
+// Last successful response per URL, kept so a 304 can be answered locally
+const cached = new Map();
+
+/**
+ * GET that revalidates with If-None-Match against the ETag of the last 200
+ * for the same URL. On 304 the previous data object is returned as is, so
+ * React state setters see an unchanged value and skip the re-render.
+ * Resolves to { data, status, notModified }; errors reject like apiClient.get.
+ */
+export default async function conditionalGet(apiClient, url) {
+    const key = apiClient.getUri({ url });
+    const previous = cached.get(key);
+    try {
+        const response = await apiClient.get(url, {
+            headers: previous ? { 'If-None-Match': previous.etag } : {},
+            validateStatus: status => (status >= 200 && status < 300) || status === 304,
+        });
+        if (response.status === 304 && previous) {
+            return { data: previous.data, status: 304, notModified: true };
+        }
+        const etag = response.headers.etag;
+        if (etag) {
+            cached.set(key, { etag, data: response.data });
+        } else {
+            cached.delete(key);
+        }
+        return { data: response.data, status: response.status, notModified: false };
+    } catch (err) {
+        cached.delete(key);
+        throw err;
+    }
+}
@@ -0,0 +1,148 @@
+import { useState, useEffect, useRef, useCallback } from 'react';
+import conditionalGet from './conditionalGet';
+
+const RECONNECT_DELAY_MS = 5000;
+const FALLBACK_POLL_MS = 5000;
+
+// ws://host/ws/queue/... from the REST client's http://host/api/ base URL
+const socketUrl = (apiClient, doctorId, date) => {
+    const base = new URL(apiClient.defaults.baseURL, window.location.href);
+    const protocol = base.protocol === 'https:' ? 'wss:' : 'ws:';
+    return `${protocol}//${base.host}/ws/queue/${doctorId}/${date}/`;
+};
+
+const streamUrl = (apiClient, doctorId, date) =>
+    new URL(`patient/queue/${doctorId}/${date}/stream/`, new URL(apiClient.defaults.baseURL, window.location.href)).href;
+
+const sortByPosition = (rowsById) => Object.values(rowsById).sort((a, b) => a.position - b.position);
+
+/**
+ * Live queue of one doctor for one day over the WebSocket feed.
+ *
+ * The server sends a full `snapshot` on connect and then `delta` messages
+ * ({base_version, version, upserted, removed}). A delta is only applied on
+ * top of the version it was computed from; otherwise we ask for a resync.
+ * Where WebSockets never get through (some proxies), the same messages are
+ * read from the Server-Sent Events stream instead. While neither is
+ * connected the queue is polled over REST.
+ * Returns [queue, refresh].
+ */
+export default function useLiveQueue(apiClient, doctorId, date) {
+    const [queue, setQueue] = useState([]);
+    const socketRef = useRef(null);
+    const stateRef = useRef({ version: null, rows: {} });
+
+    const fetchOverRest = useCallback(async () => {
+        if (!doctorId || !date) return;
+        try {
+            const response = await conditionalGet(apiClient, `/patient/queue/${doctorId}/${date}/`);
+            setQueue(Array.isArray(response.data) ? response.data : []);
+        } catch (err) {
+            console.error('Could not fetch live queue:', err);
+        }
+    }, [apiClient, doctorId, date]);
+
+    const refresh = useCallback(() => {
+        const socket = socketRef.current;
+        if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: 'resync' }));
+        } else {
+            fetchOverRest();
+        }
+    }, [fetchOverRest]);
+
+    useEffect(() => {
+        if (!doctorId || !date) {
+            setQueue([]);
+            return undefined;
+        }
+        let closed = false;
+        let reconnectTimer = null;
+        let pollTimer = null;
+        let source = null;
+
+        const stopPolling = () => {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        };
+        const startPolling = () => {
+            if (pollTimer) return;
+            fetchOverRest();
+            pollTimer = setInterval(fetchOverRest, FALLBACK_POLL_MS);
+        };
+
+        // Applies a snapshot or delta; false when a delta does not follow our version
+        const apply = (message) => {
+            const state = stateRef.current;
+            if (message.type === 'snapshot') {
+                state.rows = Object.fromEntries(message.queue.map(row => [row.id, row]));
+            } else if (message.type === 'delta') {
+                if (message.base_version !== state.version) return false;
+                message.upserted.forEach(row => { state.rows[row.id] = row; });
+                message.removed.forEach(id => { delete state.rows[id]; });
+            } else {
+                return true;
+            }
+            state.version = message.version;
+            setQueue(sortByPosition(state.rows));
+            return true;
+        };
+
+        const openStream = () => {
+            source = new EventSource(streamUrl(apiClient, doctorId, date));
+            source.onopen = stopPolling;
+            const onMessage = (event) => {
+                if (!apply(JSON.parse(event.data))) {
+                    // No way to ask for a resync on this channel: a fresh stream starts with a snapshot
+                    source.close();
+                    openStream();
+                }
+            };
+            source.addEventListener('snapshot', onMessage);
+            source.addEventListener('delta', onMessage);
+            // EventSource reconnects by itself; poll until it does. A 204 (server without
+            // async streaming) closes it for good and we stay on polling.
+            source.onerror = startPolling;
+        };
+
+        const connect = () => {
+            const socket = new WebSocket(socketUrl(apiClient, doctorId, date));
+            socketRef.current = socket;
+            let opened = false;
+
+            socket.onopen = () => {
+                opened = true;
+                stopPolling();
+            };
+            socket.onmessage = (event) => {
+                if (!apply(JSON.parse(event.data))) {
+                    socket.send(JSON.stringify({ type: 'resync' }));
+                }
+            };
+            socket.onclose = () => {
+                if (closed) return;
+                socketRef.current = null;
+                if (!opened) {
+                    // Never got through (e.g. a proxy without WebSocket support): stream over HTTP instead
+                    openStream();
+                    return;
+                }
+                startPolling();
+                reconnectTimer = setTimeout(connect, RECONNECT_DELAY_MS);
+            };
+        };
+
+        stateRef.current = { version: null, rows: {} };
+        connect();
+        return () => {
+            closed = true;
+            clearTimeout(reconnectTimer);
+            stopPolling();
+            if (socketRef.current) socketRef.current.close();
+            socketRef.current = null;
+            if (source) source.close();
+        };
+    }, [apiClient, doctorId, date, fetchOverRest]);
+
+    return [queue, refresh];
+}